@@ -0,0 +1,147 @@
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import SchedulerBusy
+
+
+class PendingQuery:
+    """
+    A single getSimilarTopics call waiting for its batch to be processed.
+    """
+
+    def __init__(self, query, userID):
+        self.query = query
+        self.userID = userID
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class QueryBatcher:
+    """
+    Coalesces concurrent getSimilarTopics calls into batches.
+
+    Queries that arrive within `maxWaitMs` of the first one in a batch are embedded with a
+    single embedding request and searched with a single multi-row index search; each caller
+    blocks until its own row of the result is ready. Queries whose result is already cached
+    are answered straight away without joining a batch. Up to `maxInFlight` batches are
+    processed at once, so a slow embedding call does not hold up the queries behind it; while
+    all of them are busy, new queries gather into the next batch.
+
+    Attributes:
+        matcher (TopicMatcher): The matcher that embeds and searches each batch.
+        maxBatchSize (int): Largest number of queries processed together.
+        maxWait (float): Longest time, in seconds, a batch waits for more queries after its first.
+        timeout (float): Longest time, in seconds, a caller waits for its result.
+        numBatches (int): Number of batches processed so far.
+        numQueries (int): Number of queries processed in batches so far.
+        numCached (int): Number of queries answered from the result cache without batching.
+    """
+
+    def __init__(self, matcher, maxBatchSize=32, maxWaitMs=5, maxInFlight=4, maxQueued=1024, timeoutMs=10000):
+        """
+        The constructor for QueryBatcher class.
+
+        Parameters:
+           matcher (TopicMatcher): The matcher that embeds and searches each batch.
+           maxBatchSize (int): Largest number of queries processed together. Default is 32.
+           maxWaitMs (float): Longest time a batch waits for more queries, in milliseconds. Default is 5.
+           maxInFlight (int): Most batches processed at once. Default is 4.
+           maxQueued (int): Most queries waiting for a batch before new ones raise SchedulerBusy. Default is 1024.
+           timeoutMs (float): Longest time a caller waits for its result, in milliseconds. Default is 10000.
+        """
+        self.matcher = matcher
+        self.maxBatchSize = maxBatchSize
+        self.maxWait = maxWaitMs / 1000
+        self.timeout = timeoutMs / 1000
+        self.numBatches = 0
+        self.numQueries = 0
+        self.numCached = 0
+        self.statsLock = threading.Lock()
+        self.pending = queue.Queue(maxQueued)
+        self.slots = threading.Semaphore(maxInFlight)
+        self.pool = ThreadPoolExecutor(max_workers=maxInFlight, thread_name_prefix='query-batch')
+        self.worker = threading.Thread(target=self.run, name='query-batcher', daemon=True)
+        self.worker.start()
+
+    def getSimilarTopics(self, query, userID):
+        """
+        Retrieves the most similar topics to the provided query, sharing work with concurrent callers.
+
+        Parameters:
+           query (str): The query to find similar topics for.
+           userID (str): The ID of the user making the query.
+
+        Returns:
+           list: A list of dictionaries, each containing the topic name, topic ID, and user ID for a similar topic.
+        """
+        # alternate queries need their own LLM calls per query, so there is nothing to share
+        if self.matcher.useAlternates:
+            return self.matcher.getSimilarTopics(query, userID)
+        cached = self.matcher.cachedSimilarTopics(query, userID)
+        if cached is not None:
+            with self.statsLock:
+                self.numCached += 1
+            return cached
+
+        request = PendingQuery(query, userID)
+        try:
+            self.pending.put_nowait(request)
+        except queue.Full:
+            raise SchedulerBusy("Too many queued match requests")
+        if not request.done.wait(self.timeout):
+            raise TimeoutError(f"No match result within {self.timeout:.1f}s")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def collectBatch(self):
+        batch = [self.pending.get()]
+        deadline = time.monotonic() + self.maxWait
+        while len(batch) < self.maxBatchSize:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            # wait for a free slot before collecting, so queries pile into the next batch meanwhile
+            self.slots.acquire()
+            self.pool.submit(self.process, self.collectBatch())
+
+    def process(self, batch):
+        try:
+            # the callers checked the result cache just before queueing
+            results = self.matcher.getSimilarTopicsBatch(
+                [request.query for request in batch], [request.userID for request in batch], checkCache=False)
+            for request, result in zip(batch, results):
+                request.result = result
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            self.slots.release()
+        with self.statsLock:
+            self.numBatches += 1
+            self.numQueries += len(batch)
+        for request in batch:
+            request.done.set()
+
+    def stats(self):
+        """
+        Returns the number of batches and queries processed, the mean batch size and the queue depth.
+        """
+        return {
+            'batches': self.numBatches,
+            'queries': self.numQueries,
+            'cached': self.numCached,
+            'queueDepth': self.pending.qsize(),
+            'meanBatchSize': self.numQueries / self.numBatches if self.numBatches else 0.0,
+        }
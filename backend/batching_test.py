@@ -0,0 +1,101 @@
+import time
+import threading
+
+import numpy as np
+import pytest
+from langchain.llms.fake import FakeListLLM
+
+from matching import TopicMatcher
+from batching import QueryBatcher
+from scheduler import SchedulerBusy
+
+
+def test_concurrent_queries_share_one_embedding_call(fakeEmbeddingAPI):
+    calls = []
+
+    def fakeEmbeddings(texts, engine):
+        calls.append(list(texts))
+        # queries are offset from the topics so no two topics tie for a match
+        return [np.full(8, len(text) + 0.3 * text.startswith('q'), dtype='float32') for text in texts]
+
+    fakeEmbeddingAPI(fakeEmbeddings)
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2)
+    matcher.addTopics([(i, f"user-{i % 3}", "x" * i) for i in range(1, 30)])
+    calls.clear()
+
+    batcher = QueryBatcher(matcher, maxBatchSize=64, maxWaitMs=200)
+    queries = [("q" * (5 + i % 10), f"user-{i % 3}") for i in range(40)]
+    results = [None] * len(queries)
+    barrier = threading.Barrier(len(queries))
+
+    def ask(i):
+        barrier.wait()
+        results[i] = batcher.getSimilarTopics(*queries[i])
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(len(queries))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert batcher.stats()['batches'] < len(queries)
+    assert len(calls) == batcher.stats()['batches']
+    assert sum(len(call) for call in calls) <= 10 * len(calls) # duplicate queries embedded once per batch
+    for (query, userID), result in zip(queries, results):
+        assert result == matcher.getSimilarTopics(query, userID)
+
+
+def makeBlockingMatcher(fakeEmbeddingAPI, release):
+    def fakeEmbeddings(texts, engine):
+        if any(text.startswith('slow') for text in texts):
+            release.wait(5)
+        return [np.full(8, len(text), dtype='float32') for text in texts]
+
+    fakeEmbeddingAPI(fakeEmbeddings)
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2)
+    matcher.addTopics([(i, f"user-{i % 3}", "x" * i) for i in range(1, 10)])
+    return matcher
+
+
+def test_cached_and_other_queries_do_not_wait_behind_a_slow_batch(fakeEmbeddingAPI):
+    release = threading.Event()
+    matcher = makeBlockingMatcher(fakeEmbeddingAPI, release)
+    cached = matcher.getSimilarTopics("cached query", 'user-0')
+    batcher = QueryBatcher(matcher, maxWaitMs=1, maxInFlight=2)
+
+    slow = threading.Thread(target=batcher.getSimilarTopics, args=("slow query", 'user-1'))
+    slow.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    assert batcher.getSimilarTopics(" cached  query", 'user-0') == cached
+    assert len(batcher.getSimilarTopics("another query", 'user-2')) == 2
+    assert time.monotonic() - start < 1 and slow.is_alive()
+    assert batcher.stats()['cached'] == 1
+
+    release.set()
+    slow.join(5)
+    assert batcher.stats()['batches'] == 2
+
+
+def test_full_queue_and_slow_batches_fail_fast(fakeEmbeddingAPI):
+    release = threading.Event()
+    batcher = QueryBatcher(makeBlockingMatcher(fakeEmbeddingAPI, release), maxWaitMs=1, maxInFlight=1,
+                           maxQueued=1, timeoutMs=200)
+    errors = []
+
+    def ask(query):
+        try:
+            batcher.getSimilarTopics(query, 'user-0')
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=ask, args=(f"slow query {i}",)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.05) # the first is in flight, the second waits in the queue
+
+    with pytest.raises(SchedulerBusy):
+        batcher.getSimilarTopics("one too many", 'user-0')
+    for thread in threads:
+        thread.join(2)
+    assert [type(error) for error in errors] == [TimeoutError, TimeoutError]
+    release.set()
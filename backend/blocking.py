@@ -0,0 +1,73 @@
+import functools
+import contextvars
+
+
+class BlockingPool:
+    """
+    Runs blocking work off the socket event loop when serving with gevent.
+
+    Under gevent, request handlers and socket events share one OS thread, so a call that
+    blocks it (waiting on the match batcher or the request scheduler, FAISS searches,
+    CPU embedding) stalls every connection. run() hands such calls to a pool of native
+    threads and yields until they finish. The app's own background threads are real
+    threads (the server patches everything but threading), so code running on them must
+    go through threadsafe() to touch Socket.IO.
+
+    In the default threaded server both are pass-throughs. A size of 0 runs blocking
+    calls inline under gevent too, which is only useful for comparison (see load_benchmark.py).
+
+    Attributes:
+        mode (str): The server's async mode: 'threading' or 'gevent'.
+        size (int): Number of native threads for blocking work.
+    """
+
+    def __init__(self, mode='threading', size=16):
+        """
+        The constructor for BlockingPool class.
+
+        Parameters:
+           mode (str): The server's async mode: 'threading' or 'gevent'. Default is 'threading'.
+           size (int): Number of native threads for blocking work. Default is 16.
+        """
+        self.mode = mode
+        self.size = size
+        self.pool = None
+        self.hub = None
+        if mode == 'gevent':
+            import gevent
+            from gevent.threadpool import ThreadPool
+            self.spawn = gevent.spawn
+            self.hub = gevent.get_hub()
+            if size > 0:
+                self.pool = ThreadPool(size)
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Calls fn(*args, **kwargs) on a native thread and returns its result.
+
+        The call runs in a copy of the caller's context variables, so it sees the same Flask
+        app and request contexts as the greenlet that made it.
+        """
+        if self.pool is None:
+            return fn(*args, **kwargs)
+        context = contextvars.copy_context()
+        return self.pool.apply(context.run, (fn,) + args, kwargs)
+
+    def threadsafe(self, fn):
+        """
+        Wraps fn so that calls from any thread run it on the event loop (fire and forget).
+        """
+        if self.hub is None:
+            return fn
+
+        @functools.wraps(fn)
+        def call(*args, **kwargs):
+            self.hub.loop.run_callback_threadsafe(self.spawn, functools.partial(fn, *args, **kwargs))
+        return call
+
+    def stats(self):
+        return {
+            'mode': self.mode,
+            'size': self.size,
+            'busy': len(self.pool) if self.pool is not None else 0,
+        }
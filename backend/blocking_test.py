@@ -0,0 +1,38 @@
+import threading
+
+import flask
+import pytest
+
+from blocking import BlockingPool
+
+
+def test_threading_mode_runs_inline():
+    pool = BlockingPool('threading')
+    assert pool.run(threading.get_ident) == threading.get_ident()
+    assert pool.threadsafe(print) is print
+
+
+def test_gevent_mode_offloads_and_marshals_back():
+    gevent = pytest.importorskip('gevent')
+    pool = BlockingPool('gevent', size=2)
+
+    # the loop keeps running other greenlets while a blocking call is out on a native thread
+    ticks = []
+    ticker = gevent.spawn(lambda: [ticks.append(gevent.sleep(0.01)) for _ in range(10)])
+    assert pool.run(lambda: threading.Event().wait(0.2) or threading.get_ident()) != threading.get_ident()
+    assert len(ticks) >= 5
+    ticker.join()
+
+    # and sees the caller's app context, as handlers that touch the database need
+    app = flask.Flask(__name__)
+    with app.app_context():
+        assert pool.run(lambda: flask.current_app.name) == app.name
+
+    # calls from other threads land back on the loop's thread
+    seen = []
+    emit = pool.threadsafe(lambda event, room=None: seen.append((event, room, threading.get_ident())))
+    thread = threading.Thread(target=emit, args=('segway-token',), kwargs={'room': 'userID_u1'})
+    thread.start()
+    thread.join()
+    gevent.sleep(0.05)
+    assert seen == [('segway-token', 'userID_u1', threading.get_ident())]
@@ -0,0 +1,36 @@
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import config
+from main import ChatApplication
+
+
+@pytest.fixture
+def chatApp(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'DATA_DIR', str(tmp_path))
+    chatApp = ChatApplication()
+    with chatApp.app.app_context():
+        chatApp.db.create_all()
+        for userID in ('u1', 'u2'):
+            chatApp.db.session.add(chatApp.User(id=userID))
+        chatApp.db.session.add(chatApp.Topic(id=1, userID='u1', title="first"))
+        chatApp.db.session.add(chatApp.Topic(id=2, userID='u2', title="second"))
+        chatApp.db.session.add(chatApp.ChatMetadata(id=1, creatorTopicID=1, matchedTopicID=2,
+                                                    userCreatorID='u1', userMatchedID='u2'))
+        chatApp.db.session.commit()
+    return chatApp
+
+
+@pytest.fixture
+def fakeEmbeddingAPI(monkeypatch):
+    """
+    Returns a function that replaces the OpenAI embeddings endpoint with embed(texts, engine).
+    """
+    def install(embed):
+        def create(input, engine, **kwargs):
+            vectors = embed(input, engine)
+            return SimpleNamespace(data=[{'index': i, 'embedding': vector} for i, vector in enumerate(vectors)])
+        monkeypatch.setattr(openai.Embedding, 'create', staticmethod(create))
+    return install
@@ -21,7 +21,7 @@ def setupModels(db):
         __tablename__ = 'topics'
 
         id = db.Column(db.Integer, primary_key=True)
-        userID = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+        userID = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, index=True)
         title = db.Column(db.String(512), nullable=False)
 
         user = db.relationship('User', backref=db.backref('topics', lazy=True))
@@ -31,17 +31,22 @@ def setupModels(db):
         __tablename__ = 'chatmetadata'
 
         id = db.Column(db.Integer, primary_key=True)  # changed from chat_id to id
-        creatorTopicID = db.Column(db.Integer, db.ForeignKey('topics.id'), nullable=False)
-        matchedTopicID = db.Column(db.Integer, db.ForeignKey('topics.id'), nullable=False)
-        userCreatorID = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
-        userMatchedID = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+        creatorTopicID = db.Column(db.Integer, db.ForeignKey('topics.id'), nullable=False, index=True)
+        matchedTopicID = db.Column(db.Integer, db.ForeignKey('topics.id'), nullable=False, index=True)
+        userCreatorID = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, index=True)
+        userMatchedID = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, index=True)
         creatorLastViewedAt = db.Column(db.DateTime, nullable=True)
         matchedLastViewedAt = db.Column(db.DateTime, nullable=True)
+        # the last message number each side had seen when it last viewed the chat
+        creatorLastReadNumber = db.Column(db.Integer, nullable=True)
+        matchedLastReadNumber = db.Column(db.Integer, nullable=True)
         lastMessageTimestamp = db.Column(db.DateTime, nullable=True)
 
 
     class ChatMessage(db.Model):
         __tablename__ = 'chat'
+        # also serves every lookup by chatID alone
+        __table_args__ = (db.UniqueConstraint('chatID', 'messageNumber', name='uq_chat_message_number'),)
 
         id = db.Column(db.Integer, primary_key=True)  # changed from chat_id to id
         chatID = db.Column(db.Integer, db.ForeignKey('chatmetadata.id'), nullable=False)
@@ -53,4 +58,26 @@ def setupModels(db):
 
         chatmetadata = db.relationship('ChatMetadata', backref=db.backref('chats', lazy=True))
 
-    return User, Topic, ChatMetadata, ChatMessage
+
+    class Counter(db.Model):
+        __tablename__ = 'counters'
+
+        # the last value handed out by IDAllocator, e.g. for 'user' or 'chat-<chatID>'
+        name = db.Column(db.String(64), primary_key=True)
+        value = db.Column(db.Integer, nullable=False)
+
+
+    class TopicChange(db.Model):
+        __tablename__ = 'topic_changes'
+
+        # one row per topic add/update/remove, replayed by every other worker's TopicSync
+        id = db.Column(db.Integer, primary_key=True)
+        op = db.Column(db.String(8), nullable=False)
+        topicID = db.Column(db.Integer, nullable=False)
+        userID = db.Column(db.String(36), nullable=True)
+        title = db.Column(db.String(512), nullable=True)
+        embedding = db.Column(db.LargeBinary, nullable=True)
+        workerID = db.Column(db.String(36), nullable=False)
+        createdAt = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+
+    return User, Topic, ChatMetadata, ChatMessage, Counter, TopicChange
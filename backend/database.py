@@ -0,0 +1,60 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+import config
+
+
+def databaseURI(dataDir):
+    """
+    Returns the configured database URL, or a SQLite file in the data directory.
+    """
+    return config.DATABASE_URL or 'sqlite:///' + os.path.join(dataDir, 'test.db')
+
+
+def engineOptions(uri):
+    """
+    Returns the create_engine() options for a database URL: pool sizing for anything with
+    a connection pool, plus recycling and pre-ping for server backends.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {} # in-memory databases use a single shared connection
+        return {'pool_size': config.DB_POOL_SIZE, 'max_overflow': config.DB_MAX_OVERFLOW,
+                'pool_timeout': config.DB_POOL_TIMEOUT}
+    return {
+        'pool_size': config.DB_POOL_SIZE,
+        'max_overflow': config.DB_MAX_OVERFLOW,
+        'pool_timeout': config.DB_POOL_TIMEOUT,
+        # servers and proxies drop idle connections; replace them before they fail a request
+        'pool_recycle': config.DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+def sqlitePragmas():
+    pragmas = {
+        'journal_mode': config.SQLITE_JOURNAL_MODE,
+        'synchronous': config.SQLITE_SYNCHRONOUS,
+        'busy_timeout': config.SQLITE_BUSY_TIMEOUT_MS,
+        'mmap_size': config.SQLITE_MMAP_SIZE,
+    }
+    return {name: value for name, value in pragmas.items() if value not in (None, '')}
+
+
+def configureEngine(engine):
+    """
+    Sets the configured pragmas on every new connection of a SQLite engine; other backends are left alone.
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlitePragmas()
+
+    @event.listens_for(engine, 'connect')
+    def setPragmas(dbapiConnection, connectionRecord):
+        cursor = dbapiConnection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
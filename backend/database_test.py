@@ -0,0 +1,19 @@
+from sqlalchemy import text
+
+from database import engineOptions
+
+
+def test_sqlite_connections_get_the_configured_pragmas(chatApp):
+    with chatApp.app.app_context():
+        with chatApp.db.engine.connect() as connection:
+            assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert connection.execute(text('PRAGMA synchronous')).scalar() == 1 # NORMAL
+            assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+            assert connection.execute(text('PRAGMA mmap_size')).scalar() == 256 * 1024 * 1024
+
+
+def test_server_backends_get_a_checked_pool():
+    options = engineOptions('postgresql+psycopg2://chatmos@localhost/chatmos')
+    assert options['pool_pre_ping'] and options['pool_size'] == 20
+    assert 'pool_pre_ping' not in engineOptions('sqlite:////tmp/chatmos.db')
+    assert engineOptions('sqlite://') == {}
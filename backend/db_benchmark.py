@@ -0,0 +1,149 @@
+"""
+Compares database profiles under a mixed chat workload.
+
+Writer threads commit one message at a time the way the synchronous message path
+does (insert the message, update the chat's metadata, commit), while reader threads
+fetch chat history pages the way /chats/<chatID> does. For each profile this reports
+read p50/p99 latency, reads and writes per second, and how many operations failed
+(e.g. "database is locked").
+
+Profiles:
+    rollback    SQLite's own defaults: rollback journal, synchronous=FULL, no mmap
+    wal         the configured SQLite profile (WAL, synchronous=NORMAL, mmap, busy timeout)
+    server      the database at --url, with the configured connection pool
+
+Usage:
+    python db_benchmark.py --seconds 10 --writers 2 --readers 2
+    python db_benchmark.py --url postgresql+psycopg2://chatmos@localhost/chatmos_bench
+
+The server database must be a scratch one: the benchmark creates its tables and drops them afterwards.
+Every thread shares one interpreter, so with many threads the read tail measures GIL
+scheduling more than the database; a few of each keeps the comparison about locking.
+"""
+import time
+import random
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import insert, select, update
+
+import config
+
+PROFILES = {
+    'rollback': {'SQLITE_JOURNAL_MODE': 'delete', 'SQLITE_SYNCHRONOUS': 'full', 'SQLITE_MMAP_SIZE': 0},
+    'wal': {},
+}
+
+
+def makeApp(dataDir, numChats, messagesPerChat):
+    from main import ChatApplication
+    config.DATA_DIR = dataDir
+    chatApp = ChatApplication()
+    start = datetime(2023, 1, 1)
+    with chatApp.app.app_context():
+        db = chatApp.db
+        db.session.execute(insert(chatApp.User), [{'id': 'u1'}, {'id': 'u2'}])
+        db.session.execute(insert(chatApp.Topic), [{'id': 1, 'userID': 'u1', 'title': "first"},
+                                                   {'id': 2, 'userID': 'u2', 'title': "second"}])
+        db.session.execute(insert(chatApp.ChatMetadata), [
+            {'id': i, 'creatorTopicID': 1, 'matchedTopicID': 2, 'userCreatorID': 'u1', 'userMatchedID': 'u2'}
+            for i in range(1, numChats + 1)])
+        db.session.execute(insert(chatApp.ChatMessage), [
+            {'chatID': 1 + i // messagesPerChat, 'messageNumber': i % messagesPerChat, 'senderID': 'u1',
+             'text': f"message {i}", 'timestamp': start + timedelta(seconds=i)}
+            for i in range(numChats * messagesPerChat)])
+        db.session.commit()
+    return chatApp
+
+
+def writer(chatApp, numChats, stopped, counters, writerID):
+    ChatMessage, ChatMetadata = chatApp.ChatMessage.__table__, chatApp.ChatMetadata.__table__
+    rng = random.Random(writerID)
+    # numbers from a range of their own, so writers never collide on (chatID, messageNumber)
+    messageNumber = 1_000_000 * (writerID + 1)
+    with chatApp.app.app_context():
+        while not stopped.is_set():
+            chatID = rng.randint(1, numChats)
+            timestamp = datetime.now(timezone.utc)
+            try:
+                with chatApp.db.engine.begin() as connection:
+                    connection.execute(insert(ChatMessage).values(
+                        chatID=chatID, messageNumber=messageNumber, senderID='u1', text="hello", timestamp=timestamp))
+                    connection.execute(update(ChatMetadata).where(ChatMetadata.c.id == chatID).values(
+                        lastMessageTimestamp=timestamp, creatorLastViewedAt=timestamp))
+                counters['writes'] += 1
+            except Exception:
+                counters['writeErrors'] += 1
+            messageNumber += 1
+
+
+def reader(chatApp, numChats, stopped, counters, latencies, readerID):
+    ChatMessage = chatApp.ChatMessage.__table__
+    rng = random.Random(-1 - readerID)
+    with chatApp.app.app_context():
+        while not stopped.is_set():
+            chatID = rng.randint(1, numChats)
+            start = time.perf_counter()
+            try:
+                with chatApp.db.engine.connect() as connection:
+                    connection.execute(select(ChatMessage).where(ChatMessage.c.chatID == chatID)
+                                       .order_by(ChatMessage.c.messageNumber.desc()).limit(config.CHAT_PAGE_SIZE)).all()
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                counters['readErrors'] += 1
+
+
+def run(chatApp, args):
+    counters = {'writes': 0, 'writeErrors': 0, 'readErrors': 0}
+    latencies = []
+    stopped = threading.Event()
+    threads = [threading.Thread(target=writer, args=(chatApp, args.chats, stopped, counters, i)) for i in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(chatApp, args.chats, stopped, counters, latencies, i))
+                for i in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stopped.set()
+    for thread in threads:
+        thread.join()
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000 if latencies else (float('nan'), float('nan'))
+    return p50, p99, len(latencies) / args.seconds, counters['writes'] / args.seconds, counters['readErrors'] + counters['writeErrors']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--readers', type=int, default=2)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--messages-per-chat', type=int, default=200)
+    parser.add_argument('--url', help="a scratch server database to compare against")
+    args = parser.parse_args()
+    config.DB_POOL_SIZE = max(config.DB_POOL_SIZE, args.writers + args.readers)
+
+    profiles = list(PROFILES) + (['server'] if args.url else [])
+    print(f"{args.writers} writers and {args.readers} readers for {args.seconds:g} s over {args.chats} chats")
+    print(f"{'profile':>10} {'read p50':>9} {'read p99':>9} {'reads/s':>9} {'writes/s':>9} {'errors':>7}")
+    for profile in profiles:
+        defaults = {name: getattr(config, name) for name in ('SQLITE_JOURNAL_MODE', 'SQLITE_SYNCHRONOUS', 'SQLITE_MMAP_SIZE')}
+        for name, value in PROFILES.get(profile, {}).items():
+            setattr(config, name, value)
+        config.DATABASE_URL = args.url if profile == 'server' else ''
+        with tempfile.TemporaryDirectory() as dataDir:
+            chatApp = makeApp(dataDir, args.chats, args.messages_per_chat)
+            p50, p99, reads, writes, errors = run(chatApp, args)
+            chatApp.readReceipts.close()
+            with chatApp.app.app_context():
+                if profile == 'server':
+                    chatApp.db.drop_all()
+                chatApp.db.engine.dispose()
+        for name, value in defaults.items():
+            setattr(config, name, value)
+        print(f"{profile:>10} {p50:>9.2f} {p99:>9.2f} {reads:>9.0f} {writes:>9.0f} {errors:>7}")
+
+
+if __name__ == '__main__':
+    main()
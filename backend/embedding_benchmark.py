@@ -0,0 +1,137 @@
+"""
+Compares the local hashing embedder with the remote OpenAI provider.
+
+The remote provider talks to a local stub of the embeddings endpoint that answers
+after a configurable delay, so the comparison covers the real client, serialization
+and HTTP round-trip without calling the API. For each provider this reports p50/p99
+latency for single-query embeddings (the /bot-response hot path) and throughput for
+batched topic embeddings.
+
+Usage:
+    python embedding_benchmark.py --latency-ms 150 --queries 200 --topics 20000
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import openai
+
+from embeddings import OpenAIEmbeddingProvider, HashingEmbeddingProvider
+
+
+def startStubServer(latency, dim, completionLatency=0, tokenDelay=0, numTokens=20):
+    """
+    Serves POST /v1/embeddings with random vectors after `latency` seconds, and POST
+    /v1/completions with a canned `numTokens`-word text after `completionLatency` seconds;
+    streamed completions then send one word every `tokenDelay` seconds.
+    """
+    words = ["Both", "of", "you", "seem", "curious", "about", "how", "things", "work,", "so", "why", "not",
+             "start", "by", "trading", "the", "one", "tip", "you", "wish", "someone", "had", "told", "you", "sooner."]
+    text = ' '.join(words[i % len(words)] for i in range(numTokens))
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            if self.path.endswith('/completions'):
+                return self.complete(body)
+            texts = body['input'] if isinstance(body['input'], list) else [body['input']]
+            time.sleep(latency)
+            vectors = np.random.default_rng(len(texts)).standard_normal((len(texts), dim)).round(6)
+            self.sendJSON({
+                'object': 'list',
+                'model': body.get('model', body.get('engine')),
+                'data': [{'object': 'embedding', 'index': i, 'embedding': vector.tolist()} for i, vector in enumerate(vectors)],
+                'usage': {'prompt_tokens': 0, 'total_tokens': 0},
+            })
+
+        def complete(self, body):
+            prompts = body['prompt'] if isinstance(body['prompt'], list) else [body['prompt']]
+            time.sleep(completionLatency)
+            def completion(choices):
+                return {'id': 'stub', 'object': 'text_completion', 'created': int(time.time()),
+                        'model': body.get('model'), 'choices': choices}
+            if not body.get('stream'):
+                response = completion([{'text': text, 'index': i, 'logprobs': None, 'finish_reason': 'stop'}
+                                       for i in range(len(prompts))])
+                response['usage'] = {'prompt_tokens': 0, 'completion_tokens': numTokens, 'total_tokens': numTokens}
+                return self.sendJSON(response)
+
+            # server-sent events, closed by the end of the response
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            for i, token in enumerate(text.split(' ')):
+                if i:
+                    time.sleep(tokenDelay)
+                chunk = completion([{'text': token if i == 0 else ' ' + token, 'index': 0, 'logprobs': None,
+                                     'finish_reason': None}])
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+
+        def sendJSON(self, response):
+            payload = json.dumps(response).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def syntheticTitles(num, rng):
+    words = ["learning", "music", "startup", "travel", "cooking", "running", "history", "physics",
+             "painting", "language", "career", "parenting", "gardening", "chess", "film", "poetry"]
+    return [' '.join(rng.choice(words, size=rng.integers(3, 9))) + f" {i}" for i in range(num)]
+
+
+def benchmark(embedder, queries, topics):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        embedder.embed([query])
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    embedder.embed(topics)
+    throughput = len(topics) / (time.perf_counter() - start)
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return p50, p99, throughput
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=150, help="stub round-trip delay per request")
+    parser.add_argument('--dim', type=int, default=1536, help="dimensionality returned by the stub")
+    parser.add_argument('--local-dim', type=int, default=512)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--topics', type=int, default=20000)
+    args = parser.parse_args()
+
+    server = startStubServer(args.latency_ms / 1000, args.dim)
+    openai.api_base = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    openai.api_key = 'stub'
+
+    rng = np.random.default_rng(0)
+    queries = syntheticTitles(args.queries, rng)
+    topics = syntheticTitles(args.topics, rng)
+
+    print(f"{args.queries} single queries, {args.topics} topics in one batch, stub latency {args.latency_ms:g} ms")
+    print(f"{'provider':>32} {'p50 ms':>8} {'p99 ms':>8} {'topics/s':>10}")
+    for embedder in [OpenAIEmbeddingProvider(), HashingEmbeddingProvider(args.local_dim)]:
+        p50, p99, throughput = benchmark(embedder, queries, topics)
+        name = f"{type(embedder).__name__[:-len('EmbeddingProvider')].lower()} ({embedder.name})"
+        print(f"{name:>32} {p50:>8.3f} {p99:>8.3f} {throughput:>10.0f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import os
+import json
+import hashlib
+import threading
+
+import numpy as np
+
+
+def normalizeText(text):
+    """
+    Normalizes text before hashing so that whitespace differences map to the same cache entry.
+    """
+    return " ".join(text.split())
+
+
+class EmbeddingCache:
+    """
+    A persistent, content-addressed cache of text embeddings.
+
+    Vectors are appended to a flat float32 file that is memory-mapped on load, and a
+    parallel key file stores one hash per row, so a warm restart needs no embedding calls.
+    The meta file recording the dimension is written only after the first rows are, so a
+    cache with meta.json always has its data files, and data files without it are discarded.
+
+    Attributes:
+        engine (str): The name of the embedding engine the cached vectors came from.
+        cacheDir (str): The directory holding the cache files for this engine.
+        dim (int): The dimensionality of the cached vectors, or None if the cache is empty.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that had to be embedded.
+    """
+
+    def __init__(self, cacheDir, engine):
+        """
+        The constructor for EmbeddingCache class.
+
+        Parameters:
+           cacheDir (str): The root directory for embedding caches.
+           engine (str): The name of the embedding engine.
+        """
+        self.engine = engine
+        self.cacheDir = os.path.join(cacheDir, engine.replace('/', '_'))
+        self.metaPath = os.path.join(self.cacheDir, 'meta.json')
+        self.keyPath = os.path.join(self.cacheDir, 'keys.txt')
+        self.vectorPath = os.path.join(self.cacheDir, 'vectors.f32')
+        self.lock = threading.Lock()
+        self.dim = None
+        self.rows = {}
+        self.vectors = None
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cacheDir, exist_ok=True)
+        self.load()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def key(self, text):
+        """
+        Returns the content hash used to address the embedding of the given text.
+        """
+        return hashlib.sha1(f"{self.engine}\n{normalizeText(text)}".encode('utf-8')).hexdigest()
+
+    def load(self):
+        """
+        Loads the key index and memory-maps the vector file.
+        """
+        if not os.path.exists(self.metaPath):
+            # rows from a first write that crashed before the meta file have no known dimension
+            for path in (self.vectorPath, self.keyPath):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+        with open(self.metaPath, 'r') as f:
+            self.dim = json.load(f)['dim']
+        keys = []
+        if os.path.exists(self.keyPath):
+            with open(self.keyPath, 'r') as f:
+                keys = f.read().split()
+        if not os.path.exists(self.vectorPath):
+            open(self.vectorPath, 'wb').close()
+
+        # a crash between the vector and key writes can leave one side longer; trust the shorter,
+        # and cut the other back so the next append lines up again
+        numRows = min(len(keys), os.path.getsize(self.vectorPath) // (4 * self.dim))
+        if os.path.getsize(self.vectorPath) != numRows * 4 * self.dim:
+            os.truncate(self.vectorPath, numRows * 4 * self.dim)
+        if len(keys) != numRows:
+            with open(self.keyPath, 'w') as f:
+                f.write("".join(f"{key}\n" for key in keys[:numRows]))
+        self.rows = {key: row for row, key in enumerate(keys[:numRows])}
+        self.mapVectors()
+        print(f"Loaded {numRows} cached embeddings for {self.engine}")
+
+    def mapVectors(self):
+        numRows = os.path.getsize(self.vectorPath) // (4 * self.dim)
+        if numRows == 0:
+            self.vectors = np.empty((0, self.dim), dtype='float32')
+            return
+        self.vectors = np.memmap(self.vectorPath, dtype='float32', mode='r', shape=(numRows, self.dim))
+
+    def lookup(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        if self.vectors is None or row >= len(self.vectors):
+            self.mapVectors()
+        return np.array(self.vectors[row])
+
+    def get(self, text):
+        """
+        Returns the cached embedding for the given text, or None on a miss.
+        """
+        with self.lock:
+            vector = self.lookup(self.key(text))
+            if vector is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return vector
+
+    def put(self, text, embedding):
+        """
+        Appends the embedding for the given text to the cache.
+        """
+        self.putMany([text], [embedding])
+
+    def putMany(self, texts, embeddings):
+        """
+        Appends a batch of embeddings to the cache with a single write per file.
+        """
+        embeddings = np.asarray(embeddings, dtype='float32').reshape(len(texts), -1)
+        with self.lock:
+            if self.dim is None:
+                self.dim = embeddings.shape[1]
+            assert embeddings.shape[1] == self.dim, f"Expected dimension {self.dim}, got {embeddings.shape[1]}"
+
+            newKeys, newRows = {}, []
+            for text, embedding in zip(texts, embeddings):
+                key = self.key(text)
+                if key in self.rows or key in newKeys:
+                    continue
+                newKeys[key] = None
+                newRows.append(embedding)
+            if not newKeys:
+                return
+
+            with open(self.vectorPath, 'ab') as f:
+                f.write(np.ascontiguousarray(newRows, dtype='float32').tobytes())
+            with open(self.keyPath, 'a') as f:
+                f.write("".join(f"{key}\n" for key in newKeys))
+            if not self.rows:
+                self.writeMeta()
+            for key in newKeys:
+                self.rows[key] = len(self.rows)
+
+    def writeMeta(self):
+        # written to the side and renamed into place, so a reader never sees half of it
+        tmpPath = self.metaPath + '.tmp'
+        with open(tmpPath, 'w') as f:
+            json.dump({'engine': self.engine, 'dim': self.dim}, f)
+        os.replace(tmpPath, self.metaPath)
+
+    def getMany(self, texts, embedFn):
+        """
+        Returns embeddings for every text, computing and caching only the misses.
+
+        Parameters:
+           texts (list): The texts to embed.
+           embedFn (callable): Called once with the list of uncached texts, returns their embeddings.
+
+        Returns:
+           np.array: A float32 matrix with one row per text.
+        """
+        results = [None] * len(texts)
+        missing = []
+        with self.lock:
+            for i, text in enumerate(texts):
+                results[i] = self.lookup(self.key(text))
+                if results[i] is None:
+                    missing.append(i)
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            missingTexts = [texts[i] for i in missing]
+            computed = embedFn(missingTexts)
+            self.putMany(missingTexts, computed)
+            for i, embedding in zip(missing, computed):
+                results[i] = np.asarray(embedding, dtype='float32')
+
+        if not results:
+            return np.empty((0, self.dim or 0), dtype='float32')
+        return np.vstack(results).astype('float32')
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and the number of cached embeddings.
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / total if total else 0.0,
+            'size': len(self.rows),
+        }
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache, normalizeText
+
+
+DIM = 8
+
+
+def fakeEmbed(calls):
+    def embed(texts):
+        calls.append(list(texts))
+        return [np.full(DIM, len(normalizeText(text)), dtype='float32') for text in texts]
+    return embed
+
+
+def test_cache_counts_hits_and_misses_and_survives_reopening(tmp_path):
+    calls = []
+    cache = EmbeddingCache(str(tmp_path), 'test-engine')
+    first = cache.getMany(["jazz piano", "marathon training"], fakeEmbed(calls))
+    assert first.shape == (2, DIM) and first.dtype == np.float32
+    assert cache.getMany(["marathon training", "sourdough"], fakeEmbed(calls))[0][0] == len("marathon training")
+    assert calls == [["jazz piano", "marathon training"], ["sourdough"]]
+    assert cache.stats() == {'hits': 1, 'misses': 3, 'hitRate': 0.25, 'size': 3}
+
+    # a new process maps the same files and needs no embedding calls
+    reopened = EmbeddingCache(str(tmp_path), 'test-engine')
+    assert len(reopened) == 3
+    assert np.array_equal(reopened.getMany(["jazz piano", "marathon training"], fakeEmbed(calls)), first)
+    assert len(calls) == 2
+    assert reopened.stats()['hits'] == 2 and reopened.stats()['misses'] == 0
+
+    # entries are per engine
+    assert EmbeddingCache(str(tmp_path), 'other/engine').get("jazz piano") is None
+
+
+def test_keys_ignore_whitespace_differences(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 'test-engine')
+    assert normalizeText("  jazz \n piano\t") == "jazz piano"
+    assert cache.key("jazz  piano ") == cache.key("jazz piano") != cache.key("Jazz piano")
+
+    cache.put("jazz piano", np.ones(DIM))
+    assert np.array_equal(cache.get(" jazz\tpiano "), np.ones(DIM, dtype='float32'))
+    cache.put("jazz   piano", np.zeros(DIM)) # already cached under the normalized text
+    assert len(cache) == 1 and np.array_equal(cache.get("jazz piano"), np.ones(DIM, dtype='float32'))
+
+
+@pytest.mark.parametrize('tornFile', ['vectors', 'keys'])
+def test_a_torn_write_is_cut_back_on_load(tmp_path, tornFile):
+    cache = EmbeddingCache(str(tmp_path), 'test-engine')
+    cache.putMany(["a", "b"], np.eye(2, DIM))
+    # a crash between appending a row to one file and to the other
+    if tornFile == 'vectors':
+        with open(cache.vectorPath, 'ab') as f:
+            f.write(np.ones(DIM, dtype='float32').tobytes())
+    else:
+        with open(cache.keyPath, 'a') as f:
+            f.write(f"{cache.key('c')}\n")
+
+    reopened = EmbeddingCache(str(tmp_path), 'test-engine')
+    assert len(reopened) == 2 and np.array_equal(reopened.get("b"), np.eye(2, DIM, dtype='float32')[1])
+    # rows appended afterwards line up with their keys
+    reopened.put("c", np.full(DIM, 7))
+    assert np.array_equal(EmbeddingCache(str(tmp_path), 'test-engine').get("c"), np.full(DIM, 7, dtype='float32'))
+
+
+@pytest.mark.parametrize('missingFile', ['meta', 'data'])
+def test_a_torn_first_write_leaves_an_empty_cache(tmp_path, missingFile):
+    cache = EmbeddingCache(str(tmp_path), 'test-engine')
+    cache.putMany(["a", "b"], np.eye(2, DIM))
+    # a crash part way through the first write, before meta.json (or, from older versions, after it)
+    if missingFile == 'meta':
+        os.remove(cache.metaPath)
+    else:
+        os.remove(cache.vectorPath)
+        os.remove(cache.keyPath)
+
+    reopened = EmbeddingCache(str(tmp_path), 'test-engine')
+    assert len(reopened) == 0 and reopened.get("a") is None
+    reopened.put("c", np.full(DIM, 7))
+    again = EmbeddingCache(str(tmp_path), 'test-engine')
+    assert len(again) == 1 and np.array_equal(again.get("c"), np.full(DIM, 7, dtype='float32'))
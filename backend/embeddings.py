@@ -0,0 +1,121 @@
+import zlib
+
+import numpy as np
+import openai
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into embedding vectors for the topic matcher.
+
+    Attributes:
+        name (str): Identifies the model; cached embeddings and snapshots are keyed by it.
+        remote (bool): Whether embedding calls go over the network (and so through the request scheduler).
+    """
+
+    name = None
+    remote = False
+
+    def embed(self, texts):
+        """
+        Embeds a batch of texts.
+
+        Parameters:
+           texts (list): The texts to embed.
+
+        Returns:
+           np.array: A float32 matrix with one row per text.
+        """
+        raise NotImplementedError
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeds texts with the OpenAI embeddings API.
+
+    Each batch is a single API request with no retries of its own, so rate-limit and
+    connection errors reach the request scheduler, which retries them without holding a
+    worker and pauses the embedding rate limit on a 429.
+
+    Attributes:
+        engine (str): The name of the embedding engine to use.
+        batchSize (int): Most texts sent per API request.
+    """
+
+    remote = True
+
+    def __init__(self, engine='text-embedding-ada-002', batchSize=2048):
+        self.engine = engine
+        self.name = engine
+        self.batchSize = batchSize
+
+    def embed(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batchSize):
+            batch = [text.replace("\n", " ") for text in texts[start:start + self.batchSize]]
+            data = openai.Embedding.create(input=batch, engine=self.engine).data
+            embeddings.extend(d['embedding'] for d in sorted(data, key=lambda d: d['index']))
+        return np.array(embeddings, dtype='float32').reshape(len(texts), -1)
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Embeds texts on the CPU by hashing word and character n-grams into a fixed-size vector.
+
+    Each text contributes its lower-cased words and the character n-grams of each word;
+    features are hashed (with a hashed sign, so collisions tend to cancel rather than add
+    up), weighted by log term frequency, and the vector is L2-normalized. There is no model
+    to download or fit, so the same text always maps to the same vector. It captures lexical
+    overlap rather than meaning, which makes it a good offline and test backend but a weaker
+    matcher than a learned model.
+
+    Attributes:
+        dim (int): The embedding dimensionality.
+        ngramRange (tuple): Smallest and largest character n-gram lengths.
+    """
+
+    def __init__(self, dim=512, ngramRange=(3, 5)):
+        self.dim = dim
+        self.ngramRange = ngramRange
+        self.name = f"hashing-{dim}-{ngramRange[0]}-{ngramRange[1]}"
+
+    def features(self, text):
+        words = ''.join(c if c.isalnum() else ' ' for c in text.lower()).split()
+        features = [f"w:{word}" for word in words]
+        low, high = self.ngramRange
+        for word in words:
+            padded = f"<{word}>"
+            for n in range(low, high + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed(self, texts):
+        rows, cols, values = [], [], []
+        for row, text in enumerate(texts):
+            counts = {}
+            for feature in self.features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                counts[h] = counts.get(h, 0) + 1
+            hashes = np.fromiter(counts.keys(), dtype='uint32', count=len(counts))
+            tf = np.fromiter(counts.values(), dtype='float32', count=len(counts))
+            rows.append(np.full(len(counts), row))
+            cols.append(hashes % self.dim)
+            # the top hash bit picks the sign, independently of the bucket
+            values.append(np.where(hashes >> 31, -1.0, 1.0) * (1 + np.log(tf)))
+
+        embeddings = np.zeros((len(texts), self.dim), dtype='float32')
+        if rows:
+            np.add.at(embeddings, (np.concatenate(rows), np.concatenate(cols)), np.concatenate(values))
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+
+def makeEmbeddingProvider(provider, engine='text-embedding-ada-002', dim=512):
+    """
+    Returns the embedding provider named by configuration: 'openai' or 'hashing'.
+    """
+    if provider == 'openai':
+        return OpenAIEmbeddingProvider(engine)
+    if provider == 'hashing':
+        return HashingEmbeddingProvider(dim)
+    raise ValueError(f"Unknown embedding provider {provider}")
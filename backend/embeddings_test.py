@@ -0,0 +1,60 @@
+import time
+
+import numpy as np
+import openai
+from langchain.llms.fake import FakeListLLM
+
+from embeddings import HashingEmbeddingProvider, OpenAIEmbeddingProvider
+from matching import TopicMatcher
+from scheduler import RequestScheduler
+
+
+def test_hashing_embeddings_are_deterministic_and_batched():
+    embedder = HashingEmbeddingProvider(dim=256)
+    texts = ["Learning to play jazz piano", "Training for a marathon", ""]
+    batch = embedder.embed(texts)
+    assert batch.shape == (3, 256) and batch.dtype == np.float32
+    assert np.allclose(np.linalg.norm(batch[:2], axis=1), 1)
+    assert not batch[2].any()
+    for text, row in zip(texts, batch):
+        assert np.allclose(HashingEmbeddingProvider(dim=256).embed([text])[0], row)
+
+
+def test_matcher_runs_offline_with_hashing_embeddings():
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, embedder=HashingEmbeddingProvider())
+    matcher.addTopics([
+        (1, 'a', "Tips for learning jazz piano"),
+        (2, 'b', "Jazz piano improvisation for beginners"),
+        (3, 'c', "Marathon training plans"),
+        (4, 'd', "Running my first marathon"),
+        (5, 'e', "Baking sourdough bread at home"),
+    ])
+    assert matcher.engine.startswith('hashing')
+
+    results = matcher.getSimilarTopics("How do I start training for a marathon?", 'z')
+    assert {result['topicID'] for result in results} == {3, 4}
+    results = matcher.getSimilarTopics("learning jazz piano", 'a')
+    assert results[0]['topicID'] == 2
+
+
+def test_provider_rate_limits_pause_the_embedding_kind(fakeEmbeddingAPI):
+    attempts = []
+
+    def throttled(texts, engine):
+        attempts.append(list(texts))
+        if len(attempts) == 1:
+            raise openai.error.RateLimitError("slow down")
+        return [[float(len(text))] * 4 for text in texts]
+
+    fakeEmbeddingAPI(throttled)
+    scheduler = RequestScheduler(numWorkers=2, backoff=0.2)
+    scheduler.addKind('embedding', rate=1000)
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), embedder=OpenAIEmbeddingProvider(), scheduler=scheduler)
+
+    start = time.monotonic()
+    embeddings = matcher.embedTexts(["jazz", "marathon\ntraining"])
+    # the 429 reached the scheduler once, instead of being retried inside the provider
+    assert attempts == [["jazz", "marathon training"]] * 2
+    assert embeddings[:, 0].tolist() == [4.0, 17.0]
+    assert scheduler.stats()['embedding']['retries'] == 1
+    assert scheduler.kinds['embedding'].bucket.pausedUntil > start
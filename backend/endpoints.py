@@ -1,11 +1,30 @@
+import uuid
 from datetime import datetime, timezone
 
+import openai
 from flask_restful import Resource, reqparse
 from flask import request
 from sqlalchemy import or_
 
+import config
+from inbox import getInbox
+from scheduler import SchedulerBusy
+
+# what embedding a topic can fail with once the scheduler has given up retrying
+EMBEDDING_ERRORS = (SchedulerBusy, TimeoutError, openai.error.OpenAIError)
+
 def setupEndpoints(chatApp, api, socketio):
 
+    def flushMessages():
+        # messages are written behind the broadcast, so reads wait for any still queued
+        if chatApp.messageWriter is not None:
+            chatApp.blocking.run(chatApp.messageWriter.flush)
+
+    def shareTopicChange(op, topicID, userID=None, title=None, embedding=None):
+        # other workers replay the change on their own matchers
+        if chatApp.topicSync is not None:
+            chatApp.blocking.run(chatApp.topicSync.record, op, topicID, userID, title, embedding)
+
     class NextUserIDResource(Resource):
         def get(self):
             nextID = chatApp.getNextUserID()  # Retrieve the next user id
@@ -68,8 +87,16 @@ def setupEndpoints(chatApp, api, socketio):
             chatApp.db.session.add(newTopic)
             chatApp.db.session.commit()
 
-            # add the topic to the matcher list
-            chatApp.matcher.addTopic(newTopic.id, userID, args['title'])
+            # add the topic to the matcher list; if it cannot be embedded now, the topic is taken back
+            # out so the database never holds a topic the matchers have not seen
+            try:
+                embedding = chatApp.blocking.run(chatApp.matcher.addTopic, newTopic.id, userID, args['title'])
+            except EMBEDDING_ERRORS as e:
+                print(f"Could not embed new topic {newTopic.id}: {e!r}")
+                chatApp.db.session.delete(newTopic)
+                chatApp.db.session.commit()
+                return {'error': 'Too many requests, please try again shortly'}, 503
+            shareTopicChange('add', newTopic.id, userID, args['title'], embedding)
 
             return {'id': newTopic.id}, 201
 
@@ -82,6 +109,32 @@ def setupEndpoints(chatApp, api, socketio):
 
             return {'title': topic.title, 'userID': topic.userID}, 200
 
+        def put(self, topicID):
+            # PUT method to rename a topic
+            parser = reqparse.RequestParser()
+            parser.add_argument('title', required=True, help="title cannot be blank!")
+            args = parser.parse_args()
+
+            topic = chatApp.Topic.query.get(topicID)
+            if not topic:
+                return {'error': 'Topic not found'}, 404
+
+            oldTitle = topic.title
+            topic.title = args['title']
+            chatApp.db.session.commit()
+
+            # re-embed the topic so matches reflect the new title; the matcher is left untouched on
+            # failure, so the old title is put back to keep the two in step
+            try:
+                embedding = chatApp.blocking.run(chatApp.matcher.updateTopic, topic.id, topic.userID, topic.title)
+            except EMBEDDING_ERRORS as e:
+                print(f"Could not embed renamed topic {topic.id}: {e!r}")
+                topic.title = oldTitle
+                chatApp.db.session.commit()
+                return {'error': 'Too many requests, please try again shortly'}, 503
+            shareTopicChange('update', topic.id, topic.userID, topic.title, embedding)
+            return {'id': topic.id, 'title': topic.title}, 200
+
         def delete(self, topicID):
             # DELETE method to delete topic
             topic = chatApp.Topic.query.get(topicID)
@@ -90,6 +143,10 @@ def setupEndpoints(chatApp, api, socketio):
 
             chatApp.db.session.delete(topic)
             chatApp.db.session.commit()
+
+            # drop the topic from the matcher so it stops showing up in matches
+            chatApp.blocking.run(chatApp.matcher.removeTopic, topicID)
+            shareTopicChange('remove', topicID)
             return {'message': f'Topic {topic.id} was deleted'}, 200
 
 
@@ -128,6 +185,7 @@ def setupEndpoints(chatApp, api, socketio):
 
     class TopicChatMetadataResource(Resource):
         def get(self, topicID):
+            flushMessages()
             chatMetadataList = chatApp.ChatMetadata.query.filter(
                 or_(chatApp.ChatMetadata.creatorTopicID == topicID,
                     chatApp.ChatMetadata.matchedTopicID == topicID
@@ -139,14 +197,15 @@ def setupEndpoints(chatApp, api, socketio):
 
             chatInfoList = []
             for chatMetadata in chatMetadataList:
+                creatorLastViewedAt, matchedLastViewedAt = chatApp.readReceipts.overlay(chatMetadata)
                 chatInfo = {
                     'chatID': chatMetadata.id,
                     'creatorTopicID': chatMetadata.creatorTopicID,
                     'matchedTopicID': chatMetadata.matchedTopicID,
                     'userCreatorID': chatMetadata.userCreatorID,
                     'userMatchedID': chatMetadata.userMatchedID,
-                    'creatorLastViewedAt': chatMetadata.creatorLastViewedAt.isoformat() if chatMetadata.creatorLastViewedAt else None,
-                    'matchedLastViewedAt': chatMetadata.matchedLastViewedAt.isoformat() if chatMetadata.matchedLastViewedAt else None,
+                    'creatorLastViewedAt': creatorLastViewedAt.isoformat() if creatorLastViewedAt else None,
+                    'matchedLastViewedAt': matchedLastViewedAt.isoformat() if matchedLastViewedAt else None,
                     'lastMessageTimestamp': chatMetadata.lastMessageTimestamp.isoformat() if chatMetadata.lastMessageTimestamp else None,
                 }
                 chatInfoList.append(chatInfo)
@@ -156,10 +215,31 @@ def setupEndpoints(chatApp, api, socketio):
 
     class ChatMessagesResource(Resource):
         def get(self, chatID):
-            messageList = chatApp.ChatMessage.query.filter_by(chatID=chatID).all()
-            if not messageList:
+            # A page of messages, oldest first: the newest `limit` by default, older ones with
+            # before=<messageNumber>, or only what a reconnecting client missed with after=<messageNumber>.
+            # Each page is one range read on the (chatID, messageNumber) index, however long the chat is.
+            before = request.args.get('before', type=int)
+            after = request.args.get('after', type=int)
+            limit = request.args.get('limit', config.CHAT_PAGE_SIZE, type=int)
+            if limit < 1:
+                # SQLite reads LIMIT -1 as no limit at all
+                return {'error': 'limit must be at least 1'}, 400
+            limit = min(limit, config.CHAT_MAX_PAGE_SIZE)
+
+            flushMessages()
+            ChatMessage = chatApp.ChatMessage
+            query = ChatMessage.query.filter(ChatMessage.chatID == chatID)
+            if after is not None:
+                query = query.filter(ChatMessage.messageNumber > after).order_by(ChatMessage.messageNumber)
+                messageList = query.limit(limit).all()
+            else:
+                if before is not None:
+                    query = query.filter(ChatMessage.messageNumber < before)
+                messageList = query.order_by(ChatMessage.messageNumber.desc()).limit(limit).all()[::-1]
+
+            if not messageList and before is None and after is None:
                 return {'error': 'No chats found for this metadata'}, 404
-            
+
             messageInfoList = []
             for message in messageList:
                 messageInfo = {
@@ -182,6 +262,7 @@ def setupEndpoints(chatApp, api, socketio):
 
             newChat = chatApp.ChatMessage(
                 chatID=chatID, 
+                messageNumber=chatApp.sequencer.next(chatID),
                 senderID=args['senderID'], 
                 text=args['text']
             )
@@ -191,6 +272,7 @@ def setupEndpoints(chatApp, api, socketio):
             return {'id': newChat.id}, 201
 
         def delete(self, chatID):
+            flushMessages()
             chat = chatApp.ChatMessage.query.filter_by(chatID=chatID).all()
             if not chat:
                 return {'error': 'Chat message not found'}, 404
@@ -206,14 +288,18 @@ def setupEndpoints(chatApp, api, socketio):
             parser.add_argument('userID', required=True, help="Text cannot be blank!")
             args = parser.parse_args()
 
-            chatMetadata = chatApp.ChatMetadata.query.filter_by(id=args['chatID']).first()
-            if args['userID'] == chatMetadata.userCreatorID:
-                chatMetadata.creatorLastViewedAt = datetime.now(timezone.utc)
-            else: # user is the matched user
-                chatMetadata.matchedLastViewedAt =  datetime.now(timezone.utc)
-            
-            chatApp.db.session.add(chatMetadata)
-            chatApp.db.session.commit()
+            # buffered and written in bulk; reads overlay it until then. The last message number is one
+            # index seek, and lets the inbox count unread messages without reading the ones already seen
+            lastReadNumber = chatApp.getLastMessageNumber(int(args['chatID']))
+            chatApp.readReceipts.record(args['chatID'], args['userID'], datetime.now(timezone.utc), lastReadNumber)
+
+
+    class InboxResource(Resource):
+        def get(self, userID):
+            # everything the sidebar needs in one query, rather than one request per topic; unflushed
+            # read receipts are overlaid rather than written out, so viewing the sidebar stays a pure read
+            flushMessages()
+            return getInbox(chatApp, userID, chatApp.readReceipts), 200
 
 
     class BotResponseResource(Resource):
@@ -221,11 +307,32 @@ def setupEndpoints(chatApp, api, socketio):
             topic = request.args.get('topic')
             userID = request.args.get('userID')
             if topic:
-                topicMatches = chatApp.matcher.getSimilarTopics(topic, userID)
+                try:
+                    # matching waits on the batcher and the scheduler, which would stall an event loop
+                    topicMatches = chatApp.blocking.run(chatApp.batcher.getSimilarTopics, topic, userID)
+                except (SchedulerBusy, TimeoutError):
+                    return {'error': 'Too many requests, please try again shortly'}, 503
+                if request.args.get('stream') and userID and len(topicMatches) == 2:
+                    # the icebreaker text follows over the user's socket as it is generated
+                    requestID = uuid.uuid4().hex
+                    socketio.start_background_task(chatApp.blocking.run, chatApp.segway.getResponse, topic, topicMatches, userID, requestID)
+                    return {'topicMatches': topicMatches, 'requestID': requestID}, 200
                 return {'topicMatches': topicMatches}, 200
             else:
                 return {'error': 'No topic provided'}, 400
 
+
+    class MatcherStatsResource(Resource):
+        def get(self):
+            stats = chatApp.matcher.cacheStats()
+            stats['batching'] = chatApp.batcher.stats()
+            stats['scheduler'] = chatApp.scheduler.stats()
+            stats['blocking'] = chatApp.blocking.stats()
+            stats['ids'] = chatApp.ids.stats()
+            if chatApp.topicSync is not None:
+                stats['topicSync'] = chatApp.topicSync.stats()
+            return stats, 200
+
     api.add_resource(NextUserIDResource, '/next-user-id')
     # TODO: get rid of the NextID resources above
     api.add_resource(CreateUserResource, '/create-user')
@@ -236,4 +343,6 @@ def setupEndpoints(chatApp, api, socketio):
     api.add_resource(TopicChatMetadataResource, '/chatmetadata/<int:topicID>')
     api.add_resource(ChatMessagesResource, '/chats/<int:chatID>')
     api.add_resource(LastViewedTimestamp, '/update-timestamp')
-    api.add_resource(BotResponseResource, '/bot-response')
\ No newline at end of file
+    api.add_resource(InboxResource, '/inbox/<string:userID>')
+    api.add_resource(BotResponseResource, '/bot-response')
+    api.add_resource(MatcherStatsResource, '/matcher-stats')
\ No newline at end of file
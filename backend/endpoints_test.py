@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy import insert
+
+import config
+from scheduler import SchedulerBusy
+
+
+def test_chat_history_pages_and_deltas(chatApp, monkeypatch):
+    with chatApp.app.app_context():
+        chatApp.db.session.execute(insert(chatApp.ChatMessage), [
+            {'chatID': 1, 'messageNumber': i, 'senderID': 'u1', 'text': f"{i}"} for i in range(25)])
+        chatApp.db.session.commit()
+    client = chatApp.app.test_client()
+
+    def numbers(url):
+        response = client.get(url)
+        assert response.status_code == 200
+        return [message['messageNumber'] for message in response.get_json()]
+
+    assert numbers('/chats/1?limit=10') == list(range(15, 25))
+    assert numbers('/chats/1?before=15&limit=10') == list(range(5, 15))
+    assert numbers('/chats/1?before=5&limit=10') == list(range(5))
+    assert numbers('/chats/1?before=0') == []
+    assert numbers('/chats/1?after=20') == [21, 22, 23, 24]
+    assert numbers('/chats/1?after=3&limit=2') == [4, 5]
+    assert numbers('/chats/1?after=24') == []
+    assert len(numbers('/chats/1')) == 25
+    assert client.get('/chats/2').status_code == 404
+
+    # a page is between 1 and CHAT_MAX_PAGE_SIZE messages, never the whole history
+    for limit in (0, -1):
+        assert client.get(f'/chats/1?limit={limit}').status_code == 400
+    monkeypatch.setattr(config, 'CHAT_MAX_PAGE_SIZE', 10)
+    assert numbers('/chats/1?limit=1000') == list(range(15, 25))
+
+
+def test_inbox_summarizes_every_chat_in_one_request(chatApp):
+    start = datetime(2023, 1, 1)
+    with chatApp.app.app_context():
+        db = chatApp.db
+        db.session.add(chatApp.Topic(id=3, userID='u1', title="third"))
+        db.session.add(chatApp.ChatMetadata(id=2, creatorTopicID=2, matchedTopicID=3, userCreatorID='u2', userMatchedID='u1'))
+        db.session.execute(insert(chatApp.ChatMessage), [
+            {'chatID': 1, 'messageNumber': i, 'senderID': senderID, 'text': text, 'timestamp': start + timedelta(minutes=i)}
+            for i, (senderID, text) in enumerate([('u1', "hi"), ('u2', "a"), ('u2', "b"), ('u2', "c" * 300)])])
+        db.session.commit()
+    client = chatApp.app.test_client()
+
+    inbox = client.get('/inbox/u1').get_json()
+    assert [(chat['chatID'], chat['topicID'], chat['otherTopicID'], chat['otherUserID']) for chat in inbox] == \
+        [(1, 1, 2, 'u2'), (2, 3, 2, 'u2')]
+    assert inbox[0]['lastMessage']['messageNumber'] == 3
+    assert inbox[0]['lastMessage']['text'] == "c" * 100
+    assert inbox[0]['unreadCount'] == 3
+    assert inbox[1]['lastMessage'] is None and inbox[1]['unreadCount'] == 0
+    assert client.get('/inbox/u2').get_json()[0]['unreadCount'] == 1
+
+    # views are counted even before the read-receipt buffer would have flushed them
+    chatApp.readReceipts.record(1, 'u1', start + timedelta(minutes=1, seconds=30), lastReadNumber=1)
+    assert client.get('/inbox/u1').get_json()[0]['unreadCount'] == 2
+    assert chatApp.readReceipts.numFlushes == 0
+
+    # once flushed, the count comes from the stored last-read number
+    chatApp.readReceipts.flush()
+    with chatApp.app.app_context():
+        assert chatApp.db.session.get(chatApp.ChatMetadata, 1).creatorLastReadNumber == 1
+    assert client.get('/inbox/u1').get_json()[0]['unreadCount'] == 2
+    assert client.get('/inbox/nobody').get_json() == []
+
+
+def test_topic_changes_are_undone_when_they_cannot_be_embedded(chatApp, monkeypatch):
+    def busy(*args):
+        raise SchedulerBusy("Too many queued embedding requests")
+    monkeypatch.setattr(chatApp, 'matcher', SimpleNamespace(addTopic=busy, updateTopic=busy))
+    client = chatApp.app.test_client()
+
+    assert client.post('/user-topics/u1', json={'title': "third"}).status_code == 503
+    assert client.put('/topics/1', json={'title': "renamed"}).status_code == 503
+    with chatApp.app.app_context():
+        assert {topic.id: topic.title for topic in chatApp.Topic.query} == {1: "first", 2: "second"}
@@ -1,4 +1,7 @@
+from datetime import datetime, timezone
+
 from flask_socketio import join_room, leave_room, send
+from sqlalchemy.exc import IntegrityError
 from extensions import socketio
 
 
@@ -45,23 +48,39 @@ def on_chat_leave(data):
 def handle_new_message(data):
     print(f"New message from user {data['senderID']} in chatID {data['chatID']}")
     room = "chatID_" + str(data['chatID'])
-    
-    # Query the latest message in the chat and increment the message number
-    # TODO: get rid of this hack and order by timestamp on client side
-    lastMessage = chatApp.ChatMessage.query.filter_by(chatID=data['chatID']) \
-        .order_by(chatApp.ChatMessage.messageNumber.desc()).first()
-
-    if lastMessage is None:
-        newMessageNumber = 0
-    else:
-        newMessageNumber = lastMessage.messageNumber + 1
-    
-    data['messageNumber'] = newMessageNumber
 
-    add_new_message(data)
+    # with several workers the sequencer commits a counter to the database
+    data['messageNumber'] = chatApp.blocking.run(chatApp.sequencer.next, int(data['chatID']))
+
+    if chatApp.messageWriter is not None:
+        # broadcast right away; the message is persisted with the writer's next batch, which
+        # announces a correction if it has to renumber it, or an error if it cannot store it
+        queue_new_message(data)
+        send(data, room=room)
+        return
+
+    try:
+        add_new_message(data)
+    except IntegrityError:
+        # another writer took this number; reload the counter so the next message is correct
+        chatApp.db.session.rollback()
+        chatApp.sequencer.reset(int(data['chatID']))
+        raise
     print(data)
     send(data, room=room)
 
+def queue_new_message(data):
+    timestamp = datetime.now(timezone.utc)
+    chatApp.messageWriter.submit({
+        'chatID': int(data['chatID']),
+        'messageNumber': data['messageNumber'],
+        'senderID': data['senderID'],
+        'text': data['text'],
+        'topicID': data['topicInfo']['topicID'] if data['topicInfo'] else None,
+        'timestamp': timestamp,
+    })
+    data['isoString'] = timestamp.isoformat()
+
 def add_new_message(data):
     chatID, messageNumber, senderID, text, topicInfo = \
         data['chatID'], data['messageNumber'], data['senderID'], data['text'], data['topicInfo']
@@ -0,0 +1,149 @@
+import threading
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import config
+from extensions import socketio
+
+
+def test_concurrent_senders_get_distinct_message_numbers(chatApp):
+    numSenders, numMessages = 8, 10
+    errors = []
+
+    def sender(senderID):
+        client = socketio.test_client(chatApp.app)
+        try:
+            for i in range(numMessages):
+                client.emit('new-message', {'chatID': 1, 'senderID': senderID, 'text': f"{i}", 'topicInfo': None})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=sender, args=('u1' if i % 2 else 'u2',)) for i in range(numSenders)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    chatApp.messageWriter.flush()
+    with chatApp.app.app_context():
+        numbers = sorted(message.messageNumber for message in chatApp.ChatMessage.query.filter_by(chatID=1))
+    assert numbers == list(range(numSenders * numMessages))
+
+
+def test_duplicate_message_numbers_are_rejected(chatApp):
+    with chatApp.app.app_context():
+        assert chatApp.sequencer.next(1) == 0
+        for _ in range(2):
+            chatApp.db.session.add(chatApp.ChatMessage(chatID=1, messageNumber=0, senderID='u1', text="hi"))
+        with pytest.raises(IntegrityError):
+            chatApp.db.session.commit()
+        chatApp.db.session.rollback()
+
+        # a counter that fell behind another writer picks up from the database after a reset
+        chatApp.db.session.add(chatApp.ChatMessage(chatID=1, messageNumber=5, senderID='u1', text="hi"))
+        chatApp.db.session.commit()
+        chatApp.sequencer.reset(1)
+        assert chatApp.sequencer.next(1) == 6
+
+
+def test_write_behind_renumbers_messages_whose_numbers_were_taken(chatApp):
+    sender = socketio.test_client(chatApp.app)
+    listener = socketio.test_client(chatApp.app)
+    listener.emit('chat-join', {'userID': 'u2', 'room': 1})
+    sender.emit('new-message', {'chatID': 1, 'senderID': 'u1', 'text': "first", 'topicInfo': None})
+    chatApp.messageWriter.flush()
+
+    # another writer stores numbers 1-3 behind the cached counter's back
+    with chatApp.app.app_context():
+        for number in range(1, 4):
+            chatApp.db.session.add(chatApp.ChatMessage(chatID=1, messageNumber=number, senderID='u2', text=f"ext{number}"))
+        chatApp.db.session.commit()
+    listener.get_received()
+
+    for i in range(5):
+        sender.emit('new-message', {'chatID': 1, 'senderID': 'u1', 'text': f"m{i}", 'topicInfo': None})
+    chatApp.messageWriter.flush()
+
+    with chatApp.app.app_context():
+        stored = {message.text: message.messageNumber for message in chatApp.ChatMessage.query.filter_by(chatID=1)}
+    assert sorted(stored.values()) == list(range(9))
+    assert {stored[f"ext{number}"] for number in range(1, 4)} == {1, 2, 3}
+
+    # clients saw m0-m2 under the taken numbers, and are told where they ended up
+    received = listener.get_received()
+    broadcast = {event['args']['text']: event['args']['messageNumber'] for event in received if event['name'] == 'message'}
+    corrections = {event['args'][0]['oldMessageNumber']: event['args'][0]['messageNumber']
+                   for event in received if event['name'] == 'message-renumbered'}
+    assert set(corrections) == {1, 2, 3}
+    for text, number in broadcast.items():
+        assert stored[text] == corrections.get(number, number)
+    assert chatApp.messageWriter.stats()['renumbered'] == 3
+    # and later messages continue after the renumbered ones
+    sender.emit('new-message', {'chatID': 1, 'senderID': 'u1', 'text': "last", 'topicInfo': None})
+    chatApp.messageWriter.flush()
+    with chatApp.app.app_context():
+        assert chatApp.ChatMessage.query.filter_by(chatID=1, text="last").one().messageNumber == 9
+
+
+def test_write_behind_retries_transient_errors(chatApp, monkeypatch):
+    write = chatApp.messageWriter.write
+    attempts = []
+
+    def flakyWrite(batch):
+        attempts.append(len(batch))
+        if len(attempts) < 3:
+            raise OperationalError("INSERT INTO chatmessages", {}, Exception("database is locked"))
+        return write(batch)
+    monkeypatch.setattr(chatApp.messageWriter, 'write', flakyWrite)
+
+    sender = socketio.test_client(chatApp.app)
+    sender.emit('new-message', {'chatID': 1, 'senderID': 'u1', 'text': "hello", 'topicInfo': None})
+    chatApp.messageWriter.flush()
+    assert len(attempts) == 3
+    with chatApp.app.app_context():
+        assert [message.text for message in chatApp.ChatMessage.query.filter_by(chatID=1)] == ["hello"]
+
+
+def test_messages_are_broadcast_then_written_in_batches(chatApp):
+    sender = socketio.test_client(chatApp.app)
+    listener = socketio.test_client(chatApp.app)
+    listener.emit('chat-join', {'userID': 'u2', 'room': 1})
+    for i in range(20):
+        sender.emit('new-message', {'chatID': 1, 'senderID': 'u1' if i < 19 else 'u2', 'text': f"{i}", 'topicInfo': None})
+    received = listener.get_received()
+    assert [event['args']['messageNumber'] for event in received] == list(range(20))
+
+    chatApp.messageWriter.flush()
+    with chatApp.app.app_context():
+        messages = chatApp.ChatMessage.query.filter_by(chatID=1).order_by(chatApp.ChatMessage.messageNumber).all()
+        chatMetadata = chatApp.ChatMetadata.query.filter_by(id=1).first()
+        assert [message.text for message in messages] == [f"{i}" for i in range(20)]
+        assert chatMetadata.lastMessageTimestamp == messages[-1].timestamp
+        assert chatMetadata.matchedLastViewedAt == messages[-1].timestamp
+        assert chatMetadata.creatorLastViewedAt == messages[-2].timestamp
+    assert chatApp.messageWriter.stats()['batches'] < 20
+
+
+@pytest.fixture(params=[1, 2], ids=['local-sequencer', 'shared-sequencer'])
+def geventChatApp(request, monkeypatch):
+    pytest.importorskip('gevent')
+    monkeypatch.setattr(config, 'SERVER_MODE', 'gevent')
+    monkeypatch.setattr(config, 'WORKERS', request.param)
+    return request.getfixturevalue('chatApp')
+
+
+def test_gevent_mode_numbers_messages_on_the_blocking_pool(geventChatApp):
+    chatApp = geventChatApp
+    assert chatApp.blocking.pool is not None
+    sender = socketio.test_client(chatApp.app)
+    listener = socketio.test_client(chatApp.app)
+    listener.emit('chat-join', {'userID': 'u2', 'room': 1})
+    for i in range(3):
+        sender.emit('new-message', {'chatID': 1, 'senderID': 'u1', 'text': f"{i}", 'topicInfo': None})
+    assert [event['args']['messageNumber'] for event in listener.get_received()] == [0, 1, 2]
+
+    chatApp.messageWriter.flush()
+    with chatApp.app.app_context():
+        assert sorted(message.messageNumber for message in chatApp.ChatMessage.query.filter_by(chatID=1)) == [0, 1, 2]
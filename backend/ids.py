@@ -0,0 +1,69 @@
+from sqlalchemy import case, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+
+class IDAllocator:
+    """
+    Hands out increasing integers from named counters stored in the database.
+
+    Every allocation is one short transaction that increments the counter row and reads
+    it back, so values are unique across every process sharing the database. A counter
+    can be given a floor, a scalar SQL expression it is raised to before incrementing,
+    which lets it catch up with rows written without it (e.g. by a single-worker run).
+
+    Attributes:
+        chatApp (ChatApplication): The app whose database holds the counters.
+        numAllocations (int): Number of allocations made by this process.
+    """
+
+    def __init__(self, chatApp, maxAttempts=5):
+        """
+        The constructor for IDAllocator class.
+
+        Parameters:
+           chatApp (ChatApplication): The app whose database holds the counters.
+           maxAttempts (int): Times to retry when another process creates the same counter concurrently. Default is 5.
+        """
+        self.chatApp = chatApp
+        self.maxAttempts = maxAttempts
+        self.numAllocations = 0
+
+    def allocate(self, name, count=1, start=1, floor=None):
+        """
+        Reserves `count` consecutive values from a counter and returns the first.
+
+        Parameters:
+           name (str): The counter to allocate from; created on first use.
+           count (int): How many consecutive values to reserve. Default is 1.
+           start (int): The first value a new counter hands out. Default is 1.
+           floor (ColumnElement): A scalar SQL expression the counter's last value is raised to first, or None.
+
+        Returns:
+           int: The first reserved value.
+        """
+        table = self.chatApp.Counter.__table__
+        if floor is None:
+            raised = table.c.value
+        else:
+            raised = case((floor > table.c.value, floor), else_=table.c.value)
+
+        with self.chatApp.app.app_context():
+            engine = self.chatApp.db.engine
+            for attempt in range(self.maxAttempts):
+                try:
+                    with engine.begin() as connection:
+                        updated = connection.execute(
+                            update(table).where(table.c.name == name).values(value=raised + count)).rowcount
+                        if not updated:
+                            initial = start - 1 if floor is None else func.coalesce(floor, start - 1)
+                            connection.execute(insert(table).values(name=name, value=initial + count))
+                        last = connection.execute(select(table.c.value).where(table.c.name == name)).scalar_one()
+                    self.numAllocations += 1
+                    return last - count + 1
+                except IntegrityError:
+                    # another process created the counter first; increment theirs instead
+                    continue
+        raise RuntimeError(f"Could not allocate from counter {name!r} after {self.maxAttempts} attempts")
+
+    def stats(self):
+        return {'allocations': self.numAllocations}
@@ -0,0 +1,95 @@
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import aliased
+
+
+def getInbox(chatApp, userID, readReceipts=None, previewLength=100):
+    """
+    Returns every chat on any of a user's topics, newest activity first, in one query.
+
+    Each chat comes with the user's topic, the other side's topic, a preview of the
+    last message, and the number of messages from the other user after the last one
+    the user has read. All lookups are index seeks: chats by user on either side, the
+    last message by (chatID, max messageNumber), and unread messages by a range of
+    (chatID, messageNumber) past the stored last-read number, so a load only touches
+    messages the user has not seen. Views still waiting in the read receipt buffer are
+    overlaid, the way chat metadata reads do, rather than flushed.
+
+    Parameters:
+       chatApp (ChatApplication): The app whose database is queried.
+       userID (str): The user whose inbox to build.
+       readReceipts (ReadReceiptBuffer): Unflushed views to overlay. Default is None.
+       previewLength (int): Longest last-message preview, in characters. Default is 100.
+
+    Returns:
+       list: A list of dictionaries, one per chat.
+    """
+    ChatMetadata, ChatMessage, Topic = chatApp.ChatMetadata, chatApp.ChatMessage, chatApp.Topic
+    isCreator = ChatMetadata.userCreatorID == userID
+    viewedAt = case((isCreator, ChatMetadata.creatorLastViewedAt), else_=ChatMetadata.matchedLastViewedAt)
+    lastRead = case((isCreator, ChatMetadata.creatorLastReadNumber), else_=ChatMetadata.matchedLastReadNumber)
+    ownTopic, otherTopic = aliased(Topic), aliased(Topic)
+    lastMessage = aliased(ChatMessage)
+
+    lastNumber = select(func.max(ChatMessage.messageNumber)) \
+        .where(ChatMessage.chatID == ChatMetadata.id).correlate(ChatMetadata).scalar_subquery()
+    unreadCount = select(func.count()).select_from(ChatMessage).where(
+        ChatMessage.chatID == ChatMetadata.id,
+        ChatMessage.senderID != userID,
+        ChatMessage.messageNumber > func.coalesce(lastRead, -1),
+    ).correlate(ChatMetadata).scalar_subquery()
+
+    query = select(
+        ChatMetadata.id,
+        ownTopic.id, ownTopic.title,
+        otherTopic.id, otherTopic.title, otherTopic.userID,
+        lastMessage.messageNumber, lastMessage.senderID, func.substr(lastMessage.text, 1, previewLength), lastMessage.timestamp,
+        viewedAt,
+        unreadCount,
+    ).join(
+        ownTopic, ownTopic.id == case((isCreator, ChatMetadata.creatorTopicID), else_=ChatMetadata.matchedTopicID)
+    ).join(
+        otherTopic, otherTopic.id == case((isCreator, ChatMetadata.matchedTopicID), else_=ChatMetadata.creatorTopicID)
+    ).outerjoin(
+        lastMessage, and_(lastMessage.chatID == ChatMetadata.id, lastMessage.messageNumber == lastNumber)
+    ).where(
+        or_(ChatMetadata.userCreatorID == userID, ChatMetadata.userMatchedID == userID)
+    ).order_by(lastMessage.timestamp.desc().nulls_last(), ChatMetadata.id.desc())
+
+    pending = readReceipts.pendingChats(userID) if readReceipts is not None else {}
+    inbox = []
+    for (chatID, topicID, topicTitle, otherTopicID, otherTopicTitle, otherUserID,
+         messageNumber, senderID, preview, timestamp, lastViewedAt, unread) in chatApp.db.session.execute(query):
+        if chatID in pending:
+            pendingViewedAt, pendingReadNumber = pending[chatID]
+            lastViewedAt = pendingViewedAt if lastViewedAt is None else max(lastViewedAt, pendingViewedAt)
+            if pendingReadNumber is not None:
+                unread = countUnread(chatApp, chatID, userID, pendingReadNumber) if unread else 0
+        inbox.append({
+            'chatID': chatID,
+            'topicID': topicID,
+            'topicTitle': topicTitle,
+            'otherTopicID': otherTopicID,
+            'otherTopicTitle': otherTopicTitle,
+            'otherUserID': otherUserID,
+            'lastMessage': None if messageNumber is None else {
+                'messageNumber': messageNumber,
+                'senderID': senderID,
+                'text': preview,
+                'timestamp': timestamp.isoformat(),
+            },
+            'lastViewedAt': lastViewedAt.isoformat() if lastViewedAt else None,
+            'unreadCount': unread,
+        })
+    return inbox
+
+
+def countUnread(chatApp, chatID, userID, lastReadNumber):
+    """
+    Counts messages from the other user after lastReadNumber in one chat.
+    """
+    ChatMessage = chatApp.ChatMessage
+    return chatApp.db.session.query(func.count()).select_from(ChatMessage).filter(
+        ChatMessage.chatID == chatID,
+        ChatMessage.senderID != userID,
+        ChatMessage.messageNumber > lastReadNumber,
+    ).scalar()
@@ -0,0 +1,85 @@
+"""
+Compares building a user's sidebar with the per-topic requests against /inbox.
+
+Seeds a temporary SQLite database where every user owns hundreds of topics, each in
+a few chats with some messages, then times, through the Flask test client, the
+client's current pattern (/user-topics/<userID> followed by /chatmetadata/<topicID>
+for every topic) against a single /inbox/<userID> request.
+
+Usage:
+    python inbox_benchmark.py --users 20 --topics-per-user 300 --chats-per-topic 2
+"""
+import time
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import insert
+
+import config
+
+
+def seed(chatApp, numUsers, topicsPerUser, chatsPerTopic, messagesPerChat):
+    numTopics = numUsers * topicsPerUser
+    numChats = numTopics * chatsPerTopic
+    start = datetime(2023, 1, 1)
+    rng = np.random.default_rng(0)
+    partners = rng.integers(numTopics, size=numChats)
+    with chatApp.app.app_context():
+        db = chatApp.db
+        db.session.execute(insert(chatApp.User), [{'id': f"user-{i}"} for i in range(numUsers)])
+        db.session.execute(insert(chatApp.Topic), [{'id': 1 + i, 'userID': f"user-{i % numUsers}", 'title': f"topic {i}"}
+                                                   for i in range(numTopics)])
+        db.session.execute(insert(chatApp.ChatMetadata), [
+            {'id': 1 + i, 'creatorTopicID': 1 + i // chatsPerTopic, 'matchedTopicID': 1 + int(partners[i]),
+             'userCreatorID': f"user-{(i // chatsPerTopic) % numUsers}", 'userMatchedID': f"user-{partners[i] % numUsers}",
+             'creatorLastViewedAt': start + timedelta(seconds=int(rng.integers(messagesPerChat)))}
+            for i in range(numChats)])
+        db.session.execute(insert(chatApp.ChatMessage), [
+            {'chatID': 1 + i // messagesPerChat, 'messageNumber': i % messagesPerChat,
+             'senderID': f"user-{i % numUsers}", 'text': f"message {i}", 'timestamp': start + timedelta(seconds=i % messagesPerChat)}
+            for i in range(numChats * messagesPerChat)])
+        db.session.commit()
+
+
+def perTopicRequests(client, userID):
+    topics = client.get(f'/user-topics/{userID}').get_json()
+    return [client.get(f'/chatmetadata/{topic["id"]}').get_json() for topic in topics]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--topics-per-user', type=int, default=300)
+    parser.add_argument('--chats-per-topic', type=int, default=2)
+    parser.add_argument('--messages-per-chat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dataDir:
+        config.DATA_DIR = dataDir
+        from main import ChatApplication
+        chatApp = ChatApplication()
+        seed(chatApp, args.users, args.topics_per_user, args.chats_per_topic, args.messages_per_chat)
+        client = chatApp.app.test_client()
+
+        print(f"{args.users} users x {args.topics_per_user} topics x {args.chats_per_topic} chats, "
+              f"{args.messages_per_chat} messages per chat")
+        print(f"{'mode':>12} {'requests':>9} {'mean ms':>9} {'p99 ms':>9}")
+        for mode in ('per-topic', 'inbox'):
+            latencies = []
+            for i in range(args.users):
+                userID = f"user-{i}"
+                start = time.perf_counter()
+                if mode == 'per-topic':
+                    perTopicRequests(client, userID)
+                else:
+                    client.get(f'/inbox/{userID}').get_json()
+                latencies.append(time.perf_counter() - start)
+            requests = 1 + args.topics_per_user if mode == 'per-topic' else 1
+            print(f"{mode:>12} {requests:>9} {1000 * np.mean(latencies):>9.1f} {1000 * np.percentile(latencies, 99):>9.1f}")
+        chatApp.readReceipts.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""
+Offline benchmark of the matcher's index modes on synthetic embeddings.
+
+For each index type this reports build time, recall@k against exact (flat) search,
+p50/p99 single-query search latency, and memory, so the recall/latency tradeoff can be
+chosen per deployment with CHATMOS_INDEX_TYPE. Memory counts the float32 TopicStore
+matrix as well, since the matcher keeps it next to every ANN index for exact fallback
+and rebuilds. Index types that cannot be trained on --num vectors are reported as
+skipped rather than measured.
+
+Usage:
+    python index_benchmark.py --num 100000 --dim 256 --types flat ivf-flat ivf-pq hnsw
+"""
+import time
+import argparse
+
+import numpy as np
+
+from topic_store import TopicStore
+from vector_index import INDEX_TYPES, buildAnnIndex, minTrainSize
+
+
+def syntheticEmbeddings(num, dim, numClusters, rng):
+    """
+    Unit-norm vectors drawn around random cluster centres, which is closer to real topic
+    embeddings than uniform noise (and much harder to get perfect recall on with IVF).
+    """
+    centres = rng.standard_normal((numClusters, dim)).astype('float32')
+    vectors = centres[rng.integers(numClusters, size=num)] + 0.5 * rng.standard_normal((num, dim)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=256)
+    parser.add_argument('--clusters', type=int, default=1000)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=12, help="neighbours per search (6*k in the matcher)")
+    parser.add_argument('--types', nargs='+', default=list(INDEX_TYPES), choices=INDEX_TYPES)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = syntheticEmbeddings(args.num + args.queries, args.dim, args.clusters, rng)
+    queries, vectors = vectors[:args.queries], vectors[args.queries:]
+
+    store = TopicStore(args.dim, capacity=args.num)
+    store.add([(i, f"user-{i % 1000}", "") for i in range(args.num)], vectors)
+    _, exact = store.search(queries, args.k)
+
+    print(f"{args.num} vectors, d={args.dim}, k={args.k}, {args.queries} queries")
+    print(f"{'index':>9} {'build s':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8} {'memory MB':>10}")
+    for indexType in args.types:
+        start = time.perf_counter()
+        index = buildAnnIndex(store, indexType)
+        buildTime = time.perf_counter() - start
+        if index is None and indexType != 'flat':
+            print(f"{indexType:>9} skipped (needs {minTrainSize(indexType, args.num)} vectors)")
+            continue
+        search = store.search if index is None else index.search
+        memory = store.nbytes() + (0 if index is None else index.nbytes())
+
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            _, rows = search(query[None, :], args.k)
+            latencies.append(time.perf_counter() - start)
+            found.append(rows[0])
+        recall = np.mean([len(np.intersect1d(f, e)) / args.k for f, e in zip(found, exact)])
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        print(f"{indexType:>9} {buildTime:>8.2f} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f} {memory / 2**20:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,180 @@
+"""
+Loads topics from a conversations file into the database and the topic matcher.
+
+The file is parsed as a stream, so its size is not limited by memory. Topics are
+inserted with one multi-row INSERT per batch, and each batch is embedded on a
+background thread while the next one is parsed and inserted. The embeddings go
+straight into the matcher, and a snapshot is saved at the end, so a server started on
+the loaded database serves matches right away without re-embedding anything.
+
+Usage:
+    python init_database.py                                      # reset, then load data/mock_convs.json
+    python init_database.py data/mock_convs_full.json --append --batch-size 1000
+
+With CHATMOS_WORKERS=N, every worker's snapshot and embedding cache directory is seeded.
+Run it while the server is stopped.
+"""
+import os
+import re
 import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from sqlalchemy import insert
+
+import config
 from main import ChatApplication
 
 
-def loadData(dataPath):
-    with open(dataPath, 'r') as f:
-        data = json.load(f)
-    return data['conversations']
+def iterConversations(dataPath, key='conversations', chunkSize=1 << 16):
+    """
+    Yields the items of the file's top-level `key` array one at a time.
 
-def initDatabase(chatApp, dataPath):
-    data = loadData(dataPath)
-    for conv in data:
-        topic = chatApp.Topic(userID=conv['userID'], title=conv['title'])
-        chatApp.db.session.add(topic)
-    chatApp.db.session.commit()
-    print(f"Database initialized with data from {dataPath}")
+    The file is read `chunkSize` characters at a time and each item is decoded as soon as
+    it is complete, so memory use is bounded by the chunk and the largest single item.
+
+    Parameters:
+       dataPath (str): A JSON file of the form {"conversations": [{...}, ...]}.
+       key (str): The key holding the array. Default is 'conversations'.
+       chunkSize (int): Characters read per chunk. Default is 65536.
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    separator = re.compile(r'[\s,]*')
+    with open(dataPath, 'r', encoding='utf-8') as f:
+        buffer, pos = '', None
+        while pos is None:
+            chunk = f.read(chunkSize)
+            if not chunk:
+                raise ValueError(f"No '{key}' array in {dataPath}")
+            buffer += chunk
+            match = start.search(buffer)
+            if match:
+                pos = match.end()
+
+        while True:
+            pos = separator.match(buffer, pos).end()
+            if buffer.startswith(']', pos):
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # the item runs past the end of what has been read so far
+                chunk = f.read(chunkSize)
+                if not chunk:
+                    raise
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield item
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def insertTopics(chatApp, conversations):
+    """
+    Inserts one batch of topics with a single executemany, and returns their (topicID, userID, title) tuples.
+    """
+    table = chatApp.Topic.__table__
+    rows = [{'userID': str(conv['userID']), 'title': conv['title']} for conv in conversations]
+    with chatApp.app.app_context():
+        with chatApp.db.engine.begin() as connection:
+            topicIDs = connection.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+    return [(topicID, row['userID'], row['title']) for topicID, row in zip(topicIDs, rows)]
+
+
+def initDatabase(chatApp, dataPath, batchSize=1000, matcher=None):
+    """
+    Loads every conversation in a file as a topic, embedding them into `matcher` if one is given.
+
+    Parameters:
+       chatApp (ChatApplication): The app whose database is loaded.
+       dataPath (str): The conversations file.
+       batchSize (int): Topics inserted and embedded together. Default is 1000.
+       matcher (TopicMatcher): The matcher to add the topics to. Default is None (database only).
+
+    Returns:
+       int: The highest topic ID inserted, or 0 if the file had no conversations.
+    """
+    highWaterMark = 0
+    numTopics = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-embed') as embedPool:
+        pending = None
+        for conversations in batched(iterConversations(dataPath), batchSize):
+            topicTuples = insertTopics(chatApp, conversations)
+            highWaterMark = max(highWaterMark, topicTuples[-1][0])
+            numTopics += len(topicTuples)
+            print(f"Inserted {numTopics} topics ({numTopics / (time.perf_counter() - start):.0f}/s)")
+            if matcher is None:
+                continue
+            # embed this batch while the next one is parsed and inserted
+            if pending is not None:
+                matcher.addEmbeddings(pending[0], pending[1].result())
+                pending = None
+            topicTuples = [info for info in topicTuples if info[2] != "Brainstorm"] # skip Brainstorm chats
+            if topicTuples:
+                pending = (topicTuples, embedPool.submit(matcher.embedTexts, [title for _, _, title in topicTuples]))
+        if pending is not None:
+            matcher.addEmbeddings(pending[0], pending[1].result())
+
+    if matcher is not None and matcher.needsRetraining():
+        matcher.compact()
+    print(f"Database initialized with {numTopics} topics from {dataPath} in {time.perf_counter() - start:.1f} s")
+    return highWaterMark
+
+
+def copyToWorkers(sourceDir, workerDirs):
+    """
+    Replaces every other worker's copy of a directory with sourceDir, so all of them boot from the same state.
+    """
+    for workerDir in workerDirs:
+        if workerDir != sourceDir:
+            shutil.rmtree(workerDir, ignore_errors=True)
+            if os.path.isdir(sourceDir):
+                shutil.copytree(sourceDir, workerDir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('dataPath', nargs='?', default='data/mock_convs.json')
+    parser.add_argument('--append', action='store_true', help="keep existing data instead of resetting the database")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--no-embed', action='store_true', help="only load the database; topics are embedded at the next boot")
+    args = parser.parse_args(argv)
 
-if __name__ == '__main__':
     # this iniitializes the chat app, and allows us to access data models
     chatApp = ChatApplication()
-    dataPath = 'data/mock_convs.json'
-    with chatApp.app.app_context():
-        chatApp.db.drop_all() # This deletes all existing data
-        chatApp.db.create_all()
-        initDatabase(chatApp, dataPath)
+    if not args.append:
+        with chatApp.app.app_context():
+            chatApp.db.drop_all() # This deletes all existing data
+            shutil.rmtree(config.SNAPSHOT_ROOT, ignore_errors=True) # snapshots refer to the old topic IDs
+            chatApp.db.create_all()
+
+    if not args.no_embed:
+        # each of serve.py's workers boots from its own snapshots and embedding cache, so build
+        # in the first one's and copy them to the rest
+        snapshotDirs = config.workerDirs(config.SNAPSHOT_ROOT)
+        cacheDirs = config.workerDirs(config.EMBEDDING_CACHE_ROOT)
+        # brings the matcher up to date with what is already stored, as a server boot would,
+        # but without the background compaction and topic sync threads
+        chatApp.initApiKey()
+        chatApp.setupTopicHelpers(snapshotDirs[0], cacheDirs[0], background=False)
+        highWaterMark = initDatabase(chatApp, args.dataPath, batchSize=args.batch_size, matcher=chatApp.matcher)
+        chatApp.matcher.saveSnapshot(snapshotDirs[0], highWaterMark=highWaterMark)
+        copyToWorkers(snapshotDirs[0], snapshotDirs)
+        copyToWorkers(cacheDirs[0], cacheDirs)
+    else:
+        initDatabase(chatApp, args.dataPath, batchSize=args.batch_size)
+    return chatApp
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import json
+
+from langchain.llms.fake import FakeListLLM
+
+import config
+import init_database
+from embedding_cache import EmbeddingCache
+from embeddings import HashingEmbeddingProvider
+from init_database import initDatabase, iterConversations
+from matching import TopicMatcher
+
+
+def writeConversations(path, conversations):
+    # indented so items straddle the tiny chunks the parser is given below
+    path.write_text(json.dumps({'meta': {'conversations': "not this one"}, 'conversations': conversations}, indent=2))
+
+
+def test_conversations_stream_across_chunks(tmp_path):
+    conversations = [{'title': f"topic {i} with \"quotes\", [brackets] and {{braces}}", 'userID': i} for i in range(20)]
+    path = tmp_path / 'convs.json'
+    writeConversations(path, conversations)
+    assert list(iterConversations(str(path), chunkSize=7)) == conversations
+
+    writeConversations(path, [])
+    assert list(iterConversations(str(path), chunkSize=7)) == []
+
+
+def test_bulk_load_fills_database_and_snapshot(chatApp, tmp_path):
+    conversations = [{'title': f"Learning topic number {i}", 'userID': i % 3} for i in range(25)]
+    conversations[5]['title'] = "Brainstorm"
+    path = tmp_path / 'convs.json'
+    writeConversations(path, conversations)
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, embedder=HashingEmbeddingProvider())
+
+    highWaterMark = initDatabase(chatApp, str(path), batchSize=4, matcher=matcher)
+
+    with chatApp.app.app_context():
+        topics = chatApp.Topic.query.filter(chatApp.Topic.id > 2).order_by(chatApp.Topic.id).all()
+    assert [(topic.userID, topic.title) for topic in topics] == [(str(c['userID']), c['title']) for c in conversations]
+    assert highWaterMark == topics[-1].id
+    brainstormID = topics[5].id
+    assert matcher.topicIDs() == {topic.id for topic in topics} - {brainstormID}
+
+    # a fresh matcher serves the loaded topics straight from the snapshot
+    matcher.saveSnapshot(str(tmp_path / 'snapshots'), highWaterMark=highWaterMark)
+    restored = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, embedder=HashingEmbeddingProvider())
+    assert restored.loadSnapshot(str(tmp_path / 'snapshots'))['highWaterMark'] == highWaterMark
+    assert restored.topicIDs() == matcher.topicIDs()
+
+
+def test_cli_seeds_every_workers_snapshot_and_cache(chatApp, tmp_path, monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'stub')
+    monkeypatch.setattr(config, 'EMBEDDING_PROVIDER', 'hashing')
+    monkeypatch.setattr(config, 'WORKERS', 2)
+    monkeypatch.setattr(config, 'SNAPSHOT_ROOT', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_ROOT', str(tmp_path / 'embedding_cache'))
+    path = tmp_path / 'convs.json'
+    writeConversations(path, [{'title': f"Learning topic number {i}", 'userID': i % 3} for i in range(10)])
+
+    loader = init_database.main([str(path), '--batch-size', '4'])
+    # an offline load runs no background compaction or topic sync
+    assert loader.matcher.compactionThread is None and loader.topicSync.worker is None
+    topicIDs = loader.matcher.topicIDs()
+    assert len(topicIDs) == 10
+
+    embedder = HashingEmbeddingProvider(config.EMBEDDING_DIM)
+    for workerID in ('worker-0', 'worker-1'):
+        restored = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, embedder=embedder)
+        assert restored.loadSnapshot(str(tmp_path / 'snapshots' / workerID))['numTopics'] == 10
+        assert restored.topicIDs() == topicIDs
+        cache = EmbeddingCache(str(tmp_path / 'embedding_cache' / workerID), embedder.name)
+        assert len(cache) == 10
@@ -0,0 +1,205 @@
+"""
+Checks that chat latency stays flat while /bot-response saturates the server.
+
+For each server configuration this starts `serve.py` in a subprocess with its own
+temporary data directory, pointed at a local stub of the embeddings endpoint that
+answers after a configurable delay. After seeding users, topics and a chat over HTTP,
+it measures the Socket.IO round-trip of a chat message (emit 'new-message', receive
+the broadcast) on an idle server, then again while a pool of clients keeps
+/bot-response busy with uncached queries.
+
+Configurations:
+    threading         the development server, one OS thread per request
+    gevent-inline     gevent with blocking calls left on the event loop (pool size 0)
+    gevent            gevent with blocking calls moved to the native thread pool
+
+Usage:
+    python load_benchmark.py --latency-ms 200 --messages 50 --bot-clients 32
+"""
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import numpy as np
+import requests
+import socketio
+
+from embedding_benchmark import startStubServer
+
+CONFIGURATIONS = {
+    'threading': {'CHATMOS_SERVER_MODE': 'threading'},
+    'gevent-inline': {'CHATMOS_SERVER_MODE': 'gevent', 'CHATMOS_BLOCKING_POOL_SIZE': '0'},
+    'gevent': {'CHATMOS_SERVER_MODE': 'gevent'},
+}
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def startServer(name, dataDir, port, embeddingsURL, poolSize):
+    env = dict(os.environ, CHATMOS_DATA_DIR=dataDir, CHATMOS_HOST='127.0.0.1', CHATMOS_PORT=str(port),
+               CHATMOS_BLOCKING_POOL_SIZE=str(poolSize), CHATMOS_EMBEDDING_PROVIDER='openai',
+               OPENAI_API_BASE=embeddingsURL, OPENAI_API_KEY='stub')
+    env.update(CONFIGURATIONS[name])
+    log = open(os.path.join(dataDir, 'server.log'), 'w')
+    # own process group, so the development server's reloader child goes down with it
+    server = subprocess.Popen([sys.executable, 'serve.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    baseURL = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"{baseURL}/matcher-stats", timeout=1)
+            return server, baseURL
+        except requests.RequestException:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    stopServer(server)
+    raise RuntimeError(f"{name} server did not start; see {log.name}")
+
+
+def stopServer(server):
+    try:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(timeout=10)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+
+
+def seed(baseURL):
+    userIDs = [requests.post(f"{baseURL}/create-user").json()['uuid'] for _ in range(2)]
+    topicIDs = [requests.post(f"{baseURL}/user-topics/{userID}", json={'title': title}).json()['id']
+                for userID, title in zip(userIDs * 2, ["jazz piano", "trail running", "sourdough baking", "chess openings"])]
+    chat = requests.post(f"{baseURL}/create-chat", json={
+        'creatorTopicID': topicIDs[0], 'matchedTopicID': topicIDs[1],
+        'userCreatorID': userIDs[0], 'userMatchedID': userIDs[1]}).json()
+    return userIDs, chat['chatID']
+
+
+def connectChat(baseURL, userID, chatID):
+    """
+    Returns a Socket.IO client joined to the chat, and an event set whenever a message is broadcast to it.
+    """
+    client = socketio.Client()
+    received = threading.Event()
+    client.on('message', lambda data: received.set())
+    client.connect(baseURL)
+    client.emit('chat-join', {'userID': userID, 'room': chatID})
+    time.sleep(0.5)
+    return client, received
+
+
+def chatLatencies(client, received, userID, chatID, numMessages, timeout=10):
+    """
+    Returns the round-trip time, in seconds, of each of `numMessages` chat messages; None for
+    a message that was not broadcast back within `timeout` seconds or could not be sent.
+    """
+    latencies = []
+    for i in range(numMessages):
+        received.clear()
+        start = time.perf_counter()
+        try:
+            client.emit('new-message', {'chatID': chatID, 'senderID': userID, 'text': f"message {i}", 'topicInfo': None})
+        except socketio.exceptions.SocketIOError:
+            # the server stopped answering polls long enough to drop the connection
+            latencies.append(None)
+            continue
+        latencies.append(time.perf_counter() - start if received.wait(timeout) else None)
+        time.sleep(0.05)
+    return latencies
+
+
+def saturate(baseURL, userID, numClients, stopped):
+    """
+    Keeps `numClients` /bot-response requests in flight until `stopped` is set; returns the completion counter.
+    """
+    completed = [0]
+
+    def worker(clientNumber):
+        session = requests.Session()
+        i = 0
+        while not stopped.is_set():
+            # every query is new, so each one is embedded rather than served from the cache
+            try:
+                session.get(f"{baseURL}/bot-response", params={'topic': f"load {clientNumber} {i}", 'userID': userID}, timeout=60)
+                completed[0] += 1
+            except requests.RequestException:
+                pass
+            i += 1
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(numClients)]
+    for thread in threads:
+        thread.start()
+    return completed, threads
+
+
+def summarize(latencies):
+    """
+    Returns p50 and p99 in milliseconds over the delivered messages, and the number lost.
+    """
+    delivered = [latency for latency in latencies if latency is not None]
+    if not delivered:
+        return float('nan'), float('nan'), len(latencies)
+    p50, p99 = np.percentile(delivered, [50, 99]) * 1000
+    return p50, p99, len(latencies) - len(delivered)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency-ms', type=float, default=200, help="stub embeddings round-trip delay")
+    parser.add_argument('--messages', type=int, default=50, help="chat messages timed per phase")
+    parser.add_argument('--bot-clients', type=int, default=32, help="concurrent /bot-response clients")
+    parser.add_argument('--pool-size', type=int, default=16, help="blocking pool size for the gevent configuration")
+    parser.add_argument('--configurations', nargs='+', default=list(CONFIGURATIONS), choices=list(CONFIGURATIONS))
+    args = parser.parse_args()
+
+    stub = startStubServer(args.latency_ms / 1000, 1536)
+    embeddingsURL = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+
+    print(f"stub embedding latency {args.latency_ms:g} ms, {args.bot_clients} /bot-response clients, "
+          f"{args.messages} messages per phase")
+    print(f"{'server':>14} {'idle p50':>9} {'idle p99':>9} {'load p50':>9} {'load p99':>9} {'lost':>5} {'bot req/s':>10}")
+    for name in args.configurations:
+        with tempfile.TemporaryDirectory() as dataDir:
+            server, baseURL = startServer(name, dataDir, freePort(), embeddingsURL, args.pool_size)
+            try:
+                userIDs, chatID = seed(baseURL)
+                client, received = connectChat(baseURL, userIDs[0], chatID)
+                idle = summarize(chatLatencies(client, received, userIDs[0], chatID, args.messages))
+
+                stopped = threading.Event()
+                completed, threads = saturate(baseURL, userIDs[1], args.bot_clients, stopped)
+                time.sleep(2)
+                start, startCount = time.perf_counter(), completed[0]
+                loaded = summarize(chatLatencies(client, received, userIDs[0], chatID, args.messages))
+                throughput = (completed[0] - startCount) / (time.perf_counter() - start)
+                stopped.set()
+                for thread in threads:
+                    thread.join(timeout=60)
+                if client.connected:
+                    client.disconnect()
+                stored = requests.get(f"{baseURL}/chats/{chatID}", params={'limit': 2 * args.messages}).json()
+                numStored = len(stored) if isinstance(stored, list) else 0
+                if numStored != 2 * args.messages:
+                    print(f"{name}: only {numStored} of {2 * args.messages} messages were stored")
+            finally:
+                stopServer(server)
+        print(f"{name:>14} {idle[0]:>9.1f} {idle[1]:>9.1f} {loaded[0]:>9.1f} {loaded[1]:>9.1f} "
+              f"{idle[2] + loaded[2]:>5} {throughput:>10.1f}")
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
 import os
+import sys
+import atexit
+import signal
 
 import openai
+import socketio as socketio_lib
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_restful import Api
@@ -8,10 +12,22 @@ from flask_cors import CORS
 from langchain.llms import OpenAI
 from dotenv import load_dotenv
 
+import config
 from matching import TopicMatcher
+from embeddings import makeEmbeddingProvider
+from batching import QueryBatcher
+from scheduler import defaultScheduler
 from segway import TopicSegway
 from events import socketio, initEventHandler
 from data import setupModels
+from database import databaseURI, engineOptions, configureEngine
+from migrations import migrateDatabase
+from sequences import MessageSequencer, SharedMessageSequencer
+from ids import IDAllocator
+from topic_sync import TopicSync
+from blocking import BlockingPool
+from message_writer import MessageWriter
+from read_receipts import ReadReceiptBuffer
 from endpoints import setupEndpoints
 
 class ChatApplication:
@@ -25,44 +41,149 @@ class ChatApplication:
     def configureApp(self):
         CORS(self.app, resources={r"/*": {"origins": "*"}})
         self.api = Api(self.app)
-        # TODO: move the data.db path to a config file
-        self.dbPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+        self.dbPath = config.DATA_DIR
         os.makedirs(self.dbPath, exist_ok=True)
-        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(self.dbPath, 'test.db')
-        socketio.init_app(self.app, cors_allowed_origins="*")
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = databaseURI(self.dbPath)
+        self.app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engineOptions(self.app.config['SQLALCHEMY_DATABASE_URI'])
+        socketio.init_app(self.app, cors_allowed_origins="*", async_mode=config.SERVER_MODE, **self.messageQueueOptions())
+        self.blocking = BlockingPool(config.SERVER_MODE, config.BLOCKING_POOL_SIZE)
+
+    def messageQueueOptions(self):
+        """Returns the Socket.IO options that share room broadcasts between workers, if configured"""
+        if not config.MESSAGE_QUEUE:
+            return {}
+        if config.MESSAGE_QUEUE_OPTIONS:
+            # Flask-SocketIO has no way to pass transport options to kombu, so build its manager here
+            return {'client_manager': socketio_lib.KombuManager(
+                config.MESSAGE_QUEUE, channel='flask-socketio',
+                connection_options={'transport_options': config.MESSAGE_QUEUE_OPTIONS})}
+        return {'message_queue': config.MESSAGE_QUEUE}
 
     def setupDatabase(self):
         self.db = SQLAlchemy(self.app)
-        self.userID = 0
-        self.User, self.Topic, self.ChatMetadata, self.ChatMessage = setupModels(self.db)
+        self.User, self.Topic, self.ChatMetadata, self.ChatMessage, self.Counter, self.TopicChange = setupModels(self.db)
+        with self.app.app_context():
+            configureEngine(self.db.engine)
+            self.db.create_all()
+            migrateDatabase(self.db)
+        self.ids = IDAllocator(self)
+        self.topicSync = None
+        if config.WORKERS > 1:
+            # workers share nothing but the database and the message queue
+            self.sequencer = SharedMessageSequencer(self.ids, self)
+            self.topicSync = TopicSync(self, pollIntervalMs=config.TOPIC_SYNC_MS,
+                                       retentionSeconds=config.TOPIC_CHANGE_RETENTION_S)
+        else:
+            self.sequencer = MessageSequencer(self.getLastMessageNumber)
+        self.messageWriter = None
+        if config.MESSAGE_WRITE_BEHIND:
+            self.messageWriter = MessageWriter(self, batchSize=config.MESSAGE_BATCH_SIZE,
+                                               flushIntervalMs=config.MESSAGE_FLUSH_MS,
+                                               emit=self.blocking.threadsafe(socketio.emit))
+        self.readReceipts = ReadReceiptBuffer(self, flushIntervalMs=config.READ_RECEIPT_FLUSH_MS)
+        self.matcher = None
+        self.isShutDown = False
+        atexit.register(self.shutdown)
     
+    def getLastMessageNumber(self, chatID):
+        return self.db.session.query(self.db.func.max(self.ChatMessage.messageNumber)) \
+            .filter_by(chatID=chatID).scalar()
+
     def getNextUserID(self):
-        self.userID += 1
-        return self.userID
+        return self.ids.allocate('user')
 
     def initApiKey(self):
         """Loads the OpenAI API key from the .env file"""
         load_dotenv()  
         openai.api_key = os.getenv('OPENAI_API_KEY')
 
-    def setupTopicHelpers(self):
-        llm = OpenAI(model_name="text-davinci-003")  # Initialize your language model
-        self.matcher = TopicMatcher(llm, k=2)
-        self.segway = TopicSegway(llm)
+    def setupTopicHelpers(self, snapshotDir=None, cacheDir=None, background=True):
+        """
+        Builds the matcher from the latest snapshot plus whatever changed in the database since.
+
+        Parameters:
+           snapshotDir (str): Where snapshots are loaded from and saved to. Default is config.SNAPSHOT_DIR.
+           cacheDir (str): The embedding cache directory. Default is config.EMBEDDING_CACHE_DIR.
+           background (bool): Whether to start background compaction and topic syncing, which
+               offline tools such as init_database.py leave off. Default is True.
+        """
+        # retries are left to the scheduler, which backs off without holding up request threads
+        llm = OpenAI(model_name="text-davinci-003", max_retries=1)  # Initialize your language model
+        self.scheduler = defaultScheduler(config.SCHEDULER_WORKERS, config.EMBEDDING_REQUESTS_PER_SEC,
+                                          config.COMPLETION_REQUESTS_PER_SEC, config.SCHEDULER_MAX_QUEUED)
+        embedder = makeEmbeddingProvider(config.EMBEDDING_PROVIDER, config.EMBEDDING_ENGINE, config.EMBEDDING_DIM)
+        self.matcher = TopicMatcher(llm, k=2, embedder=embedder, cacheDir=cacheDir or config.EMBEDDING_CACHE_DIR,
+                                    indexType=config.INDEX_TYPE, minIndexSize=config.MIN_INDEX_SIZE,
+                                    useAlternates=config.USE_ALTERNATE_QUERIES, numAlternates=config.NUM_ALTERNATE_QUERIES,
+                                    alternateBudgetMs=config.ALTERNATE_QUERY_BUDGET_MS, scheduler=self.scheduler)
+        self.batcher = QueryBatcher(self.matcher, maxBatchSize=config.MATCH_BATCH_SIZE, maxWaitMs=config.MATCH_BATCH_WAIT_MS,
+                                    maxInFlight=config.MATCH_BATCHES_IN_FLIGHT, maxQueued=config.MATCH_MAX_QUEUED,
+                                    timeoutMs=config.MATCH_TIMEOUT_MS)
+        self.segway = TopicSegway(OpenAI(model_name="text-davinci-003", streaming=True, max_retries=1), scheduler=self.scheduler,
+                                  emit=self.blocking.threadsafe(socketio.emit))
+
+        if background and self.topicSync is not None:
+            # changes recorded from here on are replayed, so none fall between the load and the first poll
+            self.topicSync.skipExisting()
+
+        # start from the latest snapshot so only topics created or renamed since then need embedding
+        self.snapshotDir = snapshotDir or config.SNAPSHOT_DIR
+        self.matcher.loadSnapshot(self.snapshotDir)
 
         with self.app.app_context():
-            self.db.create_all()
-            topics = self.Topic.query.all()  # grab all topics from the database
+            topicTuples = self.db.session.query(self.Topic.id, self.Topic.userID, self.Topic.title).all()
+
+        # compare the snapshot with the database, which also catches changes other workers made
+        # while this one was down: drop topics deleted (or renamed to Brainstorm) since, and
+        # embed the ones created or renamed since
+        snapshotTitles = self.matcher.topicTitles()
+        titles = {topicID: title for topicID, _, title in topicTuples if title != "Brainstorm"}
+        for topicID in snapshotTitles.keys() - titles.keys():
+            self.matcher.removeTopic(topicID)
+        staleTuples = [(topicID, userID, title) for topicID, userID, title in topicTuples
+                       if topicID in titles and snapshotTitles.get(topicID) != title]
 
-        print(f"Loading {len(topics)} topics")
-        topicTuples = [(topic.id, topic.userID, topic.title) for topic in topics]
-        self.matcher.addTopics(topicTuples)
+        print(f"Loading {len(staleTuples)} topics")
+        self.matcher.addTopics(staleTuples)
+        self.matcher.saveSnapshot(self.snapshotDir, highWaterMark=max((topicID for topicID, _, _ in topicTuples), default=0))
+        if background:
+            self.matcher.startCompaction()
+            if self.topicSync is not None:
+                self.topicSync.start()
         print("Added topics")
 
+    def shutdown(self):
+        """Writes out buffered messages and read receipts and saves a topic snapshot; runs once, at exit or on a stop signal"""
+        if self.isShutDown:
+            return
+        self.isShutDown = True
+        if self.messageWriter is not None:
+            self.messageWriter.close()
+        self.readReceipts.close()
+        if self.topicSync is not None:
+            self.topicSync.close()
+        if self.matcher is not None:
+            self.matcher.stopCompaction.set()
+            self.matcher.saveSnapshot(self.snapshotDir)
+
+    def installSignalHandlers(self):
+        """Shuts down cleanly on SIGTERM and SIGINT; SIGTERM (how serve.py stops its workers) skips atexit handlers"""
+        def stop(signum, frame):
+            print(f"Received {signal.Signals(signum).name}, shutting down")
+            self.shutdown()
+            sys.exit(0)
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
     def run(self):
         self.initApiKey()
         self.setupTopicHelpers()
-        socketio.run(self.app, debug=True)
+        self.installSignalHandlers()
+        if config.SERVER_MODE == 'threading':
+            # the development server, with the reloader and debugger unless it is one of several workers
+            socketio.run(self.app, host=config.HOST, port=config.PORT, debug=config.WORKERS == 1, allow_unsafe_werkzeug=True)
+        else:
+            socketio.run(self.app, host=config.HOST, port=config.PORT)
 
 
 if __name__ == '__main__':
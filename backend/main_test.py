@@ -0,0 +1,114 @@
+import os
+import sys
+import signal
+import subprocess
+
+import numpy as np
+import pytest
+from langchain.llms.fake import FakeListLLM
+
+import config
+from embeddings import HashingEmbeddingProvider
+from matching import TopicMatcher
+
+
+@pytest.fixture
+def bootTopics(chatApp, tmp_path, monkeypatch):
+    """
+    Returns a function that runs the server's topic setup, as a boot would, and returns the new matcher.
+    """
+    monkeypatch.setenv('OPENAI_API_KEY', 'stub')
+    monkeypatch.setattr(config, 'EMBEDDING_PROVIDER', 'hashing')
+    monkeypatch.setattr(config, 'SNAPSHOT_DIR', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(config, 'EMBEDDING_CACHE_DIR', str(tmp_path / 'embedding_cache'))
+
+    def boot():
+        chatApp.setupTopicHelpers()
+        chatApp.matcher.stopCompaction.set()
+        return chatApp.matcher
+    return boot
+
+
+def embedding(matcher, topicID):
+    return matcher.store.vectors[matcher.store.rowOf[topicID]]
+
+
+def test_boot_catches_up_with_renames_made_while_down(chatApp, bootTopics):
+    with chatApp.app.app_context():
+        chatApp.db.session.add(chatApp.Topic(id=3, userID='u1', title="third"))
+        chatApp.db.session.commit()
+    assert bootTopics().topicTitles() == {1: "first", 2: "second", 3: "third"}
+
+    # another worker renames two topics while this one is down
+    with chatApp.app.app_context():
+        chatApp.db.session.get(chatApp.Topic, 2).title = "renamed"
+        chatApp.db.session.get(chatApp.Topic, 3).title = "Brainstorm"
+        chatApp.db.session.commit()
+
+    matcher = bootTopics()
+    assert matcher.topicTitles() == {1: "first", 2: "renamed"}
+    embedder = HashingEmbeddingProvider(config.EMBEDDING_DIM)
+    assert np.allclose(embedding(matcher, 2), embedder.embed(["renamed"])[0])
+
+
+def test_boot_embeds_only_topics_changed_since_the_snapshot(chatApp, bootTopics, capsys):
+    bootTopics()
+    assert "Loading 2 topics" in capsys.readouterr().out
+
+    # while the server is down, one topic is created and another deleted
+    with chatApp.app.app_context():
+        chatApp.db.session.add(chatApp.Topic(id=3, userID='u1', title="third"))
+        chatApp.db.session.delete(chatApp.db.session.get(chatApp.Topic, 1))
+        chatApp.db.session.commit()
+
+    matcher = bootTopics()
+    out = capsys.readouterr().out
+    assert "Loaded snapshot of 2 topics" in out and "Loading 1 topics" in out
+    assert matcher.topicTitles() == {2: "second", 3: "third"}
+
+    # and the snapshot saved at boot already accounts for both changes
+    bootTopics()
+    assert "Loading 0 topics" in capsys.readouterr().out
+    assert chatApp.matcher.topicIDs() == {2, 3}
+
+
+SHUTDOWN_SCRIPT = '''
+import time
+from datetime import datetime, timezone
+
+from main import ChatApplication
+
+chatApp = ChatApplication()
+chatApp.setupTopicHelpers()
+chatApp.installSignalHandlers()
+chatApp.messageWriter.submit({'chatID': 1, 'messageNumber': 0, 'senderID': 'u1', 'text': "hello",
+                              'topicID': None, 'timestamp': datetime.now(timezone.utc)})
+chatApp.readReceipts.record(1, 'u2', datetime.now(timezone.utc))
+chatApp.matcher.addTopic(3, 'u1', "third")
+print("ready", flush=True)
+time.sleep(60)
+'''
+
+
+def test_sigterm_writes_out_buffers_and_saves_a_snapshot(chatApp, tmp_path):
+    env = dict(os.environ, CHATMOS_DATA_DIR=str(tmp_path), CHATMOS_EMBEDDING_PROVIDER='hashing', OPENAI_API_KEY='stub',
+               CHATMOS_MESSAGE_WRITE_BEHIND='1', CHATMOS_MESSAGE_FLUSH_MS='60000', CHATMOS_READ_RECEIPT_FLUSH_MS='60000')
+    env.pop('CHATMOS_WORKER_ID', None)
+    worker = subprocess.Popen([sys.executable, '-c', SHUTDOWN_SCRIPT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    try:
+        for line in worker.stdout:
+            if line.strip() == "ready":
+                break
+        worker.send_signal(signal.SIGTERM)
+        output, _ = worker.communicate(timeout=30)
+    finally:
+        worker.kill()
+    assert worker.returncode == 0, output
+
+    with chatApp.app.app_context():
+        assert [message.text for message in chatApp.ChatMessage.query.filter_by(chatID=1)] == ["hello"]
+        assert chatApp.db.session.get(chatApp.ChatMetadata, 1).matchedLastViewedAt is not None
+    restored = TopicMatcher(FakeListLLM(responses=["alternate"]), embedder=HashingEmbeddingProvider(config.EMBEDDING_DIM))
+    restored.loadSnapshot(str(tmp_path / 'snapshots'))
+    assert restored.topicTitles() == {1: "first", 2: "second", 3: "third"}
@@ -1,8 +1,22 @@
+import os
+import json
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import numpy as np
-import faiss
-from openai.embeddings_utils import get_embedding
 
 from query import AsymmetricQueryHelper
+from embeddings import OpenAIEmbeddingProvider
+from embedding_cache import EmbeddingCache, normalizeText
+from query_cache import LRUCache
+from scheduler import defaultScheduler
+from topic_store import TopicStore
+from vector_index import AnnIndex, buildAnnIndex, reindexAnnIndex, minTrainSize
+
+
+SNAPSHOT_VERSION = 2
 
 
 class TopicMatcher:
@@ -12,27 +26,125 @@ class TopicMatcher:
 
     Attributes:
         k (int): Number of similar topics to find.
-        engine (str): The name of the embedding engine to use.
-        topicInfo (list): List of topic info (topicID, userID, topicName).
-        embeddings (list): List of embeddings for each topic.
-        index (faiss.Index): Index for searching embeddings.
+        embedder (EmbeddingProvider): Turns topic titles and queries into embeddings.
+        engine (str): The name of the embedding model; caches and snapshots are keyed by it.
+        store (TopicStore): Columnar storage for topic embeddings and metadata, or None until the first add.
+        indexType (str): One of 'flat', 'ivf-flat', 'ivf-pq' or 'hnsw'.
+        index (AnnIndex): Approximate index over the store rows, or None while searches are exact.
+        indexLock (threading.RLock): Guards the store and index against concurrent mutation.
+        generation (int): Counter bumped whenever topics are added or removed.
+        cache (EmbeddingCache): Persistent embedding cache, or None if caching is disabled.
+        resultCache (LRUCache): Recent matches keyed by (query, userID, k, generation).
+        queryEmbeddingCache (LRUCache): Recent query embeddings, kept across index generations.
+        useAlternates (bool): Whether matches also come from LLM-generated alternate queries.
+        alternateBudget (float): Seconds a request may spend on alternate queries before giving up on them.
+        scheduler (RequestScheduler): Runs the embedding and LLM calls.
     """
 
-    def __init__(self, llm, k=2, engine='text-embedding-ada-002'):
+    def __init__(self, llm, k=2, engine='text-embedding-ada-002', cacheDir=None, embedder=None,
+                 indexType='flat', indexParams=None, minIndexSize=10000, retrainGrowth=4,
+                 resultCacheSize=4096, resultCacheTTL=600, queryEmbeddingCacheSize=4096,
+                 useAlternates=False, numAlternates=5, alternateBudgetMs=1500, scheduler=None):
         """
         The constructor for TopicMatcher class.
 
         Parameters:
            k (int): Number of similar topics to find. Default is 2.
-           engine (str): The name of the embedding engine to use. Default is 'text-embedding-ada-002'.
+           engine (str): The name of the OpenAI embedding engine to use. Default is 'text-embedding-ada-002'.
+           cacheDir (str): Directory for the persistent embedding cache. Default is None (no cache).
+           embedder (EmbeddingProvider): Embedding backend. Default is the OpenAI API with `engine`.
+           indexType (str): 'flat' for exact search, or 'ivf-flat', 'ivf-pq' or 'hnsw'. Default is 'flat'.
+           indexParams (dict): Extra keyword arguments for AnnIndex. Default is None.
+           minIndexSize (int): Number of topics below which searches stay exact. Default is 10000.
+           retrainGrowth (float): Retrain the index once the corpus grows by this factor. Default is 4.
+           resultCacheSize (int): Number of recent match results to keep. Default is 4096.
+           resultCacheTTL (float): Seconds a cached match result stays valid. Default is 600.
+           queryEmbeddingCacheSize (int): Number of recent query embeddings to keep. Default is 4096.
+           useAlternates (bool): Whether to also match on alternate queries. Default is False.
+           numAlternates (int): Number of alternate queries to generate per request. Default is 5.
+           alternateBudgetMs (float): Per-request deadline for the alternate queries, in milliseconds. Default is 1500.
+           scheduler (RequestScheduler): Shared scheduler for upstream API calls. Default is a private one.
         """
         self.llm = llm
         self.k = k
-        self.engine = engine
-        self.topicInfo = []
-        self.embeddings = []
+        self.embedder = embedder or OpenAIEmbeddingProvider(engine)
+        self.engine = self.embedder.name
+        self.store = None
+        self.indexType = indexType
+        self.indexParams = indexParams or {}
+        self.minIndexSize = minIndexSize
+        self.retrainGrowth = retrainGrowth
         self.index = None
-        self.queryHelper = AsymmetricQueryHelper(llm)
+        self.indexLock = threading.RLock()
+        self.compactionLock = threading.Lock()
+        self.generation = 0
+        self.savedGeneration = None
+        self.compactionThread = None
+        self.stopCompaction = threading.Event()
+        self.cache = EmbeddingCache(cacheDir, self.engine) if cacheDir else None
+        self.resultCache = LRUCache(resultCacheSize, ttl=resultCacheTTL)
+        self.queryEmbeddingCache = LRUCache(queryEmbeddingCacheSize)
+        self.scheduler = scheduler or defaultScheduler()
+        self.queryHelper = AsymmetricQueryHelper(llm, scheduler=self.scheduler)
+        self.useAlternates = useAlternates
+        self.numAlternates = numAlternates
+        self.alternateBudget = alternateBudgetMs / 1000
+        self.alternatePool = ThreadPoolExecutor(max_workers=16, thread_name_prefix='alternate-query')
+
+    def embedTexts(self, texts, priority=1):
+        """
+        Embeds a list of texts, serving what it can from the embedding cache.
+
+        Misses from a remote provider go through the scheduler, so identical concurrent
+        requests share one API call; local providers are called directly.
+
+        Parameters:
+           texts (list): The texts to embed.
+           priority (int): Scheduler priority; queries use 0 to go ahead of topic embeddings. Default is 1.
+
+        Returns:
+           np.array: A float32 matrix with one row per text.
+        """
+        def fetch(missing):
+            if not self.embedder.remote:
+                return self.embedder.embed(missing)
+            return self.scheduler.call('embedding', self.embedder.embed, missing,
+                                       key=(self.engine, tuple(missing)), priority=priority)
+
+        if self.cache is None:
+            return np.asarray(fetch(texts), dtype='float32')
+        return self.cache.getMany(texts, fetch)
+
+    def embedQueries(self, queries):
+        """
+        Embeds user queries, serving repeats from an in-memory cache before the embedding cache.
+
+        Parameters:
+           queries (list): The queries to embed.
+
+        Returns:
+           np.array: A float32 matrix with one row per query.
+        """
+        keys = [normalizeText(query) for query in queries]
+        embeddings = [self.queryEmbeddingCache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, embedding in zip(keys, embeddings) if embedding is None))
+        if missing:
+            computed = dict(zip(missing, self.embedTexts(missing, priority=0)))
+            for key, embedding in computed.items():
+                self.queryEmbeddingCache.put(key, embedding)
+            embeddings = [computed[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)]
+        return np.vstack(embeddings).astype('float32')
+
+    def cacheStats(self):
+        """
+        Returns hit-rate statistics for the result, query embedding and persistent embedding caches.
+        """
+        return {
+            'results': self.resultCache.stats(),
+            'queryEmbeddings': self.queryEmbeddingCache.stats(),
+            'embeddings': self.cache.stats() if self.cache is not None else None,
+            'generation': self.generation,
+        }
 
     def addTopics(self, topicTuples):
         """
@@ -41,14 +153,16 @@ class TopicMatcher:
         Parameters:
            topicTuples (list): A list of tuples where each tuple contains a user ID and a topic title.
         """
-        for info in topicTuples:
-            topicID, _, title = info
-            if title == "Brainstorm": # skip Brainstorm chats
-                continue
-            self.topicInfo.append(info)
-            self.embeddings.append(get_embedding(title, engine=self.engine))
-            print(f"Added topic {topicID}")
-        self.buildIndex()
+        topicTuples = [info for info in topicTuples if info[2] != "Brainstorm"] # skip Brainstorm chats
+        if not topicTuples:
+            return
+        embeddings = self.embedTexts([title for _, _, title in topicTuples])
+        self.addEmbeddings(topicTuples, embeddings)
+        print(f"Added {len(topicTuples)} topics")
+        if self.needsRetraining():
+            self.compact()
+        if self.cache is not None:
+            print(f"Embedding cache: {self.cache.stats()}")
 
     def addTopic(self, topicID, userID, title):
         """
@@ -57,58 +171,378 @@ class TopicMatcher:
         Parameters:
            userID (str): The user ID associated with the topic.
            title (str): The title of the topic.
+
+        Returns:
+           np.array: The topic's embedding, or None if the topic was skipped.
         """
         if title == "Brainstorm": # skip Brainstorm chats
-            return
-        self.topicInfo.append((topicID, userID, title))
-        self.embeddings.append(get_embedding(title, engine=self.engine))
-        self.buildIndex()
+            return None
+        embedding = self.embedTexts([title])
+        self.addEmbeddings([(topicID, userID, title)], embedding)
+        return embedding[0]
+
+    def addEmbeddings(self, topicTuples, embeddings):
+        """
+        Inserts already-embedded topics into the store.
+
+        Each insert writes into the preallocated matrix, so adding one topic costs
+        O(d) regardless of the corpus size (amortized over the occasional doubling).
+
+        Parameters:
+           topicTuples (list): A list of (topicID, userID, title) tuples.
+           embeddings (np.array): A float32 matrix with one row per topic.
+        """
+        embeddings = np.asarray(embeddings, dtype='float32')
+        with self.indexLock:
+            if self.store is None:
+                self.store = TopicStore(embeddings.shape[1], capacity=max(1024, len(topicTuples)))
+            rows = self.store.add(topicTuples, embeddings)
+            if self.index is not None:
+                self.index.add(embeddings, rows)
+            self.generation += 1
+
+    def removeTopic(self, topicID):
+        """
+        Removes a topic from the matcher.
+
+        The topic's row is tombstoned rather than deleted, so removal is O(1); dead rows
+        are skipped by searches and dropped at the next compaction.
+
+        Parameters:
+           topicID (int): The ID of the topic to remove.
+
+        Returns:
+           bool: True if the topic was in the matcher.
+        """
+        with self.indexLock:
+            if self.store is None or self.store.remove(topicID) is None:
+                return False
+            self.generation += 1
+            return True
+
+    def updateTopic(self, topicID, userID, title):
+        """
+        Replaces the title (and therefore the embedding) of an existing topic.
+
+        Parameters:
+           topicID (int): The ID of the topic to update.
+           userID (str): The user ID associated with the topic.
+           title (str): The new title of the topic.
+
+        Returns:
+           np.array: The topic's new embedding, or None if the topic was removed instead.
+        """
+        if title == "Brainstorm":
+            self.removeTopic(topicID)
+            return None
+        embedding = self.embedTexts([title])
+        self.addEmbeddings([(topicID, userID, title)], embedding)
+        return embedding[0]
+
+    def compact(self):
+        """
+        Rebuilds the store without its dead rows, and rebuilds the ANN index on the result.
 
-    def buildIndex(self):
+        The index is only retrained when needsRetraining() says so; otherwise a copy of the
+        current one keeps its training and is refilled with the renumbered rows. The compacted
+        store and its index are built from a snapshot of the live rows outside the index lock;
+        rows added or removed while they were being built are replayed before both are swapped
+        in together. Compactions themselves run one at a time, since each replays its changes
+        against the store it started from.
         """
-        Builds the FAISS index from the current list of embeddings.
+        with self.compactionLock:
+            with self.indexLock:
+                if self.store is None:
+                    return
+                store = self.store
+                numSnapshot = store.size
+                keep = np.flatnonzero(store.alive[:numSnapshot])
+                retrain = self.needsRetraining()
+                oldIndex = self.index
+
+            compacted = store.take(keep)
+            index = None
+            if retrain:
+                index = buildAnnIndex(compacted, self.indexType, **self.indexParams)
+            elif oldIndex is not None:
+                index = reindexAnnIndex(oldIndex, compacted)
+
+            with self.indexLock:
+                store = self.store
+                for row in keep[~store.alive[keep]]: # removed during the rebuild
+                    compacted.remove(int(store.topicIDs[row]))
+                newRows = [row for row in range(numSnapshot, store.size) if store.alive[row]]
+                if newRows:
+                    rows = compacted.add([store.info(row) for row in newRows], store.vectors[newRows])
+                    if index is not None:
+                        index.add(store.vectors[newRows], rows)
+                numDropped = store.size - compacted.size
+                self.store = compacted
+                self.index = index
+        print(f"Compacted topic store, dropped {numDropped} dead rows" +
+              (f", trained {self.indexType} index on {index.trainedSize} topics" if retrain and index is not None else ""))
+
+    def needsCompaction(self, minDead=64, maxDeadFraction=0.1):
+        """
+        Returns True once dead rows make up enough of the store to be worth a rebuild:
+        at least `minDead` of them, and more than `maxDeadFraction` of all rows.
+        """
+        with self.indexLock:
+            if self.store is None:
+                return False
+            numDead = self.store.numDead
+            return numDead >= minDead and numDead > maxDeadFraction * max(self.store.size, 1)
+
+    def needsRetraining(self):
+        """
+        Returns True when the ANN index should be (re)built: the corpus has become large
+        enough to train one, or has grown by `retrainGrowth` since the last training.
+        """
+        with self.indexLock:
+            if self.indexType == 'flat' or self.store is None:
+                return False
+            numLive = len(self.store)
+            if self.index is None:
+                params = self.indexParams
+                trainSize = minTrainSize(self.indexType, numLive, params.get('nlist'), params.get('pqBits', 8))
+                return numLive >= max(self.minIndexSize, trainSize)
+            return numLive >= self.retrainGrowth * self.index.trainedSize
+
+    def startCompaction(self, interval=60):
         """
-        embeddings = np.array(self.embeddings).astype('float32')
-        d = embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(d)
-        self.index.add(embeddings)
+        Starts a background thread that periodically compacts the store and retrains the index.
+
+        Parameters:
+           interval (float): Seconds between compaction checks. Default is 60.
+        """
+        def run():
+            while not self.stopCompaction.wait(interval):
+                try:
+                    if self.needsCompaction() or self.needsRetraining():
+                        self.compact()
+                except Exception as e:
+                    print(f"Topic compaction failed: {type(e).__name__}: {e}")
+
+        self.compactionThread = threading.Thread(target=run, name='topic-compaction', daemon=True)
+        self.compactionThread.start()
+
+    def saveSnapshot(self, snapshotDir, highWaterMark=0, keep=2):
+        """
+        Persists the matcher's state to a new versioned snapshot directory.
+
+        The row count, liveness mask and serialized index are captured under the lock, and
+        everything is written to a temporary directory that is renamed into place, so readers
+        never see a half-written snapshot.
+
+        Parameters:
+           snapshotDir (str): The root directory holding all snapshots.
+           highWaterMark (int): Highest topic ID the snapshot accounts for, if above any stored topic.
+           keep (int): How many of the most recent snapshots to retain. Default is 2.
+
+        Returns:
+           str: The path of the new snapshot, or None if nothing changed since the last save.
+        """
+        with self.indexLock:
+            if self.store is None or self.savedGeneration == self.generation:
+                return None
+            store = self.store
+            generation = self.generation
+            size = store.size
+            alive = store.alive[:size].copy()
+            indexData = self.index.serialize() if self.index is not None else None
+            trainedSize = self.index.trainedSize if self.index is not None else 0
+
+        os.makedirs(snapshotDir, exist_ok=True)
+        existing = listSnapshots(snapshotDir)
+        version = existing[-1][0] + 1 if existing else 1
+        path = os.path.join(snapshotDir, f"snapshot-{version:06d}")
+        tmpPath = path + '.tmp'
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        os.makedirs(tmpPath)
+
+        store.save(tmpPath, size, alive)
+        if indexData is not None:
+            indexData.tofile(os.path.join(tmpPath, 'index.faiss'))
+        manifest = {
+            'formatVersion': SNAPSHOT_VERSION,
+            'engine': self.engine,
+            'dim': store.dim,
+            'numTopics': int(alive.sum()),
+            'highWaterMark': int(max(highWaterMark, store.topicIDs[:size].max(initial=0))),
+            'indexType': self.indexType if indexData is not None else 'flat',
+            'indexTrainedSize': trainedSize,
+            'createdAt': time.time(),
+        }
+        with open(os.path.join(tmpPath, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmpPath, path)
+        self.savedGeneration = generation
+
+        for _, oldPath in listSnapshots(snapshotDir)[:-keep]:
+            shutil.rmtree(oldPath, ignore_errors=True)
+        print(f"Saved snapshot of {manifest['numTopics']} topics to {path}")
+        return path
+
+    def loadSnapshot(self, snapshotDir):
+        """
+        Replaces the matcher's state with the most recent compatible snapshot.
+
+        Parameters:
+           snapshotDir (str): The root directory holding all snapshots.
+
+        Returns:
+           dict: The snapshot manifest, or None if no compatible snapshot was found.
+        """
+        for _, path in reversed(listSnapshots(snapshotDir)):
+            with open(os.path.join(path, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+            if manifest['formatVersion'] != SNAPSHOT_VERSION or manifest['engine'] != self.engine:
+                print(f"Skipping incompatible snapshot {path}")
+                continue
+            store = TopicStore.load(path)
+            index = None
+            if manifest['indexType'] == self.indexType and self.indexType != 'flat':
+                indexData = np.fromfile(os.path.join(path, 'index.faiss'), dtype='uint8')
+                index = AnnIndex.deserialize(self.indexType, indexData, manifest['indexTrainedSize'])
+            with self.indexLock:
+                self.store = store
+                self.index = index
+                self.generation += 1
+                self.savedGeneration = self.generation
+            print(f"Loaded snapshot of {len(store)} topics from {path}")
+            return manifest
+        return None
+
+    def topicIDs(self):
+        """
+        Returns the set of topic IDs currently in the matcher.
+        """
+        with self.indexLock:
+            return set(self.store.rowOf) if self.store is not None else set()
+
+    def topicTitles(self):
+        """
+        Returns a dict mapping each topic ID in the matcher to the title it was embedded from.
+        """
+        with self.indexLock:
+            if self.store is None:
+                return {}
+            return {topicID: self.store.titles[row] for topicID, row in self.store.rowOf.items()}
 
     def searchIndexWithQuery(self, embedding, userID, k, selectedTopicIDs=None):
         """
         Retrieves the most similar topics to the provided query.
 
+        The caller's own topics and any already selected topics are excluded inside the
+        search itself, so the result is only short of k when fewer than k eligible topics
+        exist. If an approximate index comes back short (its probed lists or graph
+        neighbourhood ran out of eligible topics), the search falls back to one exact scan.
+
+        When `embedding` has several rows, they are searched together and their neighbours
+        are merged by distance, so each topic appears at most once.
+
         Parameters:
-           embedding (np.array): The embedding used to search the vector store.
+           embedding (np.array): The embedding(s) used to search the vector store, one per row.
            userID (str): The ID of the user making the query.
            k (int): The number of similar topics to return.
+           selectedTopicIDs (set): Topic IDs to leave out of the results. Default is None.
 
         Returns:
            list: A list of dictionaries, each containing the topic name, topic ID, and user ID for a similar topic.
         """
-        D, I = self.index.search(embedding, 6*k)
-        res = []
-        for idx, score in zip(I[0], D[0]):
-            topicID, userCreatorID, title = self.topicInfo[idx]
-            print('Search results: ', topicID, userCreatorID, title)
-            if selectedTopicIDs and topicID in selectedTopicIDs:
-                continue
-            if userCreatorID == userID:
-                continue
+        with self.indexLock:
+            if self.store is None:
+                return []
+            valid = self.store.eligibleRows(userID, selectedTopicIDs)
+            numEligible = int(valid.sum())
+            if self.index is None:
+                scores, rows = mergeNeighbours(*self.store.search(embedding, k, valid), k)
+            else:
+                scores, rows = mergeNeighbours(*self.index.search(embedding, k, valid), k)
+                if len(rows) < min(k, numEligible):
+                    scores, rows = mergeNeighbours(*self.store.search(embedding, k, valid), k)
+            topicInfo = [self.store.info(row) for row in rows]
+        return formatMatches(topicInfo, scores)
+
+    def searchBatch(self, embeddings, userIDs, k):
+        """
+        Retrieves the most similar topics for several queries with one multi-row search.
+
+        The shared search only excludes dead rows, so each row is filtered for its own user
+        afterwards; any row left with fewer than k matches is re-run on its own with the
+        exact per-user filter, so batching never returns fewer results than a single query.
+
+        Parameters:
+           embeddings (np.array): A float32 matrix with one query embedding per row.
+           userIDs (list): The ID of the user making each query.
+           k (int): The number of similar topics to return per query.
+
+        Returns:
+           list: One list of matches (as returned by searchIndexWithQuery) per query.
+        """
+        embeddings = np.asarray(embeddings, dtype='float32')
+        results, short = [], []
+        with self.indexLock:
+            if self.store is None:
+                return [[] for _ in userIDs]
+            store = self.store
+            if self.index is None:
+                D, I = store.search(embeddings, 6*k)
+            else:
+                D, I = self.index.search(embeddings, 6*k, store.alive[:store.size])
+            for q, userID in enumerate(userIDs):
+                code = store.userCodeOf.get(userID)
+                hits = [(row, score) for row, score in zip(I[q], D[q]) if row >= 0 and store.userCodes[row] != code][:k]
+                if len(hits) < k:
+                    short.append(q)
+                results.append(([store.info(row) for row, _ in hits], [score for _, score in hits]))
+
+        results = [formatMatches(topicInfo, scores) for topicInfo, scores in results]
+        for q in short:
+            results[q] = self.searchIndexWithQuery(embeddings[q:q + 1], userIDs[q], k)
+        return results
 
-            print(f"Topic {topicID} has score {score}. \nTopic: {title}\n")
-            res.append({
-                "topicName": title,
-                "topicID": topicID,
-                "userID": userCreatorID
-            })
-            if len(res) == k:
-                break
-        return res
+    def resultKey(self, query, userID):
+        # read the generation before searching so a concurrent change can only make the key older
+        return (normalizeText(query), userID, self.k, self.generation)
+
+    def cachedSimilarTopics(self, query, userID):
+        """
+        Returns the cached matches for a query, or None if they would have to be computed.
+        """
+        return self.resultCache.get(self.resultKey(query, userID))
+
+    def getSimilarTopicsBatch(self, queries, userIDs, checkCache=True):
+        """
+        Retrieves the most similar topics for several queries with one embedding call and one search.
+
+        Parameters:
+           queries (list): The queries to find similar topics for.
+           userIDs (list): The ID of the user making each query.
+           checkCache (bool): Whether to look the queries up in the result cache first; False when
+               the caller has just done so. Default is True.
+
+        Returns:
+           list: One list of matches per query, in the same order.
+        """
+        keys = [self.resultKey(query, userID) for query, userID in zip(queries, userIDs)]
+        results = [self.resultCache.get(key) if checkCache else None for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            embeddings = self.embedQueries([queries[i] for i in missing])
+            computed = self.searchBatch(embeddings, [userIDs[i] for i in missing], self.k)
+            for i, result in zip(missing, computed):
+                self.resultCache.put(keys[i], result)
+                results[i] = result
+        return results
 
     def getSimilarTopics(self, query, userID):
         """
         Retrieves the most similar topics to the provided query.
 
+        Results are cached per (normalized query, user, k, index generation); any add or
+        remove bumps the generation, so a cached result is never served once it is stale.
+
         Parameters:
            query (str): The query to find similar topics for.
            userID (str): The ID of the user making the query.
@@ -116,24 +550,109 @@ class TopicMatcher:
         Returns:
            list: A list of dictionaries, each containing the topic name, topic ID, and user ID for a similar topic.
         """
-        queryEmbedding = get_embedding(query, engine=self.engine)
-        queryEmbedding = np.array([queryEmbedding]).astype('float32')
+        key = self.resultKey(query, userID)
+        cached = self.resultCache.get(key)
+        if cached is not None:
+            return cached
+
+        if self.useAlternates:
+            results = self.getSimilarTopicsWithAlternates(query, userID)
+        else:
+            queryEmbedding = self.embedQueries([query])
+            results = self.searchIndexWithQuery(queryEmbedding, userID, self.k)
+        self.resultCache.put(key, results)
+        return results
+
+    def getSimilarTopicsWithAlternates(self, query, userID):
+        """
+        Matches on the original query plus LLM-generated alternate queries, within a deadline.
+
+        The alternates are generated in the background while the original query is embedded
+        and searched. If they are ready by three quarters of the way to the deadline, they are
+        embedded in one batch and searched as a single multi-row search, leaving the last quarter
+        for that embedding call; otherwise the original results are returned.
+
+        Parameters:
+           query (str): The query to find similar topics for.
+           userID (str): The ID of the user making the query.
+
+        Returns:
+           list: A list of dictionaries, each containing the topic name, topic ID, and user ID for a similar topic.
+        """
+        start = time.monotonic()
+        deadline = start + self.alternateBudget
+        # the scheduler drops alternate calls that are still queued when their results could no longer be used
+        alternateFuture = self.alternatePool.submit(self.queryHelper.getAlternateQuery, query, self.numAlternates,
+                                                    timeout=0.75 * self.alternateBudget)
+
+        queryEmbedding = self.embedQueries([query])
         originalResults = self.searchIndexWithQuery(queryEmbedding, userID, self.k)
-        return originalResults
 
-        # TODO: profile the timing of altnerate queries, and implement them efficiently
+        generationDeadline = start + 0.75 * self.alternateBudget
+        done, _ = wait([alternateFuture], timeout=max(0.0, generationDeadline - time.monotonic()))
+        if not done:
+            alternateFuture.cancel()
+        alternateQueries = alternateFuture.result() if done and alternateFuture.exception() is None else []
+        print(f"Alternate queries ({len(alternateQueries)}/{self.numAlternates} within budget): {alternateQueries}\n")
+        if not alternateQueries:
+            return originalResults
+
+        embedFuture = self.alternatePool.submit(self.embedQueries, alternateQueries)
+        done, _ = wait([embedFuture], timeout=max(0.0, deadline - time.monotonic()))
+        if not done or embedFuture.exception() is not None:
+            return originalResults
 
-        # alternateQueries = self.queryHelper.getAlternateQuery(query, numAlternates=5)
-        # alternateEmbeddings = [get_embedding(alternateQuery, engine=self.engine) for alternateQuery in alternateQueries]
-        # alternateEmbeddings = np.array(alternateEmbeddings).astype('float32')
+        numDesiredOriginal = self.k // 2
+        numDesiredAlternate = self.k - numDesiredOriginal
+        selectedTopics = set([topic['topicID'] for topic in originalResults[:numDesiredOriginal]])
+        alternateResults = self.searchIndexWithQuery(embedFuture.result(), userID, numDesiredAlternate, selectedTopics)
 
-        # numDesiredOriginal = self.k // 2
-        # numDesiredAlternate = self.k - numDesiredOriginal
+        # top up from the original results if the alternates found too few new topics
+        selectedTopics.update(topic['topicID'] for topic in alternateResults)
+        fillers = [topic for topic in originalResults[numDesiredOriginal:] if topic['topicID'] not in selectedTopics]
+        return originalResults[:numDesiredOriginal] + alternateResults + fillers[:numDesiredAlternate - len(alternateResults)]
 
-        # originalResults = self.searchIndexWithQuery(queryEmbedding, userID, numDesiredOriginal)
-        # selectedTopics = set([topic['topicID'] for topic in originalResults])
+def mergeNeighbours(D, I, k):
+    """
+    Merges multi-row search results into the k closest distinct rows, in order of distance.
+    """
+    scores, rows, seen = [], [], set()
+    for flat in np.argsort(D, axis=None, kind='stable'):
+        row = I.flat[flat]
+        if row < 0 or row in seen:
+            continue
+        seen.add(row)
+        rows.append(row)
+        scores.append(D.flat[flat])
+        if len(rows) == k:
+            break
+    return scores, rows
+
+
+def formatMatches(topicInfo, scores):
+    """
+    Converts (topicID, userID, title) tuples into the match dictionaries returned to clients.
+    """
+    res = []
+    for (topicID, userCreatorID, title), score in zip(topicInfo, scores):
+        print(f"Topic {topicID} has score {score}. \nTopic: {title}\n")
+        res.append({
+            "topicName": title,
+            "topicID": topicID,
+            "userID": userCreatorID
+        })
+    return res
 
-        # print(f"Alternate queries: {alternateQueries}\n")
-        # alternateResults = self.searchIndexWithQuery(alternateEmbeddings, userID, numDesiredAlternate, selectedTopics)
 
-        # return originalResults + alternateResults
\ No newline at end of file
+def listSnapshots(snapshotDir):
+    """
+    Returns (version, path) pairs for the complete snapshots in a directory, oldest first.
+    """
+    if not os.path.isdir(snapshotDir):
+        return []
+    snapshots = []
+    for name in os.listdir(snapshotDir):
+        path = os.path.join(snapshotDir, name)
+        if name.startswith('snapshot-') and not name.endswith('.tmp') and os.path.exists(os.path.join(path, 'manifest.json')):
+            snapshots.append((int(name[len('snapshot-'):]), path))
+    return sorted(snapshots)
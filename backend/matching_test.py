@@ -0,0 +1,303 @@
+import time
+import threading
+
+import numpy as np
+import pytest
+from langchain.llms.fake import FakeListLLM
+
+import embeddings
+import matching
+from matching import TopicMatcher
+
+
+DIM = 32
+
+
+def makeMatcher(indexType='flat'):
+    # small PQ codebooks so IVF-PQ can train on a test-sized corpus
+    return TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, indexType=indexType,
+                        indexParams={'pqBits': 6} if indexType == 'ivf-pq' else None, minIndexSize=1000)
+
+
+def addClusteredTopics(matcher, heavyUserTopics=3000, otherTopics=200, seed=0):
+    """
+    Gives one adversarial user thousands of topics packed right around the query, with
+    everyone else's topics further out, so a fixed over-fetch window only sees the heavy user.
+    """
+    rng = np.random.default_rng(seed)
+    query = rng.standard_normal(DIM).astype('float32')
+    heavy = query + 0.01 * rng.standard_normal((heavyUserTopics, DIM)).astype('float32')
+    others = query + 1.0 * rng.standard_normal((otherTopics, DIM)).astype('float32')
+
+    topics = [(i, 'heavy', f"heavy topic {i}") for i in range(heavyUserTopics)]
+    topics += [(heavyUserTopics + i, f"user-{i % 20}", f"other topic {i}") for i in range(otherTopics)]
+    matcher.addEmbeddings(topics, np.vstack([heavy, others]))
+    if matcher.needsRetraining():
+        matcher.compact()
+    return query[None, :]
+
+
+@pytest.mark.parametrize('indexType', ['flat', 'ivf-flat', 'ivf-pq', 'hnsw'])
+def test_heavy_user_always_gets_k_matches(indexType):
+    matcher = makeMatcher(indexType)
+    query = addClusteredTopics(matcher)
+    assert indexType == 'flat' or matcher.index is not None
+
+    for k in (2, 10, 50):
+        results = matcher.searchIndexWithQuery(query, 'heavy', k)
+        assert len(results) == k
+        assert all(result['userID'] != 'heavy' for result in results)
+
+
+@pytest.mark.parametrize('indexType', ['flat', 'hnsw'])
+def test_selected_and_removed_topics_are_excluded(indexType):
+    matcher = makeMatcher(indexType)
+    query = addClusteredTopics(matcher)
+
+    first = matcher.searchIndexWithQuery(query, 'heavy', 2)
+    selected = {result['topicID'] for result in first}
+    second = matcher.searchIndexWithQuery(query, 'heavy', 2, selectedTopicIDs=selected)
+    assert len(second) == 2
+    assert not selected & {result['topicID'] for result in second}
+
+    for result in second:
+        matcher.removeTopic(result['topicID'])
+    third = matcher.searchIndexWithQuery(query, 'heavy', 2, selectedTopicIDs=selected)
+    assert len(third) == 2
+    assert not (selected | {result['topicID'] for result in second}) & {result['topicID'] for result in third}
+
+
+@pytest.mark.parametrize('indexType', ['flat', 'hnsw'])
+def test_changes_during_compaction_are_replayed(indexType, monkeypatch):
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, indexType=indexType, minIndexSize=100)
+    vectors = np.random.default_rng(1).standard_normal((601, DIM)).astype('float32')
+    matcher.addEmbeddings([(i, f"user-{i % 10}", f"topic {i}") for i in range(500)], vectors[:500])
+    for topicID in range(0, 100, 2):
+        matcher.removeTopic(topicID) # dead rows for the compaction to drop
+
+    # once the live rows are copied out, the rebuild runs outside the lock while other threads edit the matcher
+    store = matcher.store
+    take = store.take
+
+    def takeThenEdit(rows):
+        compacted = take(rows)
+        matcher.removeTopic(101) # copied into the rebuild
+        matcher.addEmbeddings([(i, 'late', f"late topic {i}") for i in range(500, 600)], vectors[500:600])
+        matcher.removeTopic(550) # added during the rebuild
+        matcher.addEmbeddings([(103, 'user-3', "topic 103 renamed")], vectors[600:]) # re-added with a new embedding
+        return compacted
+    monkeypatch.setattr(store, 'take', takeThenEdit)
+    matcher.compact()
+
+    expected = (set(range(600)) - set(range(0, 100, 2))) - {101, 550}
+    assert matcher.topicIDs() == expected
+    # rows removed during the rebuild stay behind as tombstones until the next compaction
+    assert matcher.store is not store and len(matcher.store) == len(expected) and matcher.store.numDead == 2
+    assert (matcher.index is not None) == (indexType == 'hnsw')
+    assert matcher.topicTitles()[103] == "topic 103 renamed"
+
+    def nearest(vector, k=1):
+        return [result['topicID'] for result in matcher.searchIndexWithQuery(vector[None, :], 'nobody', k)]
+    for topicID in (1, 99, 102, 499, 500, 599):
+        assert nearest(vectors[topicID]) == [topicID]
+    assert nearest(vectors[600]) == [103]
+    for topicID in (0, 101, 550):
+        assert topicID not in nearest(vectors[topicID], k=10)
+    assert 103 not in nearest(vectors[103], k=10)
+
+
+def test_concurrent_compactions_run_one_at_a_time():
+    matcher = makeMatcher()
+    vectors = np.random.default_rng(4).standard_normal((20000, DIM)).astype('float32')
+    matcher.addEmbeddings([(i, f"user-{i % 50}", f"topic {i}") for i in range(20000)], vectors)
+    for topicID in range(0, 20000, 3):
+        matcher.removeTopic(topicID)
+
+    errors = []
+
+    def compact():
+        try:
+            matcher.compact()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=compact) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert matcher.store.numDead == 0 and matcher.topicIDs() == set(range(20000)) - set(range(0, 20000, 3))
+
+
+def test_compaction_waits_for_enough_dead_rows_and_keeps_the_index_training(monkeypatch):
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, indexType='ivf-flat', minIndexSize=100)
+    vectors = np.random.default_rng(5).standard_normal((3000, DIM)).astype('float32')
+    matcher.addEmbeddings([(i, f"user-{i % 10}", f"topic {i}") for i in range(3000)], vectors)
+    matcher.compact()
+    assert matcher.index is not None and matcher.index.trainedSize == 3000
+
+    # 64 dead rows out of 3000 is not worth copying the whole store for
+    for topicID in range(64):
+        matcher.removeTopic(topicID)
+    assert not matcher.needsCompaction()
+    for topicID in range(64, 400):
+        matcher.removeTopic(topicID)
+    assert matcher.needsCompaction() and not matcher.needsRetraining()
+
+    # dropping dead rows renumbers the index without another k-means run
+    def noTraining(*args, **kwargs):
+        raise AssertionError("retrained without growth")
+    monkeypatch.setattr(matching, 'buildAnnIndex', noTraining)
+    matcher.compact()
+    assert matcher.store.numDead == 0 and matcher.index.trainedSize == 3000
+    assert matcher.index.index.ntotal == len(matcher.store) == 2600
+    for topicID in (400, 1234, 2999):
+        assert matcher.searchIndexWithQuery(vectors[topicID][None, :], 'nobody', 1)[0]['topicID'] == topicID
+
+
+def test_background_compaction_survives_errors(monkeypatch):
+    matcher = makeMatcher()
+    matcher.addEmbeddings([(0, 'u', "topic")], np.ones((1, DIM), dtype='float32'))
+    attempts = []
+
+    def failingCompact():
+        attempts.append(time.monotonic())
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(matcher, 'needsCompaction', lambda: True)
+    monkeypatch.setattr(matcher, 'compact', failingCompact)
+    matcher.startCompaction(interval=0.01)
+    time.sleep(0.2)
+    matcher.stopCompaction.set()
+    assert len(attempts) >= 2
+
+
+@pytest.mark.parametrize('indexType', ['flat', 'hnsw'])
+def test_snapshot_round_trip(indexType, tmp_path):
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, indexType=indexType, minIndexSize=100)
+    vectors = np.random.default_rng(2).standard_normal((300, DIM)).astype('float32')
+    matcher.addEmbeddings([(i, f"user-{i % 7}", f"topic {i}") for i in range(300)], vectors)
+    for topicID in range(0, 300, 3):
+        matcher.removeTopic(topicID)
+    if matcher.needsRetraining():
+        matcher.compact()
+
+    assert matcher.saveSnapshot(str(tmp_path), highWaterMark=400) is not None
+    assert matcher.saveSnapshot(str(tmp_path)) is None # nothing changed since
+
+    restored = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, indexType=indexType, minIndexSize=100)
+    manifest = restored.loadSnapshot(str(tmp_path))
+    assert manifest['highWaterMark'] == 400 and manifest['numTopics'] == 200
+    assert restored.topicTitles() == matcher.topicTitles()
+    assert (restored.index is not None) == (indexType == 'hnsw')
+    queries = vectors[:20] + 0.1
+    for query in queries:
+        assert restored.searchIndexWithQuery(query[None, :], 'user-0', 5) == matcher.searchIndexWithQuery(query[None, :], 'user-0', 5)
+
+    # snapshots from another embedding engine are skipped rather than mixed in
+    other = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, embedder=embeddings.HashingEmbeddingProvider(DIM))
+    assert other.loadSnapshot(str(tmp_path)) is None and other.topicIDs() == set()
+
+
+def test_snapshots_keep_only_the_newest(tmp_path):
+    matcher = makeMatcher()
+    vectors = np.random.default_rng(3).standard_normal((4, DIM)).astype('float32')
+    for i in range(4):
+        matcher.addEmbeddings([(i, 'u', f"topic {i}")], vectors[i:i + 1])
+        matcher.saveSnapshot(str(tmp_path), keep=2)
+    assert [version for version, _ in matching.listSnapshots(str(tmp_path))] == [3, 4]
+
+    restored = makeMatcher()
+    assert restored.loadSnapshot(str(tmp_path))['numTopics'] == 4
+    assert restored.topicIDs() == {0, 1, 2, 3}
+
+
+def test_returns_fewer_only_when_too_few_eligible():
+    matcher = makeMatcher()
+    query = addClusteredTopics(matcher, heavyUserTopics=2000, otherTopics=1)
+    assert len(matcher.searchIndexWithQuery(query, 'heavy', 2)) == 1
+    assert matcher.searchIndexWithQuery(query, 'nobody', 2)[0]['userID'] == 'heavy'
+
+
+def test_get_similar_topics_uses_cached_embeddings(fakeEmbeddingAPI, tmp_path):
+    calls = []
+
+    def fakeEmbeddings(texts, engine):
+        calls.append(list(texts))
+        return [np.full(DIM, len(text), dtype='float32') for text in texts]
+
+    fakeEmbeddingAPI(fakeEmbeddings)
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, cacheDir=str(tmp_path))
+    matcher.addTopics([(1, 'a', 'short'), (2, 'b', 'a longer title'), (3, 'b', 'Brainstorm'), (4, 'c', 'medium one')])
+
+    results = matcher.getSimilarTopics('query text', 'a')
+    assert [result['topicID'] for result in results] == [4, 2]
+    assert len(calls) == 2
+
+    warm = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2, cacheDir=str(tmp_path))
+    warm.addTopics([(1, 'a', 'short'), (2, 'b', 'a longer title'), (4, 'c', 'medium one')])
+    assert warm.getSimilarTopics('query text', 'a') == results
+    assert len(calls) == 2
+    assert warm.cache.stats()['hits'] == 4
+
+
+def test_result_cache_is_invalidated_by_index_changes(fakeEmbeddingAPI):
+    calls = []
+
+    def fakeEmbeddings(texts, engine):
+        calls.append(list(texts))
+        return [np.full(DIM, len(text), dtype='float32') for text in texts]
+
+    fakeEmbeddingAPI(fakeEmbeddings)
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=2)
+    matcher.addTopics([(1, 'a', 'abc'), (2, 'b', 'abcd'), (3, 'c', 'abcdefgh')])
+    calls.clear()
+
+    first = matcher.getSimilarTopics('query', 'z')
+    assert matcher.getSimilarTopics(' query ', 'z') == first
+    assert matcher.cacheStats()['results']['hits'] == 1
+    assert len(calls) == 1
+
+    matcher.addTopic(4, 'd', 'abcde')
+    second = matcher.getSimilarTopics('query', 'z')
+    assert [result['topicID'] for result in second] == [4, 2]
+    assert len(calls) == 2 # the new topic, but not the query again
+
+    matcher.removeTopic(4)
+    assert matcher.getSimilarTopics('query', 'z') == first
+    assert len(calls) == 2
+    assert matcher.cacheStats()['queryEmbeddings']['hits'] == 2
+
+
+class SlowAlternates:
+    """
+    Stands in for AsymmetricQueryHelper, answering after a fixed delay.
+    """
+
+    def __init__(self, delay, alternates):
+        self.delay = delay
+        self.alternates = alternates
+
+    def getAlternateQuery(self, query, numAlternates=1, timeout=None):
+        time.sleep(self.delay)
+        return self.alternates[:numAlternates]
+
+
+def test_alternates_respect_the_deadline(fakeEmbeddingAPI):
+    # squared lengths, so no two topics tie for distance to a query
+    fakeEmbeddingAPI(lambda texts, engine: [np.full(DIM, len(text) ** 2, dtype='float32') for text in texts])
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), k=4, useAlternates=True,
+                           numAlternates=2, alternateBudgetMs=200)
+    matcher.addTopics([(i, f"user-{i}", 'x' * i) for i in range(1, 30)])
+
+    matcher.queryHelper = SlowAlternates(0.01, ['a' * 13, 'a' * 14])
+    results = matcher.getSimilarTopics('q' * 5, 'user-0')
+
+    # two from the original query, then the topics matching the alternates' lengths
+    assert [result['topicID'] for result in results[:2]] == [5, 4]
+    assert {result['topicID'] for result in results[2:]} == {13, 14}
+
+    # alternates that miss the deadline are dropped, and the original query fills all k
+    matcher.queryHelper = SlowAlternates(1.0, ['a' * 13, 'a' * 14])
+    start = time.monotonic()
+    assert [result['topicID'] for result in matcher.getSimilarTopics('q' * 10, 'user-0')] == [10, 9, 11, 8]
+    assert time.monotonic() - start < 0.5
@@ -0,0 +1,64 @@
+"""
+Compares the resident memory of the TopicStore layout against the old list-based one.
+
+The old layout kept every embedding as a Python list of floats, topic info as a list of
+tuples, and a second float32 copy inside a FAISS flat index. It is measured on a sample
+and extrapolated, since a million-topic list corpus would not fit in memory.
+
+Usage:
+    python memory_benchmark.py --sizes 10000 100000 1000000 --dim 1536
+"""
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from topic_store import TopicStore
+
+
+def syntheticTopics(start, end, numUsers):
+    return [(topicID, f"user-{topicID % numUsers}", f"Synthetic topic number {topicID}") for topicID in range(start, end)]
+
+
+def measureStore(numTopics, dim, numUsers, chunkSize=10000):
+    rng = np.random.default_rng(0)
+    tracemalloc.start()
+    store = TopicStore(dim, capacity=numTopics)
+    for start in range(0, numTopics, chunkSize):
+        end = min(start + chunkSize, numTopics)
+        store.add(syntheticTopics(start, end, numUsers), rng.random((end - start, dim), dtype='float32'))
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current
+
+
+def measureLegacy(numTopics, dim, numUsers, sampleSize=1000):
+    rng = np.random.default_rng(0)
+    sampleSize = min(sampleSize, numTopics)
+    tracemalloc.start()
+    topicInfo = syntheticTopics(0, sampleSize, numUsers)
+    embeddings = [rng.random(dim).tolist() for _ in range(sampleSize)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del topicInfo, embeddings
+    perTopic = current / sampleSize + 4 * dim # plus the IndexFlatL2 copy
+    return perTopic * numTopics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"{'topics':>10} {'legacy MB':>12} {'store MB':>12} {'legacy B/topic':>15} {'store B/topic':>14} {'ratio':>7}")
+    for numTopics in args.sizes:
+        legacy = measureLegacy(numTopics, args.dim, args.users)
+        store = measureStore(numTopics, args.dim, args.users)
+        print(f"{numTopics:>10} {legacy / 2**20:>12.1f} {store / 2**20:>12.1f} "
+              f"{legacy / numTopics:>15.0f} {store / numTopics:>14.0f} {legacy / store:>6.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Measures chat message write throughput with and without the write-behind pipeline.
+
+Both modes write the same messages into a fresh SQLite database in a temporary
+directory: 'sync' commits each message as handle_new_message used to (insert,
+metadata update, commit), and 'write-behind' queues them on the MessageWriter and
+waits for the final flush.
+
+Usage:
+    python message_benchmark.py --messages 5000 --chats 50
+"""
+import time
+import argparse
+import tempfile
+
+import config
+
+
+def makeApp(dataDir, numChats):
+    config.DATA_DIR = dataDir
+    from main import ChatApplication
+    chatApp = ChatApplication()
+    with chatApp.app.app_context():
+        chatApp.db.create_all()
+        chatApp.db.session.add_all([chatApp.User(id='u1'), chatApp.User(id='u2')])
+        chatApp.db.session.add_all([chatApp.Topic(id=1, userID='u1', title="first"),
+                                    chatApp.Topic(id=2, userID='u2', title="second")])
+        chatApp.db.session.add_all([chatApp.ChatMetadata(id=i, creatorTopicID=1, matchedTopicID=2,
+                                                         userCreatorID='u1', userMatchedID='u2')
+                                    for i in range(1, numChats + 1)])
+        chatApp.db.session.commit()
+    return chatApp
+
+
+def messages(numMessages, numChats):
+    for i in range(numMessages):
+        yield {'chatID': 1 + i % numChats, 'senderID': 'u1' if i % 3 else 'u2', 'text': f"message {i}", 'topicInfo': None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=config.MESSAGE_BATCH_SIZE)
+    parser.add_argument('--flush-ms', type=float, default=config.MESSAGE_FLUSH_MS)
+    args = parser.parse_args()
+    config.MESSAGE_BATCH_SIZE = args.batch_size
+    config.MESSAGE_FLUSH_MS = args.flush_ms
+
+    import events
+    print(f"{args.messages} messages across {args.chats} chats")
+    print(f"{'mode':>12} {'seconds':>8} {'messages/s':>11}")
+    for mode in ('sync', 'write-behind'):
+        with tempfile.TemporaryDirectory() as dataDir:
+            chatApp = makeApp(dataDir, args.chats)
+            with chatApp.app.app_context():
+                start = time.perf_counter()
+                for data in messages(args.messages, args.chats):
+                    data['messageNumber'] = chatApp.sequencer.next(data['chatID'])
+                    if mode == 'sync':
+                        events.add_new_message(data)
+                    else:
+                        events.queue_new_message(data)
+                chatApp.messageWriter.flush()
+                elapsed = time.perf_counter() - start
+                assert chatApp.ChatMessage.query.count() == args.messages
+                chatApp.messageWriter.close()
+                chatApp.db.engine.dispose()
+            print(f"{mode:>12} {elapsed:>8.2f} {args.messages / elapsed:>11.0f}")
+
+
+if __name__ == '__main__':
+    main()
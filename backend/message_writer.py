@@ -0,0 +1,232 @@
+import time
+import queue
+import threading
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from extensions import socketio
+
+
+# queued by flush() to end the batch being collected, rather than wait out the flush interval
+FLUSH = object()
+
+
+class MessageWriter:
+    """
+    Persists chat messages in the background, committing them in groups.
+
+    Messages are broadcast as soon as they arrive and queued here. A writer thread
+    collects up to `batchSize` of them, or whatever arrives within `flushInterval` of
+    the first, and writes the batch in one transaction: one multi-row INSERT, plus one
+    update per chat with the latest lastMessageTimestamp and *LastViewedAt values
+    seen in the batch. On SQLite that is one fsync per batch instead of one per message.
+
+    Clients have already seen a message by the time it is written, so none is dropped
+    quietly. A message whose number another writer took is renumbered from the reloaded
+    counter, queued again, and announced to its chat with a 'message-renumbered' event.
+    Transient errors such as "database is locked" are retried; a message that still cannot
+    be written is announced with a 'message-failed' event.
+
+    Attributes:
+        chatApp (ChatApplication): The app whose database and models are written to.
+        batchSize (int): Most messages written per transaction.
+        flushInterval (float): Longest time, in seconds, a message waits for its batch to fill.
+        numBatches (int): Number of transactions committed so far.
+        numMessages (int): Number of messages written so far.
+        numRenumbered (int): Number of messages renumbered after a collision.
+        numFailed (int): Number of messages that could not be written.
+    """
+
+    def __init__(self, chatApp, batchSize=256, flushIntervalMs=20, maxRetries=3, retryDelayMs=50, emit=None):
+        """
+        The constructor for MessageWriter class.
+
+        Parameters:
+           chatApp (ChatApplication): The app whose database and models are written to.
+           batchSize (int): Most messages written per transaction. Default is 256.
+           flushIntervalMs (float): Longest time a message waits for its batch to fill, in milliseconds. Default is 20.
+           maxRetries (int): Retries of a batch after a transient database error. Default is 3.
+           retryDelayMs (float): Delay before the first retry, doubled for each one after, in milliseconds. Default is 50.
+           emit (callable): Emits an event, with the signature of socketio.emit. Default is None (socketio.emit).
+        """
+        self.chatApp = chatApp
+        self.batchSize = batchSize
+        self.flushInterval = flushIntervalMs / 1000
+        self.maxRetries = maxRetries
+        self.retryDelay = retryDelayMs / 1000
+        self.emit = emit or socketio.emit
+        self.numBatches = 0
+        self.numMessages = 0
+        self.numRenumbered = 0
+        self.numFailed = 0
+        self.pending = queue.Queue()
+        self.closed = False
+        self.worker = threading.Thread(target=self.run, name='message-writer', daemon=True)
+        self.worker.start()
+
+    def submit(self, message):
+        """
+        Queues a message for writing.
+
+        Parameters:
+           message (dict): Column values for a ChatMessage: chatID, messageNumber, senderID, text, topicID and timestamp.
+        """
+        if self.closed:
+            raise RuntimeError("MessageWriter is closed")
+        self.pending.put(message)
+
+    def flush(self):
+        """
+        Blocks until every message submitted so far has been committed.
+        """
+        if self.pending.unfinished_tasks:
+            self.pending.put(FLUSH)
+            self.pending.join()
+
+    def close(self):
+        """
+        Writes out everything still queued and stops accepting messages; called on shutdown.
+        """
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def collectBatch(self):
+        items = [self.pending.get()]
+        deadline = time.monotonic() + self.flushInterval
+        while items[-1] is not FLUSH and len(items) < self.batchSize:
+            remaining = deadline - time.monotonic()
+            try:
+                items.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def run(self):
+        while True:
+            items = self.collectBatch()
+            batch = [item for item in items if item is not FLUSH]
+            try:
+                if batch:
+                    self.writeWithRetries(batch)
+            finally:
+                for _ in items:
+                    self.pending.task_done()
+
+    def writeWithRetries(self, batch):
+        for attempt in range(self.maxRetries + 1):
+            try:
+                with self.chatApp.app.app_context():
+                    collided, rejected = self.write(batch)
+                break
+            except OperationalError as e:
+                if attempt == self.maxRetries:
+                    return self.fail(batch, e)
+                print(f"Writing {len(batch)} messages failed ({e}); retrying")
+                time.sleep(self.retryDelay * 2 ** attempt)
+            except Exception as e:
+                return self.fail(batch, e)
+
+        # other writers stored these numbers first: reload each chat's counter once, then
+        # give the messages the next free numbers and write them with a later batch
+        for chatID in {message['chatID'] for message in collided}:
+            self.chatApp.sequencer.reset(chatID)
+        for message in collided:
+            self.renumber(message)
+        for message, error in rejected:
+            self.fail([message], error)
+
+    def write(self, batch):
+        """
+        Writes a batch in one transaction. Returns the messages whose numbers were already
+        taken, and (message, error) pairs for those rejected for any other reason.
+        """
+        db, ChatMessage, ChatMetadata = self.chatApp.db, self.chatApp.ChatMessage, self.chatApp.ChatMetadata
+        collided, rejected = [], []
+        try:
+            db.session.execute(insert(ChatMessage), batch)
+        except IntegrityError as e:
+            # find the offending rows (e.g. a duplicate messageNumber) without losing the rest
+            db.session.rollback()
+            print(f"Batch insert failed ({e}); writing messages one by one")
+            batch, collided, rejected = self.writeEach(batch)
+
+        # keep only the latest timestamps per chat, then update each chat once
+        chatIDs = {message['chatID'] for message in batch}
+        metadataByID = {metadata.id: metadata for metadata in ChatMetadata.query.filter(ChatMetadata.id.in_(chatIDs))}
+        for message in batch:
+            chatMetadata = metadataByID.get(message['chatID'])
+            if chatMetadata is None:
+                continue
+            timestamp = message['timestamp']
+            chatMetadata.lastMessageTimestamp = latest(chatMetadata.lastMessageTimestamp, timestamp)
+            if message['senderID'] == chatMetadata.userCreatorID:
+                chatMetadata.creatorLastViewedAt = latest(chatMetadata.creatorLastViewedAt, timestamp)
+            else: # user is the matched user
+                chatMetadata.matchedLastViewedAt = latest(chatMetadata.matchedLastViewedAt, timestamp)
+
+        db.session.commit()
+        self.numBatches += 1
+        self.numMessages += len(batch)
+        return collided, rejected
+
+    def writeEach(self, batch):
+        """
+        Inserts messages one at a time, sorting them into written, collided and rejected.
+        """
+        db, ChatMessage = self.chatApp.db, self.chatApp.ChatMessage
+        written, collided, rejected = [], [], []
+        for message in batch:
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(insert(ChatMessage), [message])
+                written.append(message)
+            except IntegrityError as e:
+                taken = db.session.query(ChatMessage.id).filter_by(
+                    chatID=message['chatID'], messageNumber=message['messageNumber']).first() is not None
+                if taken:
+                    collided.append(message)
+                else:
+                    rejected.append((message, e))
+        return written, collided, rejected
+
+    def renumber(self, message):
+        chatID, oldNumber = message['chatID'], message['messageNumber']
+        with self.chatApp.app.app_context():
+            message['messageNumber'] = self.chatApp.sequencer.next(chatID)
+        self.numRenumbered += 1
+        print(f"Renumbered message {oldNumber} in chat {chatID} to {message['messageNumber']}")
+        self.pending.put(message)
+        self.emit('message-renumbered', {'chatID': chatID, 'oldMessageNumber': oldNumber,
+                                         'messageNumber': message['messageNumber']}, room=f"chatID_{chatID}")
+
+    def fail(self, batch, error):
+        print(f"Failed to write {len(batch)} messages: {error}")
+        self.numFailed += len(batch)
+        for message in batch:
+            self.emit('message-failed', {'chatID': message['chatID'], 'messageNumber': message['messageNumber'],
+                                         'error': "The message could not be saved"}, room=f"chatID_{message['chatID']}")
+
+    def stats(self):
+        """
+        Returns the number of batches and messages written, the mean batch size, the messages
+        renumbered and failed, and the queue depth.
+        """
+        return {
+            'batches': self.numBatches,
+            'messages': self.numMessages,
+            'meanBatchSize': self.numMessages / self.numBatches if self.numBatches else 0.0,
+            'renumbered': self.numRenumbered,
+            'failed': self.numFailed,
+            'pending': self.pending.unfinished_tasks,
+        }
+
+
+def latest(current, timestamp):
+    if current is None:
+        return timestamp
+    # SQLite hands datetimes back without their timezone
+    if (current.tzinfo is None) != (timestamp.tzinfo is None):
+        timestamp = timestamp.replace(tzinfo=current.tzinfo)
+    return max(current, timestamp)
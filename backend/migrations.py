@@ -0,0 +1,81 @@
+from sqlalchemy import inspect, text
+
+
+def migrateDatabase(db):
+    """
+    Brings an existing database up to the current models; safe to run on every start.
+
+    create_all() only creates missing tables, so databases created before a column, index
+    or constraint was added to the models are upgraded here: missing nullable columns and
+    indexes are created, and the unique (chatID, messageNumber) constraint is added as a
+    unique index after renumbering any chats that already hold duplicate message numbers.
+    Newly added last-read message numbers are filled in from the last-viewed timestamps.
+
+    Must be called inside an app context.
+    """
+    inspector = inspect(db.engine)
+    addedColumns = set()
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existingColumns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existingColumns and column.nullable:
+                print(f"Adding column {table.name}.{column.name}")
+                columnType = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as connection:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {columnType}'))
+                addedColumns.add((table.name, column.name))
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"Creating index {index.name}")
+                index.create(bind=db.engine)
+
+    if not hasMessageNumberConstraint(inspector):
+        renumberDuplicateMessages(db)
+        print("Creating unique index uq_chat_message_number")
+        with db.engine.begin() as connection:
+            connection.execute(text('CREATE UNIQUE INDEX uq_chat_message_number ON chat ("chatID", "messageNumber")'))
+
+    for side in ('creator', 'matched'):
+        if ('chatmetadata', f'{side}LastReadNumber') in addedColumns:
+            backfillLastReadNumbers(db, side)
+
+
+def hasMessageNumberConstraint(inspector):
+    if not inspector.has_table('chat'):
+        return True
+    columns = ['chatID', 'messageNumber']
+    if any(constraint['column_names'] == columns for constraint in inspector.get_unique_constraints('chat')):
+        return True
+    return any(index['unique'] and index['column_names'] == columns for index in inspector.get_indexes('chat'))
+
+
+def renumberDuplicateMessages(db):
+    """
+    Gives every message in a chat with duplicate message numbers a fresh number, in
+    (messageNumber, id) order, so the unique index can be built.
+    """
+    with db.engine.begin() as connection:
+        chatIDs = [chatID for chatID, in connection.execute(text(
+            'SELECT DISTINCT "chatID" FROM chat GROUP BY "chatID", "messageNumber" HAVING COUNT(*) > 1'))]
+        for chatID in chatIDs:
+            print(f"Renumbering messages in chat {chatID}")
+            messageIDs = [messageID for messageID, in connection.execute(text(
+                'SELECT id FROM chat WHERE "chatID" = :chatID ORDER BY "messageNumber", id'), {'chatID': chatID})]
+            connection.execute(text('UPDATE chat SET "messageNumber" = :number WHERE id = :id'),
+                               [{'number': number, 'id': messageID} for number, messageID in enumerate(messageIDs)])
+
+
+def backfillLastReadNumbers(db, side):
+    """
+    Sets one side's last-read message number to the last message sent before its last view.
+    """
+    print(f"Filling in chatmetadata.{side}LastReadNumber")
+    with db.engine.begin() as connection:
+        connection.execute(text(f'''
+            UPDATE chatmetadata SET "{side}LastReadNumber" = (
+                SELECT MAX("messageNumber") FROM chat
+                WHERE chat."chatID" = chatmetadata.id AND chat.timestamp <= chatmetadata."{side}LastViewedAt")
+            WHERE "{side}LastViewedAt" IS NOT NULL'''))
@@ -0,0 +1,43 @@
+import sqlite3
+
+from sqlalchemy import inspect
+
+import config
+from main import ChatApplication
+
+
+def test_existing_database_is_migrated(tmp_path, monkeypatch):
+    # the schema as it was before indexes and last-read numbers, with a chat that already has duplicate numbers
+    connection = sqlite3.connect(tmp_path / 'test.db')
+    connection.executescript("""
+        CREATE TABLE users (id VARCHAR(36) PRIMARY KEY, username VARCHAR(64) UNIQUE, google_id VARCHAR(255) UNIQUE);
+        CREATE TABLE topics (id INTEGER PRIMARY KEY, "userID" VARCHAR(36) NOT NULL, title VARCHAR(512) NOT NULL);
+        CREATE TABLE chatmetadata (id INTEGER PRIMARY KEY, "creatorTopicID" INTEGER NOT NULL, "matchedTopicID" INTEGER NOT NULL,
+            "userCreatorID" VARCHAR(36) NOT NULL, "userMatchedID" VARCHAR(36) NOT NULL, "creatorLastViewedAt" DATETIME,
+            "matchedLastViewedAt" DATETIME, "lastMessageTimestamp" DATETIME);
+        CREATE TABLE chat (id INTEGER PRIMARY KEY, "chatID" INTEGER NOT NULL, "messageNumber" INTEGER NOT NULL,
+            "senderID" VARCHAR(36) NOT NULL, text VARCHAR(1024) NOT NULL, timestamp DATETIME NOT NULL, "topicID" INTEGER);
+        INSERT INTO chat VALUES (1, 1, 0, 'u1', 'a', '2023-01-01 00:00:00', NULL);
+        INSERT INTO chat VALUES (2, 1, 1, 'u2', 'b', '2023-01-01 00:00:01', NULL);
+        INSERT INTO chat VALUES (3, 1, 1, 'u1', 'c', '2023-01-01 00:00:01', NULL);
+        INSERT INTO chat VALUES (4, 2, 0, 'u1', 'd', '2023-01-01 00:00:02', NULL);
+        INSERT INTO chatmetadata VALUES (1, 1, 2, 'u1', 'u2', '2023-01-01 00:00:01', NULL, NULL);
+    """)
+    connection.close()
+
+    monkeypatch.setattr(config, 'DATA_DIR', str(tmp_path))
+    chatApp = ChatApplication()
+    with chatApp.app.app_context():
+        inspector = inspect(chatApp.db.engine)
+        assert {'ix_topics_userID'} <= {index['name'] for index in inspector.get_indexes('topics')}
+        assert {'ix_chatmetadata_creatorTopicID', 'ix_chatmetadata_matchedTopicID'} <= \
+            {index['name'] for index in inspector.get_indexes('chatmetadata')}
+        assert [(message.id, message.messageNumber) for message in chatApp.ChatMessage.query.order_by('id')] == \
+            [(1, 0), (2, 1), (3, 2), (4, 0)]
+        assert chatApp.sequencer.next(1) == 3
+        # last-read numbers are backfilled from the view times, after renumbering
+        chatMetadata = chatApp.db.session.get(chatApp.ChatMetadata, 1)
+        assert (chatMetadata.creatorLastReadNumber, chatMetadata.matchedLastReadNumber) == (2, None)
+
+    # running again finds nothing left to do
+    ChatApplication()
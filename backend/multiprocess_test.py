@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import subprocess
+
+import pytest
+import requests
+
+pytest.importorskip('kombu')
+socketio = pytest.importorskip('socketio')
+
+
+def freePorts(n):
+    # n consecutive free ports, as serve.py gives its workers PORT, PORT+1, ...
+    for _ in range(50):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        try:
+            sockets = [socket.create_server(('127.0.0.1', port + i)) for i in range(n)]
+        except OSError:
+            continue
+        for s in sockets:
+            s.close()
+        return port
+    raise RuntimeError("no free port range")
+
+
+def waitUntil(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.1)
+    raise AssertionError("timed out")
+
+
+@pytest.fixture
+def workers(tmp_path):
+    port = freePorts(2)
+    queueDir = tmp_path / 'queue'
+    queueDir.mkdir()
+    env = dict(os.environ, CHATMOS_DATA_DIR=str(tmp_path), CHATMOS_PORT=str(port), CHATMOS_WORKERS='2',
+               CHATMOS_SERVER_MODE='threading', CHATMOS_EMBEDDING_PROVIDER='hashing', CHATMOS_TOPIC_SYNC_MS='100',
+               CHATMOS_MESSAGE_QUEUE='filesystem://', OPENAI_API_KEY='stub',
+               CHATMOS_MESSAGE_QUEUE_OPTIONS=json.dumps({'data_folder_in': str(queueDir), 'data_folder_out': str(queueDir),
+                                                         'control_folder': str(queueDir), 'polling_interval': 0.05}))
+    env.pop('CHATMOS_WORKER_ID', None)
+    log = open(tmp_path / 'serve.log', 'w')
+    server = subprocess.Popen([sys.executable, 'serve.py'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    urls = [f"http://127.0.0.1:{port + i}" for i in range(2)]
+
+    def ready():
+        try:
+            return all(requests.get(f"{url}/matcher-stats", timeout=1).ok for url in urls)
+        except requests.RequestException:
+            return False
+    try:
+        waitUntil(ready, timeout=60)
+        yield urls
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(timeout=20)
+
+
+def connect(url, userID, chatID, received):
+    client = socketio.Client()
+    client.on('message', lambda data: received.append(data))
+    client.connect(url)
+    client.emit('chat-join', {'userID': userID, 'room': chatID})
+    return client
+
+
+def test_workers_share_ids_broadcasts_and_topics(workers):
+    first, second = workers
+
+    # user ids come from one counter, whichever worker hands them out
+    ids = [requests.get(f"{url}/next-user-id").json()['nextUserID'] for url in (first, second, first, second)]
+    assert ids == [1, 2, 3, 4]
+
+    users = [requests.post(f"{url}/create-user").json()['uuid'] for url in workers]
+    topics = [requests.post(f"{url}/user-topics/{userID}", json={'title': title}).json()['id']
+              for url, userID, title in zip(workers, users, ["jazz piano lessons", "learning jazz piano"])]
+    chatID = requests.post(f"{first}/create-chat", json={
+        'creatorTopicID': topics[0], 'matchedTopicID': topics[1],
+        'userCreatorID': users[0], 'userMatchedID': users[1]}).json()['chatID']
+
+    # a message sent through either worker reaches clients on both, numbered from one sequence
+    received = [[], []]
+    clients = [connect(url, userID, chatID, inbox) for url, userID, inbox in zip(workers, users, received)]
+
+    def warmedUp():
+        # each worker binds its queue once its first client connects; until then broadcasts can miss it
+        clients[0].emit('new-message', {'chatID': chatID, 'senderID': users[0], 'text': "hello", 'topicInfo': None})
+        time.sleep(0.5)
+        return all(received)
+    waitUntil(warmedUp)
+    for inbox in received:
+        inbox.clear()
+
+    for i in range(10):
+        sender = i % 2
+        clients[sender].emit('new-message', {'chatID': chatID, 'senderID': users[sender], 'text': f"message {i}", 'topicInfo': None})
+    for inbox in received:
+        waitUntil(lambda: len(inbox) == 10)
+    numbers = [message['messageNumber'] for message in received[0]]
+    assert sorted(numbers) == list(range(min(numbers), min(numbers) + 10))
+    assert sorted(numbers) == sorted(message['messageNumber'] for message in received[1])
+    for client in clients:
+        client.disconnect()
+    stored = [message['messageNumber'] for message in requests.get(f"{second}/chats/{chatID}").json()]
+    assert stored == list(range(len(stored))) and set(numbers) <= set(stored)
+
+    # a topic added on one worker is matched on the other, and stops matching once deleted there
+    def matchedTopicIDs(url, userID, query):
+        response = requests.get(f"{url}/bot-response", params={'topic': query, 'userID': userID}).json()
+        return {match['topicID'] for match in response['topicMatches']}
+
+    newTopic = requests.post(f"{first}/user-topics/{users[0]}", json={'title': "sourdough bread baking"}).json()['id']
+    waitUntil(lambda: newTopic in matchedTopicIDs(second, users[1], "baking sourdough bread"))
+    requests.delete(f"{second}/topics/{newTopic}")
+    waitUntil(lambda: newTopic not in matchedTopicIDs(first, users[1], "baking sourdough bread at home"))
@@ -1,3 +1,6 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
 from langchain import FewShotPromptTemplate, PromptTemplate
 from langchain.chains import LLMChain
 
@@ -7,12 +10,20 @@ class AsymmetricQueryHelper:
     A class that generates asymmetric queries based on the user's initial query using a language model.
     """
 
-    def __init__(self, llm):
+    def __init__(self, llm, maxParallel=4, scheduler=None):
         """
         The constructor for AsymmetricQueryGenerator class.
+
+        Parameters:
+            llm: The language model used to write alternate queries.
+            maxParallel (int): Most single-alternate calls in flight when a list response falls short. Default is 4.
+            scheduler (RequestScheduler): Shared scheduler for LLM calls. Default is None (call the LLM directly).
         """
+        self.maxParallel = maxParallel
+        self.scheduler = scheduler
         self.configurePrompt()
         self.chain = LLMChain(llm=llm, prompt=self.few_shot_prompt)
+        self.listChain = LLMChain(llm=llm, prompt=self.list_prompt)
 
     def configurePrompt(self):
         example_1 = {
@@ -96,21 +107,62 @@ class AsymmetricQueryHelper:
             example_separator="\n",
         )
 
-    def getAlternateQuery(self, query, numAlternates=1):
+        # Same examples, but asking for several alternates at once as a numbered list
+        self.list_prompt = FewShotPromptTemplate(
+            examples=examples,
+            example_prompt=example_prompt,
+            prefix=prompt_prefix,
+            suffix="\nOriginal Query: {original_query}\nWrite {num_alternates} different alternate queries for this " \
+            "original query as a numbered list, one per line.\nAlternate Queries:\n",
+            input_variables=["original_query", "num_alternates"],
+            example_separator="\n",
+        )
+
+    def getAlternateQuery(self, query, numAlternates=1, timeout=None):
         """
         Generates alternate queries based on the user's initial query.
 
+        Several alternates are requested in a single generation as a numbered list, so the
+        few-shot prompt is only sent once. If the list comes back short, the missing
+        alternates are generated one per call, at most `maxParallel` at a time.
+
         Parameters:
             query (str): The user's initial query.
             numAlternates (int): The number of alternate queries to generate.
+            timeout (float): Seconds the caller will wait; scheduled calls not started by then are dropped. Default is None.
 
         Returns:
             list: A list of generated alternate queries.
         """
         alternateQueries = []
-        for _ in range(numAlternates):
-            response = self.chain.run({"original_query": query})
-            alternateQuery = response.strip()
-            alternateQueries.append(alternateQuery)
+        if numAlternates > 1:
+            response = self.runChain(self.listChain, {"original_query": query, "num_alternates": numAlternates},
+                                     key=(query, numAlternates), timeout=timeout)
+            alternateQueries = parseNumberedList(response)[:numAlternates]
+
+        missing = numAlternates - len(alternateQueries)
+        if missing > 0:
+            with ThreadPoolExecutor(max_workers=min(missing, self.maxParallel)) as pool:
+                # not coalesced: each call should come up with a different alternate
+                responses = pool.map(lambda _: self.runChain(self.chain, {"original_query": query}, timeout=timeout),
+                                     range(missing))
+                alternateQueries += [response.strip() for response in responses]
 
         return alternateQueries
+
+    def runChain(self, chain, inputs, key=None, timeout=None):
+        if self.scheduler is None:
+            return chain.run(inputs)
+        return self.scheduler.call('alternate', chain.run, inputs, key=key, timeout=timeout)
+
+
+def parseNumberedList(text):
+    """
+    Returns the items of a numbered list ("1. ...", "2) ..."), ignoring any other lines.
+    """
+    items = []
+    for line in text.splitlines():
+        match = re.match(r"\s*\d+\s*[.)]\s*(.+)", line)
+        if match:
+            items.append(match.group(1).strip())
+    return items
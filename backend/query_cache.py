@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A thread-safe least-recently-used cache with an optional time-to-live.
+
+    Attributes:
+        maxSize (int): Largest number of entries kept before the oldest is evicted.
+        ttl (float): Seconds an entry stays valid, or None for no expiry.
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that missed or found an expired entry.
+    """
+
+    def __init__(self, maxSize=1024, ttl=None):
+        """
+        The constructor for LRUCache class.
+
+        Parameters:
+           maxSize (int): Largest number of entries to keep. Default is 1024.
+           ttl (float): Seconds an entry stays valid. Default is None (no expiry).
+        """
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns the cached value for a key, or None on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or (self.ttl is not None and time.monotonic() - entry[1] > self.ttl):
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        """
+        Stores a value, evicting the least recently used entry if the cache is full.
+        """
+        if self.maxSize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, time.monotonic())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Returns the hit/miss counters, hit rate and current size.
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hitRate': self.hits / total if total else 0.0,
+            'size': len(self.entries),
+        }
@@ -0,0 +1,87 @@
+import re
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, insert, text
+
+
+NUM_USERS, TOPICS_PER_USER, MESSAGES_PER_CHAT = 500, 10, 10
+
+
+@pytest.fixture
+def seededApp(chatApp):
+    """
+    Adds thousands of users, topics, chats and messages, so the planner has real
+    choices to make, and refreshes the planner's statistics.
+    """
+    numTopics = NUM_USERS * TOPICS_PER_USER
+    start = datetime(2023, 1, 1)
+    with chatApp.app.app_context():
+        db = chatApp.db
+        db.session.execute(insert(chatApp.User), [{'id': f"user-{i}"} for i in range(NUM_USERS)])
+        db.session.execute(insert(chatApp.Topic), [{'id': 10 + i, 'userID': f"user-{i % NUM_USERS}", 'title': f"topic {i}"}
+                                                   for i in range(numTopics)])
+        db.session.execute(insert(chatApp.ChatMetadata), [
+            {'id': 10 + i, 'creatorTopicID': 10 + i, 'matchedTopicID': 10 + (i * 7 + 1) % numTopics,
+             'userCreatorID': f"user-{i % NUM_USERS}", 'userMatchedID': f"user-{(i * 7 + 1) % NUM_USERS}"}
+            for i in range(numTopics)])
+        db.session.execute(insert(chatApp.ChatMessage), [
+            {'chatID': 10 + i // MESSAGES_PER_CHAT, 'messageNumber': i % MESSAGES_PER_CHAT, 'senderID': f"user-{i % NUM_USERS}",
+             'text': f"message {i}", 'timestamp': start + timedelta(seconds=i)}
+            for i in range(numTopics * MESSAGES_PER_CHAT)])
+        db.session.commit()
+        db.session.execute(text('ANALYZE'))
+    return chatApp
+
+
+def recordQueries(chatApp, action):
+    """
+    Runs action() and returns the (statement, parameters) of every SELECT it issued.
+    """
+    queries = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            queries.append((statement, parameters))
+
+    with chatApp.app.app_context():
+        engine = chatApp.db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            action()
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+    return queries
+
+
+def fullScans(chatApp, statement, parameters):
+    with chatApp.app.app_context():
+        connection = chatApp.db.engine.raw_connection()
+        try:
+            plan = connection.cursor().execute('EXPLAIN QUERY PLAN ' + statement, parameters).fetchall()
+        finally:
+            connection.close()
+    details = [row[-1] for row in plan]
+    return [detail for detail in details if re.match(r'SCAN (?!CONSTANT ROW)', detail)]
+
+
+ENDPOINT_QUERIES = {
+    'chat history': lambda client, chatApp: client.get('/chats/1000'),
+    'chat history page': lambda client, chatApp: client.get('/chats/1000?before=5&limit=3'),
+    'chat history delta': lambda client, chatApp: client.get('/chats/1000?after=5'),
+    'topic chats': lambda client, chatApp: client.get('/chatmetadata/1000'),
+    'user topics': lambda client, chatApp: client.get('/user-topics/user-42'),
+    'topic': lambda client, chatApp: client.get('/topics/1000'),
+    'user': lambda client, chatApp: client.get('/users/user-42'),
+    'inbox': lambda client, chatApp: client.get('/inbox/user-42'),
+    'next message number': lambda client, chatApp: chatApp.getLastMessageNumber(1000),
+}
+
+
+@pytest.mark.parametrize('name', list(ENDPOINT_QUERIES))
+def test_endpoint_queries_use_indexes(seededApp, name):
+    client = seededApp.app.test_client()
+    queries = recordQueries(seededApp, lambda: ENDPOINT_QUERIES[name](client, seededApp))
+    assert queries, f"{name} issued no queries"
+    for statement, parameters in queries:
+        assert fullScans(seededApp, statement, parameters) == [], statement
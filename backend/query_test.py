@@ -1,17 +1,98 @@
 import os
+import threading
+from typing import Any, List, Optional
 
-import openai
-from langchain.llms import OpenAI
-from dotenv import load_dotenv
+import pytest
+from langchain.llms.base import LLM
 
-from query import AsymmetricQueryHelper
+from query import AsymmetricQueryHelper, parseNumberedList
+from scheduler import RequestScheduler
 
-load_dotenv()  
-openai.api_key = os.getenv('OPENAI_API_KEY')
-llm = OpenAI(model_name="text-davinci-003")  # Initialize your language model
 
-generator = AsymmetricQueryHelper()
-query = "How can I learn to code?"
-alternates = generator.generate(query, num_alternates=5)
-for i, alt in enumerate(alternates):
-        print(f"Alternate Query {i+1}: {alt}")
\ No newline at end of file
+lock = threading.Lock()
+
+
+class CountingLLM(LLM):
+    """
+    A fake LLM that answers with canned responses and counts calls and prompt tokens.
+    Tokens are approximated by whitespace-separated words.
+    """
+
+    responses: List[str]
+    calls: int = 0
+    promptTokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "counting"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        with lock:
+            response = self.responses[self.calls % len(self.responses)]
+            self.calls += 1
+            self.promptTokens += len(prompt.split())
+        return response
+
+
+def test_alternates_come_from_one_call():
+    llm = CountingLLM(responses=["1. My time as a chef\n2) Cooking professionally\n3. Life in a kitchen\n"])
+    helper = AsymmetricQueryHelper(llm)
+    assert helper.getAlternateQuery("What is it like to be a chef?", 3) == \
+        ["My time as a chef", "Cooking professionally", "Life in a kitchen"]
+    assert llm.calls == 1
+
+    looping = CountingLLM(responses=["My time as a chef"])
+    helper = AsymmetricQueryHelper(looping)
+    for _ in range(3):
+        helper.getAlternateQuery("What is it like to be a chef?")
+    assert looping.calls == 3
+    assert llm.promptTokens < looping.promptTokens / 2
+
+
+def test_short_list_falls_back_to_single_calls():
+    llm = CountingLLM(responses=["1. My time as a chef\nsorry, that's all I have", "Cooking professionally"])
+    helper = AsymmetricQueryHelper(llm, maxParallel=2)
+    alternates = helper.getAlternateQuery("What is it like to be a chef?", 4)
+    assert alternates[0] == "My time as a chef"
+    assert len(alternates) == 4
+    assert llm.calls == 4
+
+
+def test_alternates_still_queued_at_the_timeout_are_dropped():
+    scheduler = RequestScheduler(numWorkers=1)
+    scheduler.addKind('alternate', rate=1000)
+    release = threading.Event()
+    busy = scheduler.submit('alternate', release.wait)
+
+    llm = CountingLLM(responses=["1. My time as a chef\n2. Cooking professionally\n"])
+    helper = AsymmetricQueryHelper(llm, scheduler=scheduler)
+    with pytest.raises(TimeoutError):
+        helper.getAlternateQuery("What is it like to be a chef?", 2, timeout=0.05)
+
+    # once the worker frees up, the expired call is skipped rather than sent to the model
+    release.set()
+    busy.result(1)
+    scheduler.call('alternate', lambda: None)
+    assert llm.calls == 0
+
+
+def test_parse_numbered_list():
+    assert parseNumberedList("Here you go:\n 1. first\n2)second\n\n10. tenth") == ["first", "second", "tenth"]
+    assert parseNumberedList("no list here") == []
+
+
+if __name__ == '__main__':
+    # Manual check against the real model
+    import openai
+    from langchain.llms import OpenAI
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    openai.api_key = os.getenv('OPENAI_API_KEY')
+    llm = OpenAI(model_name="text-davinci-003")
+
+    generator = AsymmetricQueryHelper(llm)
+    query = "How can I learn to code?"
+    alternates = generator.getAlternateQuery(query, numAlternates=5)
+    for i, alt in enumerate(alternates):
+        print(f"Alternate Query {i+1}: {alt}")
@@ -0,0 +1,163 @@
+import threading
+from datetime import timezone
+
+from message_writer import latest
+
+
+class ReadReceiptBuffer:
+    """
+    Absorbs "last viewed" updates in memory and writes them out periodically.
+
+    Clients report a view on every chat open and focus, so the same (chat, user) pair
+    is typically updated many times between flushes; only the latest timestamp and
+    last-read message number per pair are kept, and a flush writes all of them in one
+    transaction. Reads of chat metadata overlay the unflushed values, so unread badges
+    are never stale.
+
+    Attributes:
+        chatApp (ChatApplication): The app whose ChatMetadata rows are updated.
+        flushInterval (float): Seconds between flushes.
+        numRecorded (int): Number of updates recorded.
+        numWritten (int): Number of (chat, user) timestamps written to the database.
+        numFlushes (int): Number of flushes that wrote anything.
+    """
+
+    def __init__(self, chatApp, flushIntervalMs=1000):
+        """
+        The constructor for ReadReceiptBuffer class.
+
+        Parameters:
+           chatApp (ChatApplication): The app whose ChatMetadata rows are updated.
+           flushIntervalMs (float): Milliseconds between flushes. Default is 1000.
+        """
+        self.chatApp = chatApp
+        self.flushInterval = flushIntervalMs / 1000
+        self.pending = {}
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.flushLock = threading.Lock()
+        self.numRecorded = 0
+        self.numWritten = 0
+        self.numFlushes = 0
+        self.stopped = threading.Event()
+        self.worker = threading.Thread(target=self.run, name='read-receipts', daemon=True)
+        self.worker.start()
+
+    def record(self, chatID, userID, timestamp, lastReadNumber=None):
+        """
+        Notes that a user viewed a chat at the given time, having seen up to lastReadNumber.
+        """
+        # kept as naive UTC, the way SQLite hands DateTime columns back, so reads match before and after a flush
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        with self.lock:
+            key = (int(chatID), userID)
+            self.pending[key] = mergeReceipts(self.pending.get(key), (timestamp, lastReadNumber))
+            self.numRecorded += 1
+
+    def receipt(self, chatID, userID):
+        """
+        Returns the unflushed (lastViewedAt, lastReadNumber) for a user in a chat, or None.
+        """
+        key = (int(chatID), userID)
+        with self.lock:
+            pending, flushing = self.pending.get(key), self.flushing.get(key)
+        if pending is None:
+            return flushing
+        return mergeReceipts(flushing, pending)
+
+    def viewedAt(self, chatID, userID):
+        """
+        Returns the unflushed last-viewed time for a user in a chat, or None.
+        """
+        receipt = self.receipt(chatID, userID)
+        return None if receipt is None else receipt[0]
+
+    def pendingChats(self, userID):
+        """
+        Returns {chatID: (lastViewedAt, lastReadNumber)} for a user's unflushed views.
+        """
+        with self.lock:
+            chatIDs = {chatID for chatID, user in list(self.pending) + list(self.flushing) if user == userID}
+        return {chatID: self.receipt(chatID, userID) for chatID in chatIDs}
+
+    def overlay(self, chatMetadata):
+        """
+        Returns (creatorLastViewedAt, matchedLastViewedAt) for a chat, including unflushed views.
+        """
+        creatorViewedAt = self.viewedAt(chatMetadata.id, chatMetadata.userCreatorID)
+        matchedViewedAt = self.viewedAt(chatMetadata.id, chatMetadata.userMatchedID)
+        return (
+            chatMetadata.creatorLastViewedAt if creatorViewedAt is None else latest(chatMetadata.creatorLastViewedAt, creatorViewedAt),
+            chatMetadata.matchedLastViewedAt if matchedViewedAt is None else latest(chatMetadata.matchedLastViewedAt, matchedViewedAt),
+        )
+
+    def flush(self):
+        """
+        Writes every recorded timestamp to the database in one transaction.
+        """
+        with self.flushLock:
+            with self.lock:
+                # keep the swapped-out values visible to viewedAt() until they are committed
+                self.flushing, self.pending = self.pending, {}
+            if not self.flushing:
+                return
+            try:
+                with self.chatApp.app.app_context():
+                    self.write(self.flushing)
+            except Exception as e:
+                print(f"Failed to write {len(self.flushing)} read receipts: {e}")
+                with self.lock:
+                    for key, receipt in self.flushing.items():
+                        self.pending[key] = mergeReceipts(self.pending.get(key), receipt)
+            with self.lock:
+                self.flushing = {}
+
+    def write(self, receipts):
+        db, ChatMetadata = self.chatApp.db, self.chatApp.ChatMetadata
+        chatIDs = {chatID for chatID, _ in receipts}
+        metadataByID = {metadata.id: metadata for metadata in ChatMetadata.query.filter(ChatMetadata.id.in_(chatIDs))}
+        for (chatID, userID), (timestamp, lastReadNumber) in receipts.items():
+            chatMetadata = metadataByID.get(chatID)
+            if chatMetadata is None:
+                continue
+            if userID == chatMetadata.userCreatorID:
+                chatMetadata.creatorLastViewedAt = latest(chatMetadata.creatorLastViewedAt, timestamp)
+                chatMetadata.creatorLastReadNumber = highest(chatMetadata.creatorLastReadNumber, lastReadNumber)
+            else: # user is the matched user
+                chatMetadata.matchedLastViewedAt = latest(chatMetadata.matchedLastViewedAt, timestamp)
+                chatMetadata.matchedLastReadNumber = highest(chatMetadata.matchedLastReadNumber, lastReadNumber)
+        db.session.commit()
+        self.numWritten += len(receipts)
+        self.numFlushes += 1
+
+    def run(self):
+        while not self.stopped.wait(self.flushInterval):
+            self.flush()
+
+    def close(self):
+        """
+        Stops the periodic flush and writes out whatever is left; called on shutdown.
+        """
+        self.stopped.set()
+        self.flush()
+
+    def stats(self):
+        return {
+            'recorded': self.numRecorded,
+            'written': self.numWritten,
+            'flushes': self.numFlushes,
+            'pending': len(self.pending),
+        }
+
+
+def highest(current, number):
+    if current is None:
+        return number
+    return current if number is None else max(current, number)
+
+
+def mergeReceipts(current, receipt):
+    if current is None:
+        return receipt
+    return latest(current[0], receipt[0]), highest(current[1], receipt[1])
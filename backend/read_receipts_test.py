@@ -0,0 +1,36 @@
+from datetime import datetime
+
+
+def test_read_receipts_are_coalesced_and_overlaid(chatApp):
+    client = chatApp.app.test_client()
+    chatApp.readReceipts.stopped.set() # flush by hand below
+    writes = []
+    write = chatApp.readReceipts.write
+
+    def recordingWrite(receipts):
+        writes.append(dict(receipts))
+        write(receipts)
+
+    chatApp.readReceipts.write = recordingWrite
+
+    for _ in range(50):
+        assert client.post('/update-timestamp', json={'chatID': 1, 'userID': 'u2'}).status_code == 200
+    client.post('/update-timestamp', json={'chatID': 1, 'userID': 'u1'})
+
+    # nothing written yet, but reads already see the latest views
+    with chatApp.app.app_context():
+        chatMetadata = chatApp.ChatMetadata.query.filter_by(id=1).first()
+        assert chatMetadata.matchedLastViewedAt is None and chatMetadata.creatorLastViewedAt is None
+    chatInfo = client.get('/chatmetadata/1').get_json()[0]
+    matchedViewedAt = datetime.fromisoformat(chatInfo['matchedLastViewedAt'])
+    creatorViewedAt = datetime.fromisoformat(chatInfo['creatorLastViewedAt'])
+    assert matchedViewedAt < creatorViewedAt
+
+    chatApp.readReceipts.flush()
+    assert len(writes) == 1 and len(writes[0]) == 2
+    with chatApp.app.app_context():
+        chatMetadata = chatApp.ChatMetadata.query.filter_by(id=1).first()
+        assert chatMetadata.matchedLastViewedAt == matchedViewedAt
+        assert chatMetadata.creatorLastViewedAt == creatorViewedAt
+    assert client.get('/chatmetadata/1').get_json()[0] == chatInfo
+    assert chatApp.readReceipts.stats()['recorded'] == 51
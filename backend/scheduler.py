@@ -0,0 +1,343 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+from concurrent.futures import Future
+
+import openai
+
+
+# Upstream errors worth retrying; anything else fails the call straight away
+RETRIABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    openai.error.TryAgain,
+)
+
+
+class SchedulerBusy(Exception):
+    """
+    Raised when a kind's queue is full, so callers fail fast instead of piling up behind it.
+    """
+
+
+class TokenBucket:
+    """
+    A token-bucket rate limiter.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (float): Largest number of tokens the bucket holds (the burst size).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updatedAt = time.monotonic()
+        self.pausedUntil = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updatedAt) * self.rate)
+        self.updatedAt = now
+
+    def tryAcquire(self):
+        """
+        Takes a token if one is available.
+
+        Returns:
+           float: 0 if a token was taken, otherwise the seconds until one will be available.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            if now >= self.pausedUntil and self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return max(self.pausedUntil - now, (1 - self.tokens) / self.rate, 1e-3)
+
+    def pause(self, seconds):
+        """
+        Stops handing out tokens for a while, e.g. after the upstream API reports a rate limit.
+        """
+        with self.lock:
+            self.pausedUntil = max(self.pausedUntil, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class ScheduledCall:
+    def __init__(self, kind, key, fn, args, kwargs, deadline, priority, sequence, canRetry):
+        self.kind = kind
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.deadline = deadline
+        self.priority = priority
+        self.sequence = sequence
+        self.canRetry = canRetry
+        self.attempt = 0
+        self.future = Future()
+        self.enqueuedAt = time.monotonic()
+
+    def expired(self, now):
+        # only a call that has not started yet can expire
+        return self.attempt == 0 and self.deadline is not None and now > self.deadline
+
+
+class CallKind:
+    """
+    The queue, limits and counters for one kind of upstream call.
+    """
+
+    def __init__(self, name, priority, rate, burst, maxConcurrent, maxQueued):
+        self.name = name
+        self.priority = priority
+        self.bucket = TokenBucket(rate, burst)
+        self.maxConcurrent = maxConcurrent
+        self.maxQueued = maxQueued
+        self.queue = []
+        self.delayed = []
+        self.running = 0
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.expired = 0
+        self.retries = 0
+        self.failures = 0
+        self.completed = 0
+        self.totalWait = 0.0
+        self.maxWait = 0.0
+
+
+class RequestScheduler:
+    """
+    Runs LLM and embedding API calls on a bounded worker pool shared by the whole app.
+
+    Each kind of call ('embedding', 'alternate', 'segway', ...) has its own priority queue,
+    concurrency cap and token-bucket rate limit; idle workers serve the highest-priority kind
+    that has work, a free slot and a token, so a kind that is out of tokens never holds
+    workers the other kinds could use. Identical in-flight requests (same kind and key) share
+    one upstream call. Retriable upstream errors are re-queued with exponential backoff
+    rather than slept on by the worker, and a rate-limit error pauses that kind's bucket so
+    its other calls back off too. Queues are bounded, so when the API is throttling, new
+    callers get SchedulerBusy immediately rather than blocking request threads behind a
+    growing backlog.
+
+    Attributes:
+        numWorkers (int): Number of worker threads.
+        maxRetries (int): Retries per call after a retriable error.
+        backoff (float): Delay before the first retry, in seconds; doubles on each retry.
+        maxBackoff (float): Longest delay between retries, in seconds.
+        kinds (dict): CallKind for each registered kind of call.
+    """
+
+    def __init__(self, numWorkers=8, maxRetries=4, backoff=0.5, maxBackoff=8.0):
+        """
+        The constructor for RequestScheduler class.
+
+        Parameters:
+           numWorkers (int): Number of worker threads. Default is 8.
+           maxRetries (int): Retries per call after a retriable error. Default is 4.
+           backoff (float): Delay before the first retry, in seconds. Default is 0.5.
+           maxBackoff (float): Longest delay between retries, in seconds. Default is 8.
+        """
+        self.numWorkers = numWorkers
+        self.maxRetries = maxRetries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.kinds = {}
+        self.inFlight = {}
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.workers = [threading.Thread(target=self.run, name=f'request-scheduler-{i}', daemon=True)
+                        for i in range(numWorkers)]
+        for worker in self.workers:
+            worker.start()
+
+    def addKind(self, name, priority=0, rate=10.0, burst=None, maxConcurrent=None, maxQueued=256):
+        """
+        Registers a kind of call.
+
+        Parameters:
+           name (str): The kind's name, passed to submit() and call().
+           priority (int): Lower values are served first. Default is 0.
+           rate (float): Most calls started per second. Default is 10.
+           burst (float): Most calls started back to back. Default is max(1, rate).
+           maxConcurrent (int): Most calls of this kind running at once. Default is numWorkers.
+           maxQueued (int): Most calls waiting before submit() raises SchedulerBusy. Default is 256.
+        """
+        with self.condition:
+            self.kinds[name] = CallKind(name, priority, rate, burst, maxConcurrent or self.numWorkers, maxQueued)
+
+    def submit(self, kind, fn, *args, key=None, priority=0, timeout=None, canRetry=None, **kwargs):
+        """
+        Queues fn(*args, **kwargs) and returns a Future for its result.
+
+        Parameters:
+           kind (str): A kind registered with addKind().
+           fn (callable): The upstream call.
+           key (hashable): Identifies the request for coalescing; calls with the same kind and key
+               while one is queued or running share its Future. Default is None (never coalesced).
+           priority (int): Lower values are served first within the kind. Default is 0.
+           timeout (float): Seconds after which the call is dropped if it has not started. Default is None.
+           canRetry (callable): Asked before each retry; returning False fails the call with the error
+               instead, e.g. once a streamed call has sent output. Default is None (always retry).
+
+        Returns:
+           Future: Resolves to fn's return value or exception.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            callKind = self.kinds[kind]
+            if key is not None and (kind, key) in self.inFlight:
+                call = self.inFlight[(kind, key)]
+                # a coalesced caller may be willing to wait longer than the original one
+                if call.deadline is not None:
+                    call.deadline = None if deadline is None else max(call.deadline, deadline)
+                callKind.coalesced += 1
+                return call.future
+            if len(callKind.queue) >= callKind.maxQueued:
+                callKind.rejected += 1
+                raise SchedulerBusy(f"Too many queued {kind} requests")
+
+            call = ScheduledCall(kind, key, fn, args, kwargs, deadline, priority, next(self.sequence), canRetry)
+            heapq.heappush(callKind.queue, (priority, call.sequence, call))
+            if key is not None:
+                self.inFlight[(kind, key)] = call
+            callKind.submitted += 1
+            self.condition.notify()
+        return call.future
+
+    def call(self, kind, fn, *args, key=None, priority=0, timeout=None, canRetry=None, **kwargs):
+        """
+        Like submit(), but blocks for the result; raises TimeoutError if it takes longer than timeout.
+        """
+        future = self.submit(kind, fn, *args, key=key, priority=priority, timeout=timeout, canRetry=canRetry, **kwargs)
+        return future.result(timeout)
+
+    def nextCall(self):
+        """
+        Blocks until some kind has queued work, a free slot and a rate-limit token, then takes its next call.
+
+        The token is taken here, before the worker commits to the call, so a worker never sits in
+        one kind's rate limit while another kind has work it could run. Calls that have expired
+        in the queue are handed out without a token, to be failed straight away.
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                timeout = None
+                for callKind in sorted(self.kinds.values(), key=lambda k: k.priority):
+                    while callKind.delayed and callKind.delayed[0][0] <= now:
+                        _, _, call = heapq.heappop(callKind.delayed)
+                        heapq.heappush(callKind.queue, (call.priority, call.sequence, call))
+                    if callKind.delayed:
+                        timeout = min(timeout or float('inf'), callKind.delayed[0][0] - now)
+                    if not callKind.queue or callKind.running >= callKind.maxConcurrent:
+                        continue
+                    _, _, call = callKind.queue[0]
+                    if not call.expired(now):
+                        wait = callKind.bucket.tryAcquire()
+                        if wait:
+                            timeout = min(timeout or float('inf'), wait)
+                            continue
+                    heapq.heappop(callKind.queue)
+                    callKind.running += 1
+                    return callKind, call
+                self.condition.wait(timeout)
+
+    def run(self):
+        while True:
+            callKind, call = self.nextCall()
+            retryDelay = None
+            try:
+                retryDelay = self.execute(callKind, call)
+            finally:
+                with self.condition:
+                    callKind.running -= 1
+                    if retryDelay is not None:
+                        heapq.heappush(callKind.delayed, (time.monotonic() + retryDelay, call.sequence, call))
+                    elif call.key is not None and self.inFlight.get((call.kind, call.key)) is call:
+                        del self.inFlight[(call.kind, call.key)]
+                    self.condition.notify_all()
+
+    def execute(self, callKind, call):
+        """
+        Makes one attempt at a call, whose rate-limit token nextCall() has already taken.
+
+        Returns:
+           float: Seconds to wait before re-queueing the call for another attempt, or None once it has finished.
+        """
+        if call.attempt == 0:
+            if not call.future.set_running_or_notify_cancel():
+                return None
+            if call.expired(time.monotonic()):
+                callKind.expired += 1
+                call.future.set_exception(TimeoutError(f"{call.kind} request expired in the queue"))
+                return None
+            wait = time.monotonic() - call.enqueuedAt
+            callKind.totalWait += wait
+            callKind.maxWait = max(callKind.maxWait, wait)
+
+        try:
+            result = call.fn(*call.args, **call.kwargs)
+        except RETRIABLE_ERRORS as e:
+            if call.attempt == self.maxRetries or (call.canRetry is not None and not call.canRetry()):
+                callKind.failures += 1
+                call.future.set_exception(e)
+                return None
+            callKind.retries += 1
+            delay = min(self.maxBackoff, self.backoff * 2 ** call.attempt) * random.uniform(0.5, 1.0)
+            if isinstance(e, openai.error.RateLimitError):
+                callKind.bucket.pause(delay)
+            print(f"Retrying {call.kind} request in {delay:.2f}s after {type(e).__name__}: {e}")
+            call.attempt += 1
+            return delay
+        except BaseException as e:
+            callKind.failures += 1
+            call.future.set_exception(e)
+            return None
+        else:
+            callKind.completed += 1
+            call.future.set_result(result)
+            return None
+
+    def stats(self):
+        """
+        Returns queue depth, running calls, counters and queue wait times for each kind.
+        """
+        with self.condition:
+            stats = {}
+            for name, callKind in self.kinds.items():
+                started = callKind.completed + callKind.failures
+                stats[name] = {
+                    'queueDepth': len(callKind.queue),
+                    'running': callKind.running,
+                    'submitted': callKind.submitted,
+                    'coalesced': callKind.coalesced,
+                    'rejected': callKind.rejected,
+                    'expired': callKind.expired,
+                    'retries': callKind.retries,
+                    'failures': callKind.failures,
+                    'completed': callKind.completed,
+                    'meanWaitMs': 1000 * callKind.totalWait / started if started else 0.0,
+                    'maxWaitMs': 1000 * callKind.maxWait,
+                }
+            return stats
+
+
+def defaultScheduler(numWorkers=8, embeddingRate=50.0, completionRate=10.0, maxQueued=256):
+    """
+    Returns a scheduler with the kinds used by the app registered, in priority order:
+    embeddings (query embeddings ahead of topic embeddings), alternate queries, then segway text.
+    """
+    scheduler = RequestScheduler(numWorkers)
+    scheduler.addKind('embedding', priority=0, rate=embeddingRate, maxQueued=maxQueued)
+    scheduler.addKind('alternate', priority=1, rate=completionRate, maxConcurrent=max(1, numWorkers // 2), maxQueued=maxQueued)
+    scheduler.addKind('segway', priority=2, rate=completionRate, maxConcurrent=max(1, numWorkers // 2), maxQueued=maxQueued)
+    return scheduler
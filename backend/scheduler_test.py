@@ -0,0 +1,139 @@
+import time
+import threading
+
+import openai
+import pytest
+
+from scheduler import RequestScheduler, SchedulerBusy
+
+
+def makeScheduler(**kindParams):
+    scheduler = RequestScheduler(numWorkers=4, backoff=0.01)
+    scheduler.addKind('test', rate=1000, **kindParams)
+    return scheduler
+
+
+def test_identical_requests_share_one_call():
+    calls = []
+    release = threading.Event()
+
+    def embed(text):
+        calls.append(text)
+        release.wait()
+        return text.upper()
+
+    scheduler = makeScheduler()
+    futures = [scheduler.submit('test', embed, 'hello', key='hello') for _ in range(5)]
+    other = scheduler.submit('test', embed, 'world', key='world')
+    release.set()
+    assert [future.result(1) for future in futures] == ['HELLO'] * 5
+    assert other.result(1) == 'WORLD'
+    assert sorted(calls) == ['hello', 'world']
+    assert scheduler.stats()['test']['coalesced'] == 4
+
+
+def test_rate_limits_are_retried_with_backoff():
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) < 3:
+            raise openai.error.RateLimitError("slow down")
+        return 'ok'
+
+    scheduler = makeScheduler()
+    assert scheduler.call('test', flaky, timeout=5) == 'ok'
+    assert len(attempts) == 3
+    assert attempts[2] - attempts[1] >= attempts[1] - attempts[0] > 0
+    assert scheduler.stats()['test']['retries'] == 2
+
+    def broken():
+        raise ValueError("not retriable")
+
+    with pytest.raises(ValueError):
+        scheduler.call('test', broken, timeout=5)
+    assert scheduler.stats()['test']['failures'] == 1
+
+
+def test_full_queue_rejects_instead_of_blocking():
+    release = threading.Event()
+    scheduler = makeScheduler(maxConcurrent=1, maxQueued=2)
+    running = scheduler.submit('test', release.wait)
+    time.sleep(0.05)
+    queued = [scheduler.submit('test', lambda i=i: i) for i in range(2)]
+    assert scheduler.stats()['test']['queueDepth'] == 2
+
+    start = time.monotonic()
+    with pytest.raises(SchedulerBusy):
+        scheduler.submit('test', lambda: None)
+    assert time.monotonic() - start < 0.1
+
+    release.set()
+    assert running.result(1) is True
+    assert [future.result(1) for future in queued] == [0, 1]
+
+
+def test_higher_priority_kinds_go_first():
+    order = []
+    release = threading.Event()
+    scheduler = RequestScheduler(numWorkers=1)
+    scheduler.addKind('slow', priority=1, rate=1000)
+    scheduler.addKind('fast', priority=0, rate=1000)
+
+    blocker = scheduler.submit('slow', release.wait)
+    time.sleep(0.05)
+    futures = [scheduler.submit('slow', order.append, 'slow') for _ in range(2)]
+    futures += [scheduler.submit('fast', order.append, 'fast') for _ in range(2)]
+    release.set()
+    for future in [blocker] + futures:
+        future.result(1)
+    assert order == ['fast', 'fast', 'slow', 'slow']
+
+
+def test_a_kind_out_of_tokens_does_not_hold_workers():
+    done = {}
+    scheduler = RequestScheduler(numWorkers=2)
+    scheduler.addKind('throttled', priority=0, rate=5, burst=1)
+    scheduler.addKind('other', priority=1, rate=1000)
+
+    throttled = [scheduler.submit('throttled', lambda i=i: done.setdefault(i, time.monotonic())) for i in range(3)]
+    time.sleep(0.05)
+    # the throttled calls wait in their queue for tokens, not on the workers
+    assert scheduler.stats()['throttled']['running'] == 0
+    assert scheduler.submit('other', lambda: 'ok').result(0.1) == 'ok'
+
+    for future in throttled:
+        future.result(2)
+    assert done[2] - done[1] >= 0.15 and done[1] - done[0] >= 0.15
+
+
+def test_retry_backoff_does_not_hold_a_worker():
+    attempts = []
+
+    def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise openai.error.Timeout("try again")
+        return 'ok'
+
+    scheduler = RequestScheduler(numWorkers=1, backoff=0.4)
+    scheduler.addKind('flaky', priority=0, rate=1000)
+    scheduler.addKind('other', priority=1, rate=1000)
+    retried = scheduler.submit('flaky', flaky)
+    time.sleep(0.05)
+    assert scheduler.submit('other', lambda: 'ok').result(0.1) == 'ok'
+    assert retried.result(2) == 'ok' and attempts[1] - attempts[0] >= 0.2
+
+
+def test_calls_are_not_retried_once_they_say_so():
+    sent = []
+
+    def stream():
+        sent.append("token")
+        raise openai.error.APIConnectionError("connection reset")
+
+    scheduler = makeScheduler()
+    with pytest.raises(openai.error.APIConnectionError):
+        scheduler.call('test', stream, canRetry=lambda: not sent, timeout=5)
+    assert sent == ["token"]
+    assert scheduler.stats()['test']['retries'] == 0 and scheduler.stats()['test']['failures'] == 1
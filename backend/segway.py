@@ -1,5 +1,31 @@
 from langchain.chains import LLMChain
 from langchain import PromptTemplate, FewShotPromptTemplate
+from langchain.callbacks.base import BaseCallbackHandler
+
+from extensions import socketio
+from scheduler import SchedulerBusy
+
+
+class SocketIOStreamHandler(BaseCallbackHandler):
+    """
+    A callback handler that forwards each generated token to a Socket.IO room as it arrives.
+
+    Attributes:
+        room (str): The room the tokens are emitted to.
+        requestID (str): Identifies which response the tokens belong to.
+        emit (callable): Emits an event, with the signature of socketio.emit.
+        numTokens (int): Number of tokens emitted so far.
+    """
+
+    def __init__(self, room, requestID, emit=None):
+        self.room = room
+        self.requestID = requestID
+        self.emit = emit or socketio.emit
+        self.numTokens = 0
+
+    def on_llm_new_token(self, token, **kwargs):
+        self.numTokens += 1
+        self.emit('segway-token', {'requestID': self.requestID, 'token': token}, room=self.room)
 
 
 class TopicSegway:
@@ -13,10 +39,17 @@ class TopicSegway:
         few_shot_prompt (FewShotPromptTemplate): Few-shot prompt to guide the language model.
     """
 
-    def __init__(self, llm):
+    def __init__(self, llm, scheduler=None, emit=None):
         """
         The constructor for TopicSegway class.
+
+        Parameters:
+           llm (OpenAI): Language model to generate responses.
+           scheduler (RequestScheduler): Shared scheduler for LLM calls. Default is None (call the LLM directly).
+           emit (callable): Emits streamed tokens, with the signature of socketio.emit. Default is None (socketio.emit).
         """
+        self.scheduler = scheduler
+        self.emit = emit or socketio.emit
         self.configurePrompt()
         self.chain = LLMChain(llm=llm, prompt=self.few_shot_prompt)
 
@@ -81,16 +114,25 @@ class TopicSegway:
         )
         print("Set up few shot prompt")
 
-    def getResponse(self, query, topics):
+    def getResponse(self, query, topics, userID=None, requestID=None):
         """
         Generates a response to a given query in the context of a series of topic names.
 
+        If a userID is given, the response is also streamed to the user's "userID_" room:
+        a 'segway-token' event per generated token (when the language model streams), then
+        a 'segway-done' event carrying the full text. If the completion fails, whether the
+        scheduler is too busy to take it or the upstream call fails part way through, a
+        'segway-failed' event is sent instead and None is returned, since nothing else is
+        waiting on a streamed response.
+
         Parameters:
            query (str): The query to generate a response for.
            topics (list): A list of topic dictionaries with the keys 'topicName', 'topicID', and 'userID'.
+           userID (str): The user to stream the response to. Default is None (no streaming).
+           requestID (str): Echoed back in the streamed events so the client can match them up. Default is None.
 
         Returns:
-           str: The generated response to the query.
+           str: The generated response to the query, or None if a streamed response failed.
         """
         print(f"Generating response for query {query}")
 
@@ -104,6 +146,24 @@ class TopicSegway:
         }
 
         print("Input:", input)
-        response = self.chain.run(input)
+        if userID is None:
+            response = self.runChain(input, key=tuple(input.values()))
+        else:
+            room = f"userID_{userID}"
+            try:
+                response = self.runChain(input, streamHandler=SocketIOStreamHandler(room, requestID, self.emit))
+            except Exception as e:
+                print(f"Streamed response {requestID} failed: {e!r}")
+                self.emit('segway-failed', {'requestID': requestID, 'busy': isinstance(e, SchedulerBusy)}, room=room)
+                return None
+            self.emit('segway-done', {'requestID': requestID, 'text': response}, room=room)
         print("Response:", response)
-        return response
\ No newline at end of file
+        return response
+
+    def runChain(self, input, key=None, streamHandler=None):
+        callbacks = [streamHandler] if streamHandler is not None else None
+        if self.scheduler is None:
+            return self.chain.run(input, callbacks=callbacks)
+        # once tokens have reached the user, a retry would send them all a second time
+        canRetry = (lambda: streamHandler.numTokens == 0) if streamHandler is not None else None
+        return self.scheduler.call('segway', self.chain.run, input, key=key, canRetry=canRetry, callbacks=callbacks)
@@ -0,0 +1,109 @@
+import time
+from typing import Any, List, Optional
+
+import openai
+import pytest
+from flask import Flask
+from langchain.llms.base import LLM
+
+import events # registers the room handlers on socketio
+from extensions import socketio
+from scheduler import RequestScheduler
+from segway import TopicSegway
+
+
+class FakeStreamingLLM(LLM):
+    """
+    A fake LLM that streams its tokens through the callback manager, one every `delay` seconds.
+    """
+
+    tokens: List[str]
+    delay: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        for token in self.tokens:
+            time.sleep(self.delay)
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+        return "".join(self.tokens)
+
+
+TOPICS = [
+    {'topicName': "How does climate change affect wildlife?", 'topicID': 1, 'userID': 'a'},
+    {'topicName': "What are the economic consequences of climate change?", 'topicID': 2, 'userID': 'b'},
+]
+
+
+def test_response_is_streamed_to_user_room():
+    app = Flask(__name__)
+    socketio.init_app(app)
+    client = socketio.test_client(app)
+    bystander = socketio.test_client(app)
+    client.emit('user-join', {'userID': 'u1', 'room': 'u1'})
+    bystander.emit('user-join', {'userID': 'u2', 'room': 'u2'})
+
+    tokens = ["You might ", "enjoy ", "discussing ", "wildlife."]
+    segway = TopicSegway(FakeStreamingLLM(tokens=tokens))
+    assert segway.getResponse("climate change", TOPICS, userID='u1', requestID='r1') == "".join(tokens)
+
+    received = client.get_received()
+    assert [event['args'][0]['token'] for event in received if event['name'] == 'segway-token'] == tokens
+    assert received[-1]['name'] == 'segway-done'
+    assert received[-1]['args'][0] == {'requestID': 'r1', 'text': "".join(tokens)}
+    assert bystander.get_received() == []
+
+
+def test_without_user_nothing_is_emitted():
+    app = Flask(__name__)
+    socketio.init_app(app)
+    client = socketio.test_client(app)
+    client.emit('user-join', {'userID': 'u1', 'room': 'u1'})
+
+    segway = TopicSegway(FakeStreamingLLM(tokens=["plain ", "text"]))
+    assert segway.getResponse("climate change", TOPICS) == "plain text"
+    assert client.get_received() == []
+
+
+class FailingStreamingLLM(FakeStreamingLLM):
+    """
+    A fake streaming LLM whose connection drops after `failAfter` tokens on every call.
+    """
+
+    failAfter: int
+    calls: List[int] = []
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        self.calls.append(len(self.calls))
+        for token in self.tokens[:self.failAfter]:
+            run_manager.on_llm_new_token(token)
+        raise openai.error.APIConnectionError("connection reset")
+
+
+@pytest.mark.parametrize('failAfter, attempts', [(0, 3), (2, 1)])
+def test_streamed_response_is_only_retried_before_its_first_token(failAfter, attempts):
+    sent = []
+    scheduler = RequestScheduler(numWorkers=1, maxRetries=2, backoff=0.01)
+    scheduler.addKind('segway', rate=1000)
+    llm = FailingStreamingLLM(tokens=["You might ", "enjoy ", "wildlife."], failAfter=failAfter, calls=[])
+    segway = TopicSegway(llm, scheduler=scheduler, emit=lambda event, data, room: sent.append((event, data)))
+
+    # the client is told the response failed, rather than being left waiting for 'segway-done'
+    assert segway.getResponse("climate change", TOPICS, userID='u1', requestID='r1') is None
+    assert len(llm.calls) == attempts
+    assert [event for event, _ in sent] == ['segway-token'] * failAfter + ['segway-failed']
+    assert sent[-1][1] == {'requestID': 'r1', 'busy': False}
+
+
+def test_streamed_response_fails_fast_when_the_scheduler_is_busy():
+    sent = []
+    scheduler = RequestScheduler(numWorkers=1)
+    scheduler.addKind('segway', rate=1000, maxQueued=0)
+    llm = FakeStreamingLLM(tokens=["never ", "sent"])
+    segway = TopicSegway(llm, scheduler=scheduler, emit=lambda event, data, room: sent.append((event, data)))
+
+    assert segway.getResponse("climate change", TOPICS, userID='u1', requestID='r2') is None
+    assert sent == [('segway-failed', {'requestID': 'r2', 'busy': True})]
@@ -0,0 +1,92 @@
+import threading
+
+from sqlalchemy import func, select
+
+
+class MessageSequencer:
+    """
+    Hands out consecutive message numbers per chat.
+
+    Each chat's counter is loaded from the database the first time the chat is seen, then
+    incremented in memory under a per-chat lock, so concurrent senders never get the same
+    number and no query is needed per message. The (chatID, messageNumber) unique
+    constraint backs this up: if another process writes to the same chat, the insert fails
+    instead of silently duplicating a number, and reset() makes the next call reload.
+
+    Attributes:
+        loadLast (callable): Returns the highest stored messageNumber for a chat, or None.
+    """
+
+    def __init__(self, loadLast):
+        """
+        The constructor for MessageSequencer class.
+
+        Parameters:
+           loadLast (callable): Called with a chatID; returns its highest stored messageNumber, or None.
+        """
+        self.loadLast = loadLast
+        self.counters = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def chatLock(self, chatID):
+        with self.lock:
+            return self.locks.setdefault(chatID, threading.Lock())
+
+    def next(self, chatID):
+        """
+        Returns the next message number for a chat.
+        """
+        with self.chatLock(chatID):
+            last = self.counters.get(chatID)
+            if last is None:
+                last = self.loadLast(chatID)
+                last = -1 if last is None else last
+            self.counters[chatID] = last + 1
+            return last + 1
+
+    def reset(self, chatID):
+        """
+        Forgets a chat's counter so the next call reloads it from the database.
+        """
+        with self.chatLock(chatID):
+            self.counters.pop(chatID, None)
+
+
+class SharedMessageSequencer:
+    """
+    Hands out message numbers from a database counter per chat, for several workers.
+
+    An in-memory counter per process would let two workers give out the same number, so
+    every message takes one IDAllocator transaction instead. The counter's floor is the
+    chat's highest stored messageNumber (one lookup on the unique index), so it can never
+    fall behind messages written by a single-worker run.
+
+    Attributes:
+        allocator (IDAllocator): Allocates from the 'chat-<chatID>' counters.
+        chatApp (ChatApplication): The app whose ChatMessage table provides the floor.
+    """
+
+    def __init__(self, allocator, chatApp):
+        """
+        The constructor for SharedMessageSequencer class.
+
+        Parameters:
+           allocator (IDAllocator): Allocates from the 'chat-<chatID>' counters.
+           chatApp (ChatApplication): The app whose ChatMessage table provides the floor.
+        """
+        self.allocator = allocator
+        self.chatApp = chatApp
+
+    def next(self, chatID):
+        """
+        Returns the next message number for a chat.
+        """
+        ChatMessage = self.chatApp.ChatMessage
+        floor = select(func.max(ChatMessage.messageNumber)).where(ChatMessage.chatID == chatID).scalar_subquery()
+        return self.allocator.allocate(f"chat-{chatID}", start=0, floor=floor)
+
+    def reset(self, chatID):
+        """
+        Nothing to forget: the next call re-reads the counter and the floor.
+        """
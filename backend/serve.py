@@ -0,0 +1,65 @@
+"""
+Production entry point for the backend.
+
+Runs the app on the server selected by CHATMOS_SERVER_MODE: 'gevent' serves every
+HTTP request and socket connection on cooperative greenlets, with blocking matching
+and LLM work moved to CHATMOS_BLOCKING_POOL_SIZE native threads; 'threading' is the
+development server that `python main.py` runs.
+
+With CHATMOS_WORKERS=N (N > 1) this starts N worker processes on ports PORT to
+PORT+N-1, sharing the database and the CHATMOS_MESSAGE_QUEUE Socket.IO message queue,
+and waits for them. Put a load balancer with sticky sessions in front of them.
+
+Usage:
+    CHATMOS_SERVER_MODE=gevent CHATMOS_PORT=5000 python serve.py
+    CHATMOS_WORKERS=4 CHATMOS_MESSAGE_QUEUE=redis://localhost:6379/0 CHATMOS_SERVER_MODE=gevent python serve.py
+"""
+import os
+import sys
+import signal
+import subprocess
+
+import config
+
+
+def runWorkers():
+    if not config.MESSAGE_QUEUE:
+        sys.exit("CHATMOS_WORKERS > 1 needs CHATMOS_MESSAGE_QUEUE so broadcasts reach clients on every worker")
+    # create and migrate the schema once here, rather than having every worker race to
+    from main import ChatApplication
+    ChatApplication()
+
+    workers = []
+    for i in range(config.WORKERS):
+        env = dict(os.environ, CHATMOS_WORKER_ID=f"worker-{i}", CHATMOS_PORT=str(config.PORT + i))
+        workers.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+        print(f"Started worker-{i} on port {config.PORT + i}")
+
+    def stop(signum, frame):
+        for worker in workers:
+            worker.terminate()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    sys.exit(max(worker.wait() for worker in workers))
+
+
+if __name__ == '__main__' and config.WORKERS > 1 and not config.WORKER_ID:
+    runWorkers()
+
+if config.SERVER_MODE == 'gevent':
+    from gevent import monkey
+    # the app's worker threads (batching, scheduling, write-behind) stay real threads, and the
+    # queues they block on stay thread queues
+    monkey.patch_all(thread=False, queue=False)
+
+    import platform
+    # the openai client reads this on its first request, which runs `uname` in a subprocess;
+    # gevent can only wait on children from the main thread, so resolve it here once
+    platform.uname().processor
+
+from main import ChatApplication
+
+
+if __name__ == '__main__':
+    chatApp = ChatApplication()
+    chatApp.run()
@@ -0,0 +1,250 @@
+import os
+import json
+
+import numpy as np
+
+
+class TopicStore:
+    """
+    Columnar storage for topic embeddings and metadata.
+
+    Embeddings live in a single preallocated float32 matrix that grows by doubling, with
+    parallel typed arrays for the topic ID, the interned user ID and a liveness flag, so
+    each topic costs roughly 4*d bytes instead of a Python list of boxed floats.
+
+    Attributes:
+        dim (int): The dimensionality of the stored embeddings.
+        size (int): Number of rows in use, including removed (dead) rows.
+        vectors (np.array): The (capacity, dim) float32 embedding matrix.
+        sqNorms (np.array): Squared L2 norm of each row, used for exact search.
+        topicIDs (np.array): int64 topic ID of each row.
+        userCodes (np.array): int32 interned user ID of each row.
+        alive (np.array): bool flag per row, False once the topic is removed or replaced.
+        titles (list): Title of each row.
+        users (list): Interned user IDs, indexed by user code.
+        rowOf (dict): Map from topicID to the row of its live embedding.
+    """
+
+    def __init__(self, dim, capacity=1024):
+        """
+        The constructor for TopicStore class.
+
+        Parameters:
+           dim (int): The dimensionality of the stored embeddings.
+           capacity (int): Number of rows to preallocate. Default is 1024.
+        """
+        self.dim = dim
+        self.size = 0
+        self.numDead = 0
+        self.vectors = np.empty((capacity, dim), dtype='float32')
+        self.sqNorms = np.empty(capacity, dtype='float32')
+        self.topicIDs = np.empty(capacity, dtype='int64')
+        self.userCodes = np.empty(capacity, dtype='int32')
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.titles = []
+        self.users = []
+        self.userCodeOf = {}
+        self.rowOf = {}
+
+    def __len__(self):
+        return len(self.rowOf)
+
+    @property
+    def capacity(self):
+        return len(self.vectors)
+
+    def reserve(self, capacity):
+        """
+        Grows the backing arrays so they can hold at least `capacity` rows.
+        """
+        if capacity <= self.capacity:
+            return
+        newCapacity = max(capacity, 2 * self.capacity, 1024)
+        for name in ('vectors', 'sqNorms', 'topicIDs', 'userCodes', 'alive'):
+            old = getattr(self, name)
+            new = np.zeros((newCapacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def internUser(self, userID):
+        """
+        Returns the integer code for a user ID, assigning one if it is new.
+        """
+        code = self.userCodeOf.get(userID)
+        if code is None:
+            code = len(self.users)
+            self.users.append(userID)
+            self.userCodeOf[userID] = code
+        return code
+
+    def add(self, topicTuples, embeddings):
+        """
+        Appends topics to the store, retiring the previous row of any topic that is re-added.
+
+        Parameters:
+           topicTuples (list): A list of (topicID, userID, title) tuples.
+           embeddings (np.array): A float32 matrix with one row per topic.
+
+        Returns:
+           np.array: The rows the topics were written to.
+        """
+        embeddings = np.asarray(embeddings, dtype='float32').reshape(len(topicTuples), self.dim)
+        start, end = self.size, self.size + len(topicTuples)
+        self.reserve(end)
+        self.vectors[start:end] = embeddings
+        self.sqNorms[start:end] = np.einsum('ij,ij->i', embeddings, embeddings)
+        self.alive[start:end] = True
+        for row, (topicID, userID, title) in enumerate(topicTuples, start):
+            self.remove(topicID)
+            self.topicIDs[row] = topicID
+            self.userCodes[row] = self.internUser(userID)
+            self.titles.append(title)
+            self.rowOf[topicID] = row
+        self.size = end
+        return np.arange(start, end, dtype='int64')
+
+    def remove(self, topicID):
+        """
+        Marks a topic's row as dead. Dead rows keep their slot until the store is compacted.
+
+        Returns:
+           int: The row that was retired, or None if the topic was not stored.
+        """
+        row = self.rowOf.pop(topicID, None)
+        if row is not None:
+            self.alive[row] = False
+            self.numDead += 1
+        return row
+
+    def info(self, row):
+        """
+        Returns the (topicID, userID, title) tuple stored at a row.
+        """
+        return int(self.topicIDs[row]), self.users[self.userCodes[row]], self.titles[row]
+
+    def take(self, rows):
+        """
+        Returns a new store holding only the given rows, in order.
+        """
+        store = TopicStore(self.dim, capacity=max(len(rows), 1))
+        store.size = len(rows)
+        store.vectors[:store.size] = self.vectors[rows]
+        store.sqNorms[:store.size] = self.sqNorms[rows]
+        store.topicIDs[:store.size] = self.topicIDs[rows]
+        store.alive[:store.size] = True
+        store.titles = [self.titles[row] for row in rows]
+        # re-intern so users whose topics were all removed are dropped
+        store.userCodes[:store.size] = [store.internUser(self.users[code]) for code in self.userCodes[rows]]
+        store.rowOf = {int(topicID): row for row, topicID in enumerate(store.topicIDs[:store.size])}
+        return store
+
+    def eligibleRows(self, excludeUserID=None, excludeTopicIDs=None):
+        """
+        Returns a bool mask of the live rows that are not owned by `excludeUserID` and not in `excludeTopicIDs`.
+
+        Building the mask is a vectorized O(N) pass over compact arrays, which keeps the
+        cost of filtering bounded no matter how many topics the excluded user owns.
+        """
+        valid = self.alive[:self.size].copy()
+        code = self.userCodeOf.get(excludeUserID)
+        if code is not None:
+            valid &= self.userCodes[:self.size] != code
+        for topicID in excludeTopicIDs or ():
+            row = self.rowOf.get(topicID)
+            if row is not None:
+                valid[row] = False
+        return valid
+
+    def save(self, path, size=None, alive=None):
+        """
+        Writes the store to a directory of .npy and .json files.
+
+        Rows below `size` never change once written, so a caller holding a lock only needs
+        to capture the size and liveness mask under it and can write the rest without it.
+
+        Parameters:
+           path (str): The directory to write to. It must already exist.
+           size (int): Number of rows to write. Default is all of them.
+           alive (np.array): Liveness mask for those rows. Default is the current mask.
+        """
+        size = self.size if size is None else size
+        alive = self.alive[:size] if alive is None else alive
+        np.save(os.path.join(path, 'vectors.npy'), self.vectors[:size])
+        np.save(os.path.join(path, 'sqNorms.npy'), self.sqNorms[:size])
+        np.save(os.path.join(path, 'topicIDs.npy'), self.topicIDs[:size])
+        np.save(os.path.join(path, 'userCodes.npy'), self.userCodes[:size])
+        np.save(os.path.join(path, 'alive.npy'), alive)
+        with open(os.path.join(path, 'titles.json'), 'w') as f:
+            json.dump(self.titles[:size], f)
+        with open(os.path.join(path, 'users.json'), 'w') as f:
+            json.dump(self.users, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a store written by save().
+
+        The embedding matrix is memory-mapped read-only when `mmap` is set, so loading costs
+        a file open; it is copied into memory the first time the store has to grow.
+
+        Parameters:
+           path (str): The directory to read from.
+           mmap (bool): Whether to memory-map the embedding matrix. Default is True.
+        """
+        mmapMode = 'r' if mmap else None
+        vectors = np.load(os.path.join(path, 'vectors.npy'), mmap_mode=mmapMode)
+        store = cls(vectors.shape[1], capacity=0)
+        store.size = len(vectors)
+        store.vectors = vectors
+        store.sqNorms = np.load(os.path.join(path, 'sqNorms.npy'), mmap_mode=mmapMode)
+        store.topicIDs = np.load(os.path.join(path, 'topicIDs.npy'))
+        store.userCodes = np.load(os.path.join(path, 'userCodes.npy'))
+        store.alive = np.load(os.path.join(path, 'alive.npy'))
+        store.numDead = int(store.size - store.alive.sum())
+        with open(os.path.join(path, 'titles.json'), 'r') as f:
+            store.titles = json.load(f)
+        with open(os.path.join(path, 'users.json'), 'r') as f:
+            store.users = json.load(f)
+        store.userCodeOf = {userID: code for code, userID in enumerate(store.users)}
+        store.rowOf = {int(store.topicIDs[row]): int(row) for row in np.flatnonzero(store.alive)}
+        return store
+
+    def search(self, queries, n, valid=None):
+        """
+        Exact L2 search over the stored embeddings.
+
+        Parameters:
+           queries (np.array): A float32 matrix of query embeddings.
+           n (int): Number of neighbours to return per query.
+           valid (np.array): Optional bool mask of rows that may be returned. Defaults to the live rows.
+
+        Returns:
+           tuple: (distances, rows) matrices of shape (len(queries), n), padded with inf and -1.
+        """
+        queries = np.asarray(queries, dtype='float32').reshape(-1, self.dim)
+        if valid is None:
+            valid = self.alive[:self.size]
+        D = np.full((len(queries), n), np.inf, dtype='float32')
+        I = np.full((len(queries), n), -1, dtype='int64')
+        if self.size == 0 or n <= 0:
+            return D, I
+
+        # ||x - q||^2 = ||x||^2 - 2 x.q + ||q||^2
+        distances = self.sqNorms[:self.size] - 2 * (queries @ self.vectors[:self.size].T)
+        distances += np.einsum('ij,ij->i', queries, queries)[:, None]
+        distances[:, ~valid] = np.inf
+
+        m = min(n, self.size)
+        for q in range(len(queries)):
+            candidates = np.argpartition(distances[q], m - 1)[:m] if m < self.size else np.arange(self.size)
+            candidates = candidates[np.argsort(distances[q, candidates], kind='stable')]
+            candidates = candidates[np.isfinite(distances[q, candidates])]
+            D[q, :len(candidates)] = distances[q, candidates]
+            I[q, :len(candidates)] = candidates
+        return D, I
+
+    def nbytes(self):
+        """
+        Returns the bytes held by the numeric arrays (allocated, not just used).
+        """
+        return sum(a.nbytes for a in (self.vectors, self.sqNorms, self.topicIDs, self.userCodes, self.alive))
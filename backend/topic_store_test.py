@@ -0,0 +1,60 @@
+import numpy as np
+
+from topic_store import TopicStore
+
+
+DIM = 4
+
+
+def makeStore(capacity=2):
+    store = TopicStore(DIM, capacity=capacity)
+    vectors = np.arange(5 * DIM, dtype='float32').reshape(5, DIM)
+    store.add([(10 + i, 'u1' if i < 3 else 'u2', f"topic {i}") for i in range(5)], vectors)
+    return store, vectors
+
+
+def test_add_grows_and_interns_users():
+    store, vectors = makeStore()
+    assert len(store) == store.size == 5 and store.capacity >= 5
+    assert store.users == ['u1', 'u2']
+    assert store.info(3) == (13, 'u2', "topic 3")
+    assert np.array_equal(store.vectors[:5], vectors)
+    assert np.allclose(store.sqNorms[:5], (vectors ** 2).sum(axis=1))
+
+
+def test_remove_and_readd_leave_tombstones():
+    store, vectors = makeStore()
+    assert store.remove(11) == 1 and store.remove(11) is None
+    store.add([(12, 'u1', "topic 2 renamed")], vectors[:1])
+    assert len(store) == 4 and store.size == 6 and store.numDead == 2
+    assert store.rowOf[12] == 5 and store.info(5) == (12, 'u1', "topic 2 renamed")
+    assert list(store.alive[:6]) == [True, False, False, True, True, True]
+
+    # compaction keeps only the live rows, and drops users left without topics
+    compacted = store.take(np.flatnonzero(store.alive[:store.size]))
+    assert compacted.numDead == 0 and compacted.rowOf == {10: 0, 13: 1, 14: 2, 12: 3}
+    assert compacted.info(3) == (12, 'u1', "topic 2 renamed")
+    assert store.take(np.array([3, 4])).users == ['u2']
+
+
+def test_eligible_rows_exclude_the_user_removed_and_selected_topics():
+    store, _ = makeStore()
+    store.remove(14)
+    assert list(store.eligibleRows()) == [True, True, True, True, False]
+    assert list(store.eligibleRows(excludeUserID='u1')) == [False, False, False, True, False]
+    assert list(store.eligibleRows(excludeUserID='u2', excludeTopicIDs={10, 99})) == [False, True, True, False, False]
+    assert list(store.eligibleRows(excludeUserID='nobody')) == list(store.eligibleRows())
+
+
+def test_masked_exact_search():
+    store, vectors = makeStore()
+    D, I = store.search(vectors[[0, 4]] + 0.1, 2)
+    assert I.tolist() == [[0, 1], [4, 3]]
+    assert np.allclose(D[0], ((vectors[[0, 1]] - vectors[0] - 0.1) ** 2).sum(axis=1), rtol=1e-4)
+
+    # masked-out rows are never returned, and missing neighbours are padded
+    valid = store.eligibleRows(excludeUserID='u1')
+    D, I = store.search(vectors[0], 3, valid)
+    assert I.tolist() == [[3, 4, -1]] and np.isinf(D[0, 2])
+    store.remove(13)
+    assert store.search(vectors[3], 5)[1].tolist() == [[2, 4, 1, 0, -1]]
@@ -0,0 +1,154 @@
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from sqlalchemy import delete, func, insert, or_, select
+
+
+class TopicSync:
+    """
+    Keeps every worker's matcher in step with topic changes made by the others.
+
+    Each worker applies its own adds, updates and removes to its matcher directly and
+    records them in the topic_changes table, together with the embedding it computed,
+    so other workers replay the change without another embedding call. A background
+    thread polls the table for changes from other workers, in id order.
+
+    Autoincrement ids can commit out of order on server databases, so ids skipped by a
+    poll are looked for again until `gapTimeout` passes. Changes older than `retention`
+    are pruned; a worker that starts later loads topics from the topics table instead.
+
+    Attributes:
+        chatApp (ChatApplication): The app whose database and matcher are kept in step.
+        workerID (str): Identifies this process's changes.
+        pollInterval (float): Seconds between polls.
+        lastSeen (int): Highest change id handled so far.
+        numRecorded (int): Number of changes recorded by this worker.
+        numApplied (int): Number of other workers' changes applied to this worker's matcher.
+    """
+
+    def __init__(self, chatApp, pollIntervalMs=500, retentionSeconds=3600, gapTimeout=60):
+        """
+        The constructor for TopicSync class.
+
+        Parameters:
+           chatApp (ChatApplication): The app whose database and matcher are kept in step.
+           pollIntervalMs (float): Milliseconds between polls. Default is 500.
+           retentionSeconds (float): How long changes are kept in the table. Default is 3600.
+           gapTimeout (float): Seconds to keep looking for a skipped change id. Default is 60.
+        """
+        self.chatApp = chatApp
+        self.workerID = uuid.uuid4().hex
+        self.pollInterval = pollIntervalMs / 1000
+        self.retention = timedelta(seconds=retentionSeconds)
+        self.gapTimeout = gapTimeout
+        self.lastSeen = 0
+        self.gaps = {}
+        self.lastPruned = time.monotonic()
+        self.numRecorded = 0
+        self.numApplied = 0
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def record(self, op, topicID, userID=None, title=None, embedding=None):
+        """
+        Records a change this worker has already applied to its own matcher.
+
+        Parameters:
+           op (str): 'add', 'update' or 'remove'.
+           topicID (int): The topic that changed.
+           userID (str): The topic's user, for adds and updates.
+           title (str): The topic's title, for adds and updates.
+           embedding (np.array): The title's embedding, or None if the matcher skipped the topic.
+        """
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype='float32').tobytes()
+        table = self.chatApp.TopicChange.__table__
+        with self.chatApp.app.app_context():
+            with self.chatApp.db.engine.begin() as connection:
+                connection.execute(insert(table).values(
+                    op=op, topicID=topicID, userID=userID, title=title, embedding=embedding,
+                    workerID=self.workerID, createdAt=datetime.now(timezone.utc)))
+        self.numRecorded += 1
+
+    def skipExisting(self):
+        """
+        Starts following changes from the newest one recorded; called before loading topics from the database.
+        """
+        table = self.chatApp.TopicChange.__table__
+        with self.chatApp.app.app_context():
+            with self.chatApp.db.engine.connect() as connection:
+                self.lastSeen = connection.execute(select(func.max(table.c.id))).scalar() or 0
+
+    def poll(self):
+        """
+        Applies every change recorded by other workers since the last poll; returns how many were applied.
+        """
+        table = self.chatApp.TopicChange.__table__
+        condition = table.c.id > self.lastSeen
+        if self.gaps:
+            condition = or_(condition, table.c.id.in_(list(self.gaps)))
+        with self.chatApp.app.app_context():
+            with self.chatApp.db.engine.connect() as connection:
+                changes = connection.execute(select(table).where(condition).order_by(table.c.id)).all()
+
+        applied = 0
+        for change in changes:
+            if change.id > self.lastSeen:
+                now = time.monotonic()
+                self.gaps.update((missing, now) for missing in range(self.lastSeen + 1, change.id))
+                self.lastSeen = change.id
+            self.gaps.pop(change.id, None)
+            if change.workerID != self.workerID:
+                self.apply(change)
+                applied += 1
+        self.gaps = {id: since for id, since in self.gaps.items() if time.monotonic() - since < self.gapTimeout}
+
+        if time.monotonic() - self.lastPruned > 60:
+            self.prune()
+        return applied
+
+    def apply(self, change):
+        matcher = self.chatApp.matcher
+        if change.op == 'remove' or change.embedding is None:
+            # a topic the matcher skips (e.g. Brainstorm) is recorded without an embedding
+            matcher.removeTopic(change.topicID)
+        else:
+            embedding = np.frombuffer(change.embedding, dtype='float32').reshape(1, -1)
+            matcher.addEmbeddings([(change.topicID, change.userID, change.title)], embedding)
+        self.numApplied += 1
+
+    def prune(self):
+        table = self.chatApp.TopicChange.__table__
+        cutoff = datetime.now(timezone.utc) - self.retention
+        with self.chatApp.app.app_context():
+            with self.chatApp.db.engine.begin() as connection:
+                connection.execute(delete(table).where(table.c.createdAt < cutoff))
+        self.lastPruned = time.monotonic()
+
+    def start(self):
+        """
+        Starts applying other workers' changes in the background.
+        """
+        self.worker = threading.Thread(target=self.run, name='topic-sync', daemon=True)
+        self.worker.start()
+
+    def run(self):
+        while not self.stopped.wait(self.pollInterval):
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Failed to apply topic changes: {e}")
+
+    def close(self):
+        self.stopped.set()
+
+    def stats(self):
+        return {
+            'workerID': self.workerID,
+            'lastSeen': self.lastSeen,
+            'recorded': self.numRecorded,
+            'applied': self.numApplied,
+        }
@@ -0,0 +1,194 @@
+import numpy as np
+import faiss
+
+
+INDEX_TYPES = ('flat', 'ivf-flat', 'ivf-pq', 'hnsw')
+
+
+def defaultNlist(numVectors):
+    return int(np.clip(np.sqrt(numVectors), 16, 65536))
+
+
+def minTrainSize(indexType, numVectors, nlist=None, pqBits=8):
+    """
+    Returns the number of vectors needed to train an index well (about 39 per k-means centroid).
+    """
+    nlist = nlist or defaultNlist(numVectors)
+    if indexType == 'ivf-flat':
+        return 39 * nlist
+    if indexType == 'ivf-pq':
+        return 39 * max(nlist, 2 ** pqBits)
+    return 0
+
+
+class AnnIndex:
+    """
+    An approximate nearest-neighbour index over the rows of a TopicStore.
+
+    Wraps a FAISS IVF-flat, IVF-PQ or HNSW index whose IDs are store rows. Exact
+    ('flat') search does not need one, since it runs directly over the store.
+
+    Attributes:
+        indexType (str): One of 'ivf-flat', 'ivf-pq' or 'hnsw'.
+        dim (int): The dimensionality of the indexed vectors.
+        index (faiss.Index): The underlying FAISS index.
+        trainedSize (int): Number of live topics the index was trained for.
+    """
+
+    def __init__(self, indexType, dim, numVectors, nlist=None, nprobe=16, pqM=None, pqBits=8,
+                 hnswM=32, efConstruction=80, efSearch=64):
+        """
+        The constructor for AnnIndex class.
+
+        Parameters:
+           indexType (str): One of 'ivf-flat', 'ivf-pq' or 'hnsw'.
+           dim (int): The dimensionality of the indexed vectors.
+           numVectors (int): The corpus size the index is being built for, used to size the IVF lists.
+           nlist (int): Number of IVF lists. Default is sqrt(numVectors).
+           nprobe (int): Number of IVF lists visited per query. Default is 16.
+           pqM (int): Number of PQ sub-quantizers; must divide dim. Default gives sub-vectors of about 16 dimensions.
+           pqBits (int): Bits per PQ code. Default is 8.
+           hnswM (int): Number of HNSW neighbours per node. Default is 32.
+           efConstruction (int): HNSW build-time search depth. Default is 80.
+           efSearch (int): HNSW query-time search depth. Default is 64.
+        """
+        assert indexType in INDEX_TYPES and indexType != 'flat', f"Unknown ANN index type {indexType}"
+        self.indexType = indexType
+        self.dim = dim
+        self.trainedSize = numVectors
+        nlist = nlist or defaultNlist(numVectors)
+        pqM = pqM or max((m for m in range(1, dim // 16 + 1) if dim % m == 0), default=1)
+        self.pqBits = pqBits
+
+        if indexType == 'ivf-flat':
+            self.index = faiss.index_factory(dim, f"IVF{nlist},Flat")
+        elif indexType == 'ivf-pq':
+            self.index = faiss.index_factory(dim, f"IVF{nlist},PQ{pqM}x{pqBits}")
+        else:
+            self.index = faiss.index_factory(dim, f"IDMap2,HNSW{hnswM},Flat")
+            hnsw = faiss.downcast_index(self.index.index).hnsw
+            hnsw.efConstruction = efConstruction
+            hnsw.efSearch = efSearch
+
+        if indexType.startswith('ivf'):
+            self.index.nprobe = nprobe
+
+    @property
+    def minTrainSize(self):
+        return minTrainSize(self.indexType, self.trainedSize, self.index.nlist if self.indexType != 'hnsw' else None, self.pqBits)
+
+    def train(self, vectors):
+        """
+        Trains the index on the given vectors. HNSW needs no training and ignores them.
+        """
+        if not self.index.is_trained:
+            self.index.train(np.ascontiguousarray(vectors, dtype='float32'))
+
+    def add(self, vectors, rows):
+        """
+        Adds vectors to the index under the given store rows.
+        """
+        self.index.add_with_ids(np.ascontiguousarray(vectors, dtype='float32'), np.asarray(rows, dtype='int64'))
+
+    def search(self, queries, n, valid=None):
+        """
+        Returns (distances, rows) matrices for the n approximate nearest neighbours of each query.
+
+        Parameters:
+           queries (np.array): A float32 matrix of query embeddings.
+           n (int): Number of neighbours to return per query.
+           valid (np.array): Optional bool mask over store rows; rows outside it are skipped
+               inside the FAISS search itself rather than filtered out afterwards.
+        """
+        queries = np.ascontiguousarray(queries, dtype='float32')
+        if valid is None:
+            return self.index.search(queries, n)
+
+        bitmap = np.packbits(valid, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(valid), faiss.swig_ptr(bitmap))
+        if self.indexType == 'hnsw':
+            efSearch = faiss.downcast_index(self.index.index).hnsw.efSearch
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(efSearch, n))
+        else:
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=self.index.nprobe)
+        return self.index.search(queries, n, params=params)
+
+    def emptyCopy(self):
+        """
+        Returns a copy of the index with the same training (IVF centroids and PQ codebooks) but no vectors.
+        """
+        copy = AnnIndex.deserialize(self.indexType, self.serialize(), self.trainedSize)
+        copy.index.reset()
+        return copy
+
+    def nbytes(self):
+        """
+        Returns the serialized size of the index, a close proxy for its resident memory.
+        """
+        return faiss.serialize_index(self.index).nbytes
+
+    def serialize(self):
+        return faiss.serialize_index(self.index)
+
+    @classmethod
+    def deserialize(cls, indexType, data, trainedSize):
+        annIndex = cls.__new__(cls)
+        annIndex.indexType = indexType
+        annIndex.index = faiss.deserialize_index(data)
+        annIndex.dim = annIndex.index.d
+        annIndex.pqBits = faiss.downcast_index(annIndex.index).pq.nbits if indexType == 'ivf-pq' else 8
+        annIndex.trainedSize = trainedSize
+        return annIndex
+
+
+def buildAnnIndex(store, indexType, maxTrainSize=256 * 1024, chunkSize=65536, **indexParams):
+    """
+    Builds and trains an ANN index over the live rows of a store.
+
+    Parameters:
+       store (TopicStore): The store to index.
+       indexType (str): One of INDEX_TYPES.
+       maxTrainSize (int): Largest random sample of vectors to train on. Default is 262144.
+       chunkSize (int): Number of vectors copied out of the store per add. Default is 65536.
+       indexParams: Extra keyword arguments for AnnIndex.
+
+    Returns:
+       AnnIndex: The built index, or None for 'flat' or when the store is too small to train on.
+    """
+    if indexType == 'flat':
+        return None
+    rows = np.flatnonzero(store.alive[:store.size])
+    annIndex = AnnIndex(indexType, store.dim, len(rows), **indexParams)
+    if len(rows) == 0 or len(rows) < annIndex.minTrainSize:
+        return None
+    sample = rows
+    if len(rows) > maxTrainSize:
+        sample = np.sort(np.random.default_rng(0).choice(rows, maxTrainSize, replace=False))
+    annIndex.train(store.vectors[sample])
+    addLiveRows(annIndex, store, rows, chunkSize)
+    return annIndex
+
+
+def reindexAnnIndex(annIndex, store, chunkSize=65536):
+    """
+    Fills a fresh copy of an already-trained index with the live rows of a store, without
+    retraining it; used when compaction renumbers rows but the corpus has not grown enough
+    to be worth another k-means run.
+
+    Parameters:
+       annIndex (AnnIndex): The trained index to copy.
+       store (TopicStore): The store whose live rows are added.
+       chunkSize (int): Number of vectors copied out of the store per add. Default is 65536.
+
+    Returns:
+       AnnIndex: The refilled index, still reporting the size it was trained for.
+    """
+    copy = annIndex.emptyCopy()
+    addLiveRows(copy, store, np.flatnonzero(store.alive[:store.size]), chunkSize)
+    return copy
+
+
+def addLiveRows(annIndex, store, rows, chunkSize):
+    for start in range(0, len(rows), chunkSize):
+        chunk = rows[start:start + chunkSize]
+        annIndex.add(store.vectors[chunk], chunk)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from langchain.llms.fake import FakeListLLM
+
+from matching import TopicMatcher
+from topic_store import TopicStore
+from vector_index import buildAnnIndex, minTrainSize
+
+
+DIM = 16
+
+
+def makeStore(numTopics, numUsers=10, seed=0):
+    rng = np.random.default_rng(seed)
+    store = TopicStore(DIM)
+    store.add([(i, f"user-{i % numUsers}", f"topic {i}") for i in range(numTopics)],
+              rng.standard_normal((numTopics, DIM)).astype('float32'))
+    return store, rng.standard_normal((8, DIM)).astype('float32')
+
+
+@pytest.mark.parametrize('indexType', ['ivf-flat', 'hnsw'])
+def test_masked_out_rows_never_appear(indexType):
+    store, queries = makeStore(2000)
+    for topicID in range(0, 2000, 7):
+        store.remove(topicID)
+    index = buildAnnIndex(store, indexType)
+    assert index is not None and index.trainedSize == len(store)
+
+    for excludeUserID in ('user-0', 'user-3'):
+        valid = store.eligibleRows(excludeUserID, excludeTopicIDs=set(range(1, 2000, 5)))
+        D, I = index.search(queries, 20, valid)
+        assert (I >= 0).all() and valid[I].all()
+        assert store.users.index(excludeUserID) not in store.userCodes[I]
+
+        # the filtered approximate search mostly agrees with the exact one
+        _, exact = store.search(queries, 20, valid)
+        recall = np.mean([len(set(a) & set(b)) / 20 for a, b in zip(I, exact)])
+        assert recall >= 0.8
+
+    # a mask that leaves fewer than n rows returns only those, padded with -1
+    valid = np.zeros(store.size, dtype=bool)
+    valid[[5, 8, 9]] = True
+    _, I = index.search(queries[:1], 10, valid)
+    found = I[0][I[0] >= 0]
+    assert set(found) <= {5, 8, 9} and (I[0][len(found):] == -1).all()
+
+
+def test_no_index_below_min_train_size():
+    store, _ = makeStore(500)
+    assert 500 < minTrainSize('ivf-flat', 500)
+    assert buildAnnIndex(store, 'ivf-flat') is None
+    assert buildAnnIndex(store, 'flat') is None
+    assert buildAnnIndex(store, 'hnsw') is not None # HNSW needs no training
+
+
+@pytest.mark.parametrize('indexType', ['ivf-flat', 'hnsw'])
+def test_matcher_searches_exactly_until_it_retrains(indexType):
+    store, queries = makeStore(4000)
+    matcher = TopicMatcher(FakeListLLM(responses=["alternate"]), indexType=indexType,
+                           minIndexSize=1000, retrainGrowth=2)
+    # IVF list counts grow with the corpus, so find the first size that can train them
+    threshold = next(n for n in range(1000, 4000) if n >= minTrainSize(indexType, n))
+
+    matcher.addEmbeddings([store.info(row) for row in range(threshold - 1)], store.vectors[:threshold - 1])
+    assert not matcher.needsRetraining()
+    matcher.compact()
+    assert matcher.index is None
+
+    # below the training size, searches fall back to the exact scan over the store
+    results = matcher.searchIndexWithQuery(queries[:1], 'user-1', 5)
+    _, exact = matcher.store.search(queries[:1], 5, matcher.store.eligibleRows('user-1'))
+    assert [result['topicID'] for result in results] == [int(matcher.store.topicIDs[row]) for row in exact[0]]
+
+    matcher.addEmbeddings([store.info(threshold - 1)], store.vectors[threshold - 1:threshold])
+    assert matcher.needsRetraining()
+    matcher.compact()
+    assert matcher.index is not None and not matcher.needsRetraining()
+    assert all(result['userID'] != 'user-1' for result in matcher.searchIndexWithQuery(queries[:1], 'user-1', 5))
+
+    # the index is retrained once the corpus has grown by retrainGrowth
+    trainedSize = matcher.index.trainedSize
+    rows = list(range(threshold, 2 * trainedSize - 1))
+    matcher.addEmbeddings([store.info(row) for row in rows], store.vectors[rows])
+    assert not matcher.needsRetraining()
+    matcher.addEmbeddings([store.info(2 * trainedSize - 1)], store.vectors[2 * trainedSize - 1:2 * trainedSize])
+    assert matcher.needsRetraining()
+    matcher.compact()
+    assert matcher.index.trainedSize == 2 * trainedSize and not matcher.needsRetraining()
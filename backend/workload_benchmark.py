@@ -0,0 +1,290 @@
+"""
+Measures the whole service under a realistic mix of traffic.
+
+Each server mode runs in `serve.py` with its own temporary data directory. The data
+directory is first filled from a conversations file with init_database.py. The server
+talks to a local stub of the OpenAI API, which answers embeddings after --embedding-ms
+and completions after --completion-ms, and then streams one token every --token-ms.
+Every client is a user with a topic, a chat and a Socket.IO connection. Clients run
+closed loops for --seconds after a warm-up, each time picking one of these operations:
+
+    message         emit 'new-message' and wait for the chat's broadcast of it
+    bot-response    GET /bot-response?stream=1, matching a query against the corpus
+    topic-create    POST /user-topics/<userID>, which embeds and indexes the topic
+    history         GET /chats/<chatID>, the newest page of the chat
+
+Each streamed /bot-response is also timed until the icebreaker's 'segway-done' event
+arrives, and reported as 'segway'. For every operation this prints throughput and
+p50/p95/p99 latency, and saves them to a JSON file keyed by the current commit. Pass
+an earlier file to --compare to see how the latencies moved.
+
+Mixes are named (see MIXES) or given as weights, e.g. --mix message=70,history=30.
+
+Usage:
+    python workload_benchmark.py --clients 16 --seconds 30 --mix balanced
+    python workload_benchmark.py --modes threading gevent --embedding-ms 100 --completion-ms 400
+    python workload_benchmark.py --compare data/benchmarks/workload-1a2b3c4.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+import requests
+import socketio
+
+from embedding_benchmark import startStubServer
+from load_benchmark import CONFIGURATIONS, freePort, startServer, stopServer
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MIXES = {
+    'balanced': {'message': 50, 'bot-response': 15, 'topic-create': 5, 'history': 30},
+    'chat': {'message': 80, 'bot-response': 2, 'topic-create': 3, 'history': 15},
+    'matching': {'message': 20, 'bot-response': 60, 'topic-create': 10, 'history': 10},
+}
+
+QUERY_WORDS = ["learning", "jazz", "piano", "marathon", "training", "sourdough", "baking", "chess", "startup",
+               "travel", "japan", "parenting", "gardening", "poetry", "career", "change", "physics", "history"]
+
+
+def parseMix(spec):
+    """
+    Returns the operation weights for a named mix, or for a spec like 'message=70,history=30'.
+    """
+    if spec in MIXES:
+        return MIXES[spec]
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name not in MIXES['balanced']:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}; choose from {', '.join(MIXES['balanced'])}")
+        mix[name] = float(weight)
+    return mix
+
+
+def seedCorpus(dataDir, corpusPath, stubURL):
+    # the server boots from the loader's snapshot, so the corpus is never embedded under load
+    env = dict(os.environ, CHATMOS_DATA_DIR=dataDir, CHATMOS_EMBEDDING_PROVIDER='openai',
+               OPENAI_API_BASE=stubURL, OPENAI_API_KEY='stub')
+    with open(os.path.join(dataDir, 'init_database.log'), 'w') as log:
+        subprocess.run([sys.executable, 'init_database.py', os.path.abspath(corpusPath), '--batch-size', '100'],
+                       cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+
+
+class VirtualUser:
+    """
+    One simulated user: a topic, a chat with a partner, and a Socket.IO connection joined to both rooms.
+
+    Attributes:
+        baseURL (str): The server under test.
+        rng (random.Random): Picks operations and query words, seeded per client.
+        timeout (float): Seconds to wait for a response or event before counting an error.
+    """
+
+    def __init__(self, baseURL, clientNumber, timeout=30):
+        self.baseURL = baseURL
+        self.rng = random.Random(clientNumber)
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.clientNumber = clientNumber
+        self.numSent = 0
+
+        self.userID, partnerID = [self.session.post(f"{baseURL}/create-user").json()['uuid'] for _ in range(2)]
+        topicIDs = [self.session.post(f"{baseURL}/user-topics/{userID}", json={'title': self.query()}).json()['id']
+                    for userID in (self.userID, partnerID)]
+        self.chatID = self.session.post(f"{baseURL}/create-chat", json={
+            'creatorTopicID': topicIDs[0], 'matchedTopicID': topicIDs[1],
+            'userCreatorID': self.userID, 'userMatchedID': partnerID}).json()['chatID']
+
+        # broadcasts and icebreakers can arrive before the request that caused them returns
+        self.condition = threading.Condition()
+        self.delivered = {}
+        self.client = socketio.Client()
+        self.client.on('message', lambda data: self.arrived(data.get('text')))
+        self.client.on('segway-done', lambda data: self.arrived(data.get('requestID')))
+        self.client.connect(baseURL)
+        self.client.emit('user-join', {'userID': self.userID, 'room': self.userID})
+        self.client.emit('chat-join', {'userID': self.userID, 'room': self.chatID})
+        time.sleep(0.5)
+        # the chat's history is a 404 until its first message, which also shows the socket has joined
+        self.run('message')
+
+    def arrived(self, key):
+        with self.condition:
+            self.delivered[key] = time.perf_counter()
+            self.condition.notify_all()
+
+    def waitFor(self, key):
+        with self.condition:
+            if not self.condition.wait_for(lambda: key in self.delivered, self.timeout):
+                raise TimeoutError(f"{key} was not delivered")
+            return self.delivered.pop(key)
+
+    def query(self):
+        return ' '.join(self.rng.sample(QUERY_WORDS, self.rng.randint(2, 4)))
+
+    def run(self, operation):
+        """
+        Performs one operation and returns the latency, in seconds, of each timed step.
+        """
+        start = time.perf_counter()
+        if operation == 'message':
+            text = f"client {self.clientNumber} message {self.numSent}"
+            self.numSent += 1
+            self.client.emit('new-message', {'chatID': self.chatID, 'senderID': self.userID, 'text': text, 'topicInfo': None})
+            return {'message': self.waitFor(text) - start}
+
+        if operation == 'bot-response':
+            response = self.session.get(f"{self.baseURL}/bot-response", timeout=self.timeout,
+                                        params={'topic': self.query(), 'userID': self.userID, 'stream': 1})
+            response.raise_for_status()
+            latencies = {'bot-response': time.perf_counter() - start}
+            requestID = response.json().get('requestID')
+            if requestID:
+                latencies['segway'] = self.waitFor(requestID) - start
+            return latencies
+
+        if operation == 'topic-create':
+            response = self.session.post(f"{self.baseURL}/user-topics/{self.userID}", json={'title': self.query()},
+                                         timeout=self.timeout)
+        else:
+            response = self.session.get(f"{self.baseURL}/chats/{self.chatID}", timeout=self.timeout)
+        response.raise_for_status()
+        return {operation: time.perf_counter() - start}
+
+    def close(self):
+        self.client.disconnect()
+
+
+def drive(users, mix, warmup, seconds, thinkTime):
+    """
+    Runs every user in its own closed loop, and returns each operation's latencies and errors after the warm-up.
+    """
+    operations, weights = zip(*mix.items())
+    latencies = {}
+    errors = {}
+    lock = threading.Lock()
+    measureFrom = time.perf_counter() + warmup
+    stopAt = measureFrom + seconds
+
+    def loop(user):
+        while time.perf_counter() < stopAt:
+            operation = user.rng.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                timed = user.run(operation)
+            except Exception as e:
+                timed, error = None, f"{type(e).__name__}: {e}"
+            if started >= measureFrom:
+                with lock:
+                    if timed is None:
+                        errors.setdefault(operation, []).append(error)
+                    for name, latency in (timed or {}).items():
+                        latencies.setdefault(name, []).append(latency)
+            time.sleep(thinkTime)
+
+    threads = [threading.Thread(target=loop, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def summarize(latencies, errors, seconds):
+    results = {}
+    for operation in sorted(set(latencies) | set(errors)):
+        samples = latencies.get(operation, [])
+        p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000 if samples else (float('nan'),) * 3
+        results[operation] = {'count': len(samples), 'errors': len(errors.get(operation, [])),
+                              'throughput': len(samples) / seconds, 'p50': p50, 'p95': p95, 'p99': p99}
+        if operation in errors:
+            results[operation]['firstError'] = errors[operation][0]
+    return results
+
+
+def currentCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def printResults(mode, results, baseline=None):
+    header = f"{'operation':>14} {'ops/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    print(mode)
+    print(header + (f" {'p50 vs base':>12} {'p99 vs base':>12}" if baseline else ""))
+    for operation, result in results.items():
+        line = (f"{operation:>14} {result['throughput']:>8.1f} {result['p50']:>9.1f} {result['p95']:>9.1f} "
+                f"{result['p99']:>9.1f} {result['errors']:>7}")
+        before = (baseline or {}).get(operation)
+        if before:
+            line += ''.join(f" {100 * (result[key] / before[key] - 1):>+11.1f}%" for key in ('p50', 'p99'))
+        print(line)
+        if 'firstError' in result:
+            print(f"{'':>14} first error: {result['firstError']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modes', nargs='+', default=['threading'], choices=[name for name in CONFIGURATIONS if name != 'gevent-inline'])
+    parser.add_argument('--mix', type=parseMix, default='balanced', help=f"one of {', '.join(MIXES)}, or op=weight,...")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent simulated users")
+    parser.add_argument('--seconds', type=float, default=20, help="measured time per mode")
+    parser.add_argument('--warmup', type=float, default=3, help="unmeasured time before each measurement")
+    parser.add_argument('--think-ms', type=float, default=50, help="pause between a client's operations")
+    parser.add_argument('--embedding-ms', type=float, default=50, help="stub embeddings latency")
+    parser.add_argument('--completion-ms', type=float, default=300, help="stub completion latency before the first token")
+    parser.add_argument('--token-ms', type=float, default=20, help="stub delay between streamed tokens")
+    parser.add_argument('--pool-size', type=int, default=16, help="blocking pool size in gevent mode")
+    parser.add_argument('--corpus', default='data/mock_convs_full.json', help="conversations loaded before each run")
+    parser.add_argument('--output', help="where to save the results (default: data/benchmarks/workload-<commit>.json)")
+    parser.add_argument('--compare', help="an earlier results file to compare against")
+    args = parser.parse_args()
+
+    commit = currentCommit()
+    output = args.output or os.path.join(BASE_DIR, 'data', 'benchmarks', f"workload-{commit}.json")
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Comparing against {baseline['commit']} ({args.compare})")
+
+    stub = startStubServer(args.embedding_ms / 1000, 1536, args.completion_ms / 1000, args.token_ms / 1000)
+    stubURL = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+    print(f"{args.clients} clients, mix {args.mix}, stub latencies: embedding {args.embedding_ms:g} ms, "
+          f"completion {args.completion_ms:g} ms + {args.token_ms:g} ms/token")
+
+    report = {'commit': commit, 'createdAt': datetime.now(timezone.utc).isoformat(), 'settings': vars(args), 'modes': {}}
+    for mode in args.modes:
+        with tempfile.TemporaryDirectory() as dataDir:
+            seedCorpus(dataDir, args.corpus, stubURL)
+            server, baseURL = startServer(mode, dataDir, freePort(), stubURL, args.pool_size)
+            try:
+                users = [VirtualUser(baseURL, n) for n in range(args.clients)]
+                latencies, errors = drive(users, args.mix, args.warmup, args.seconds, args.think_ms / 1000)
+                for user in users:
+                    user.close()
+            finally:
+                stopServer(server)
+        report['modes'][mode] = summarize(latencies, errors, args.seconds)
+        printResults(mode, report['modes'][mode], (baseline or {}).get('modes', {}).get(mode))
+    stub.shutdown()
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,9 @@ const axiosInstance = axios.create({
   baseURL: 'http://localhost:5000', // This is the default port for Flask apps
 });
 
+// Messages per /chats/<id> request; the server returns the newest page unless asked for older ones
+const CHAT_PAGE_SIZE = 100;
+
 class ApiManager {
   static findParentTopic = (topics, chatID) => {
     for (let topicName in topics) {
@@ -218,53 +221,64 @@ class ApiManager {
     }
   }
 
+  // Fetch a chat's whole history, oldest first, walking back one page at a time with before=
+  static async fetchChatHistory(chatID) {
+    let history = [];
+    let before = null;
+    while (true) {
+      const params = before === null ? { limit: CHAT_PAGE_SIZE } : { limit: CHAT_PAGE_SIZE, before };
+      const page = (await axiosInstance.get(`/chats/${chatID}`, { params })).data;
+      history = [...page, ...history];
+      if (page.length < CHAT_PAGE_SIZE || page[0].messageNumber === 0) {
+        return history;
+      }
+      before = page[0].messageNumber;
+    }
+  }
+
   // Load messages when a user clicks on a chat
   static async loadChatMessages(topics, setTopics, chatID) {
     try {
-      const messageResponse = await axiosInstance.get(`/chats/${chatID}`);
-
-      // console.log('Message response:', messageResponse);
-
-      if (messageResponse.status === 200) {
-        // Fetch all match infos
-        const topicInfoPromises = messageResponse.data.map(async message => {
-          if (message.topicID) {
-            const topicResponse = await axiosInstance.get(`/topics/${message.topicID}`);
-            if (topicResponse.status === 200) {
-              console.log(topicResponse);
-              return {
-                topicName: topicResponse.data.title,
-                topicID: message.topicID,
-                userID: topicResponse.data.userID
-              };
-            } else {
-              console.error('Failed to load matched topic:', topicResponse);
-            }
+      const history = await ApiManager.fetchChatHistory(chatID);
+
+      // Fetch all match infos
+      const topicInfoPromises = history.map(async message => {
+        if (message.topicID) {
+          const topicResponse = await axiosInstance.get(`/topics/${message.topicID}`);
+          if (topicResponse.status === 200) {
+            console.log(topicResponse);
+            return {
+              topicName: topicResponse.data.title,
+              topicID: message.topicID,
+              userID: topicResponse.data.userID
+            };
+          } else {
+            console.error('Failed to load matched topic:', topicResponse);
           }
-          return null;
-        });
+        }
+        return null;
+      });
 
-        const topicInfos = await Promise.all(topicInfoPromises);
+      const topicInfos = await Promise.all(topicInfoPromises);
 
-        // Update messages with match info
-        const messages = messageResponse.data.map((message, i) => {
-          return {
-            ...message,
-            topicInfo: topicInfos[i],
-          };
-        });
+      // Update messages with match info
+      const messages = history.map((message, i) => {
+        return {
+          ...message,
+          topicInfo: topicInfos[i],
+        };
+      });
 
-        // TODO: refactor findParentTopic out of ApiManager since its not async
-        const topicID = ApiManager.findParentTopic(topics, chatID);
-        
-        console.log('parent topic', topicID);
+      // TODO: refactor findParentTopic out of ApiManager since its not async
+      const topicID = ApiManager.findParentTopic(topics, chatID);
+      
+      console.log('parent topic', topicID);
 
-        setTopics(prevTopics => {
-          const updatedTopics = {...prevTopics};
-          updatedTopics[topicID].chats[chatID].messages = messages;
-          return updatedTopics;
-        });
-      }
+      setTopics(prevTopics => {
+        const updatedTopics = {...prevTopics};
+        updatedTopics[topicID].chats[chatID].messages = messages;
+        return updatedTopics;
+      });
     } catch (error) {
       console.error('Failed to load messages for the chat:', error);
     }
@@ -64,10 +64,12 @@ function App() {
     const brainstormChat = topics[brainstormTopicID.current].chats[brainstormChatID.current];
     let userTopicInfo = null;
 
-    // Retrieve the nearest user message above this messageID to use as the topic name
-    for (let j = messageNumber - 1; j >= 0; j--) {
-      if (brainstormChat.messages[j].senderID === userID) {
-        userTopicInfo = brainstormChat.messages[j].topicInfo;
+    // Retrieve the nearest user message above this messageNumber to use as the topic name;
+    // messages are kept oldest first, but their positions need not match their numbers
+    const messages = brainstormChat.messages;
+    for (let j = messages.length - 1; j >= 0; j--) {
+      if (messages[j].messageNumber < messageNumber && messages[j].senderID === userID) {
+        userTopicInfo = messages[j].topicInfo;
         break;
       }
     }